@@ -0,0 +1,79 @@
+import sys
+import os
+import time
+import argparse
+import datetime
+import statistics
+import tempfile
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+import generate_data
+from daily_aggregator import lese_rohdaten
+
+
+# Vergleicht den Einlesepfad von daily_aggregator.py für CSV und Parquet:
+# gleiche Daten (fester Seed), gemessen wird Lesen + Parsen bis zu einer Aggregation über alle Spalten.
+
+def erzeuge_eingaben(arbeitsverzeichnis: str, maschine: str, tag: datetime.date, seed: int) -> dict:
+    generate_data.DATA_DIR = arbeitsverzeichnis
+    csv_pfad, anzahl = generate_data.simuliere_maschinentag(maschine, tag, seed, "csv")
+    generate_data.simuliere_maschinentag(maschine, tag, seed, "parquet")
+    parquet_pfad = os.path.join(arbeitsverzeichnis, generate_data.PARQUET_DATASET)
+    print(f"{anzahl} Datenzeilen erzeugt: CSV {os.path.getsize(csv_pfad) / 1e6:.1f} MB, "
+          f"Parquet {verzeichnis_groesse(parquet_pfad) / 1e6:.1f} MB")
+    return {"csv": csv_pfad, "parquet": parquet_pfad}
+
+
+def verzeichnis_groesse(pfad: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, dateien in os.walk(pfad) for f in dateien)
+
+
+def miss_einlesen(spark: SparkSession, input_pfad: str, tag: datetime.date) -> float:
+    start = time.perf_counter()
+    lese_rohdaten(spark, input_pfad, tag).agg(
+        F.count("*"), F.sum("value"), F.max("event_timestamp"),
+        F.max(F.length("event_name")), F.max(F.length("parameter_name")), F.countDistinct("machine_id")
+    ).collect()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: CSV- gegen Parquet-Eingabe in daily_aggregator.py")
+    parser.add_argument("--maschine", default="DieBonder_01")
+    parser.add_argument("--datum", type=generate_data.parse_datum, default=datetime.date(2024, 10, 16))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--wiederholungen", type=int, default=5)
+    parser.add_argument("--master", default="local[*]")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_eingabeformat_") as arbeitsverzeichnis:
+        eingaben = erzeuge_eingaben(arbeitsverzeichnis, args.maschine, args.datum, args.seed)
+
+        spark = SparkSession.builder \
+            .master(args.master) \
+            .appName("Benchmark_Eingabeformat") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.ui.showConsoleProgress", "false") \
+            .getOrCreate()
+        spark.sparkContext.setLogLevel("ERROR")
+
+        ergebnisse = {}
+        for format_name, input_pfad in eingaben.items():
+            miss_einlesen(spark, input_pfad, args.datum)  # Aufwärmen (JIT, Datei-Cache)
+            ergebnisse[format_name] = [miss_einlesen(spark, input_pfad, args.datum) for _ in range(args.wiederholungen)]
+        spark.stop()
+
+    print(f"{'Format':<10}{'Median (s)':>12}{'Min (s)':>10}")
+    for format_name, zeiten in ergebnisse.items():
+        print(f"{format_name:<10}{statistics.median(zeiten):>12.2f}{min(zeiten):>10.2f}")
+    print(f"Faktor CSV/Parquet (Median): {statistics.median(ergebnisse['csv']) / statistics.median(ergebnisse['parquet']):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
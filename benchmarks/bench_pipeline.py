@@ -0,0 +1,250 @@
+import sys
+import os
+import glob
+import json
+import time
+import argparse
+import datetime
+import platform
+import threading
+import subprocess
+import functools
+
+import psycopg2
+import pyarrow.parquet as pq
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+import generate_data
+
+INIT_DB_PFAD = os.path.join(REPO_DIR, "src", "init_db.sql")
+VERLAUF_PFAD = os.path.join(REPO_DIR, "benchmarks", "ergebnisse", "pipeline_verlauf.json")
+SPEICHER_INTERVALL_S = 0.5
+
+
+# End-to-End-Benchmark von daily_aggregator.py: erzeugt mit festem Seed N Maschinen x T Tage, setzt eine eigene
+# Benchmark-Datenbank zurück und verarbeitet die Tage nacheinander wie im nächtlichen Betrieb (je Tag ein spark-submit),
+# einmal je Kernanzahl (local[N]). Gemessen werden Durchsatz (Events/s), Spitzen-Speicher des Prozessbaums und die
+# Schrittzeiten aus pipeline_run_metrics. Jeder Durchlauf wird an einen JSON-Verlauf angehängt und mit dem letzten
+# Durchlauf gleicher Konfiguration (bzw. einem gewählten Commit) verglichen.
+
+def lauf_modus(eingabe: str, datum: datetime.date):
+    # Wird per spark-submit aufgerufen: daily_aggregator mit den Pfaden dieses Repos statt /app und /data/raw
+    import daily_aggregator
+    import kennzahlen
+    daily_aggregator.INPUT_DATA_PFAD_TEMPLATE = os.path.join(os.path.dirname(eingabe), "{}")
+    daily_aggregator.SCHWELLWERTE_PFAD = os.path.join(REPO_DIR, "config", "schwellwerte.json")
+    daily_aggregator.lade_kennzahlen = functools.partial(kennzahlen.lade_kennzahlen, os.path.join(REPO_DIR, "config", "kennzahlen.json"))
+    daily_aggregator.main([os.path.basename(eingabe)], datum)
+
+
+def erzeuge_daten(verzeichnis: str, maschinen: list, tage: list, seed: int) -> int:
+    # Der Seed legt jeden Maschinentag fest (generate_data.erzeuge_rng): vorhandene Partitionen werden wiederverwendet
+    # (gleicher Seed vorausgesetzt; bei anderem Seed ein anderes Verzeichnis wählen)
+    generate_data.DATA_DIR = verzeichnis
+    anzahl = 0
+    for maschine in maschinen:
+        for tag in tage:
+            datei = os.path.join(verzeichnis, generate_data.PARQUET_DATASET, f"machine_id={maschine}", f"date={tag}", "part-0.parquet")
+            if not os.path.exists(datei):
+                generate_data.simuliere_maschinentag(maschine, tag, seed, "parquet")
+            anzahl += pq.ParquetFile(datei).metadata.num_rows
+    return anzahl
+
+
+def setze_datenbank_zurueck(pg_params: dict):
+    # Nur die Benchmark-Datenbank: wird bei Bedarf angelegt und vor jeder Kernanzahl neu initialisiert
+    admin = psycopg2.connect(**{**pg_params, "dbname": "postgres"})
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (pg_params["dbname"],))
+            if not cur.fetchone():
+                cur.execute(f'CREATE DATABASE "{pg_params["dbname"]}"')
+    finally:
+        admin.close()
+    conn = psycopg2.connect(**pg_params)
+    try:
+        with conn.cursor() as cur, open(INIT_DB_PFAD, encoding="utf-8") as f:
+            cur.execute(f.read())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def baum_rss(pid: int) -> int:
+    # Summe des Arbeitsspeichers eines Prozesses und aller Nachfahren (JVM, Python-Driver, Python-Worker); nur Linux
+    kinder = {}
+    for eintrag in os.listdir("/proc"):
+        if eintrag.isdigit():
+            try:
+                with open(f"/proc/{eintrag}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                kinder.setdefault(ppid, []).append(int(eintrag))
+            except (OSError, ValueError, IndexError):
+                continue
+    summe, offen = 0, [pid]
+    while offen:
+        aktuell = offen.pop()
+        try:
+            with open(f"/proc/{aktuell}/statm") as f:
+                summe += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+        offen.extend(kinder.get(aktuell, []))
+    return summe
+
+
+def fuehre_tag_aus(args, kerne: int, eingabe: str, tag: datetime.date, umgebung: dict) -> tuple[float, int]:
+    befehl = [
+        "spark-submit", "--master", f"local[{kerne}]", "--driver-memory", args.driver_speicher,
+        "--conf", "spark.ui.showConsoleProgress=false"
+    ]
+    jars = glob.glob(os.path.join(REPO_DIR, "drivers", "postgresql-*.jar"))
+    if jars:
+        befehl += ["--jars", jars[0]]
+    befehl += [os.path.abspath(__file__), "--lauf", eingabe, tag.isoformat()]
+
+    spitze = [0]
+    start = time.perf_counter()
+    with open(args.log, "a", encoding="utf-8") as log:
+        prozess = subprocess.Popen(befehl, env=umgebung, stdout=log, stderr=subprocess.STDOUT)
+
+        def beobachte():
+            while prozess.poll() is None:
+                spitze[0] = max(spitze[0], baum_rss(prozess.pid))
+                time.sleep(SPEICHER_INTERVALL_S)
+        beobachter = threading.Thread(target=beobachte, daemon=True)
+        if os.path.isdir("/proc"):
+            beobachter.start()
+        prozess.wait()
+    dauer = time.perf_counter() - start
+    if prozess.returncode != 0:
+        raise RuntimeError(f"daily_aggregator für {tag} mit local[{kerne}] fehlgeschlagen, siehe '{args.log}'.")
+    return dauer, spitze[0]
+
+
+def schritt_zeiten(pg_params: dict) -> dict:
+    conn = psycopg2.connect(**pg_params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT step_name, sum(wall_seconds) FROM pipeline_run_metrics GROUP BY step_name ORDER BY min(step_order)")
+            return {schritt: float(sekunden) for schritt, sekunden in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lade_verlauf(pfad: str) -> list:
+    if not os.path.exists(pfad):
+        return []
+    with open(pfad, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def finde_baseline(verlauf: list, konfiguration: dict, commit: str = None) -> dict:
+    kandidaten = [
+        eintrag for eintrag in verlauf
+        if eintrag["konfiguration"] == konfiguration and (commit is None or (eintrag["commit"] or "").startswith(commit))
+    ]
+    return kandidaten[-1] if kandidaten else None
+
+
+def vergleiche(ergebnis: dict, baseline: dict):
+    print(f"\nVergleich mit {baseline['zeitpunkt']} (Commit {baseline['commit']}):")
+    vorher = {lauf["kerne"]: lauf for lauf in baseline["laeufe"]}
+    for lauf in ergebnis["laeufe"]:
+        alt = vorher.get(lauf["kerne"])
+        if not alt:
+            continue
+        print(f"  local[{lauf['kerne']}]: {lauf['events_pro_s']:,.0f} Events/s ({lauf['events_pro_s'] / alt['events_pro_s'] - 1:+.1%})")
+        for schritt, sekunden in lauf["schritte"].items():
+            if alt["schritte"].get(schritt):
+                print(f"    {schritt:<20}{sekunden:>9.1f} s ({sekunden / alt['schritte'][schritt] - 1:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-End-Benchmark: daily_aggregator.py über N Maschinen x T Tage und mehrere Kernanzahlen")
+    parser.add_argument("--maschinen", type=int, default=1, help="Anzahl Maschinen (DieBonder_01, DieBonder_02, ...)")
+    parser.add_argument("--tage", type=int, default=1, help="Anzahl aufeinanderfolgender Tage")
+    parser.add_argument("--startdatum", type=generate_data.parse_datum, default=datetime.date(2024, 10, 16))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--kerne", default="1,2,4", help="Kommagetrennte Kernanzahlen für local[N]")
+    parser.add_argument("--driver-speicher", default="4g")
+    parser.add_argument("--daten", default=None, help="Verzeichnis der erzeugten Daten (wird wiederverwendet), "
+                                                       "Standard: benchmarks/daten/seed_<SEED>")
+    parser.add_argument("--db-name", default="manufacturing_bench",
+                        help="Eigene Datenbank für den Benchmark; wird vor jeder Kernanzahl neu initialisiert")
+    parser.add_argument("--verlauf", default=VERLAUF_PFAD, help="JSON-Verlauf der Ergebnisse")
+    parser.add_argument("--baseline", default=None, help="Commit (Präfix) zum Vergleich; Standard: letzter Eintrag gleicher Konfiguration")
+    parser.add_argument("--log", default=os.path.join(REPO_DIR, "benchmarks", "bench_pipeline.log"))
+    parser.add_argument("--lauf", nargs=2, metavar=("EINGABE", "DATUM"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.lauf:
+        lauf_modus(args.lauf[0], datetime.date.fromisoformat(args.lauf[1]))
+        return
+
+    for variable in ("DB_HOST", "DB_USER", "DB_PASS"):
+        if not os.environ.get(variable):
+            parser.error(f"Umgebungsvariable {variable} muss gesetzt sein (Zugang zur lokalen PostgreSQL).")
+    if args.db_name == "manufacturing_db":
+        parser.error("Die Produktionsdatenbank wird zurückgesetzt und ist als Benchmark-Datenbank nicht erlaubt.")
+    umgebung = {**os.environ, "DB_NAME": args.db_name}
+    pg_params = {
+        "host": os.environ["DB_HOST"], "dbname": args.db_name, "user": os.environ["DB_USER"],
+        "password": os.environ["DB_PASS"], "port": 5432
+    }
+
+    maschinen = [f"DieBonder_{nummer:02d}" for nummer in range(1, args.maschinen + 1)]
+    tage = [args.startdatum + datetime.timedelta(days=i) for i in range(args.tage)]
+    start = time.perf_counter()
+    args.daten = args.daten or os.path.join(REPO_DIR, "benchmarks", "daten", f"seed_{args.seed}")
+    events = erzeuge_daten(args.daten, maschinen, tage, args.seed)
+    print(f"{len(maschinen)} Maschine(n) x {len(tage)} Tag(e): {events} Events ({time.perf_counter() - start:.0f} s Erzeugung/Prüfung)")
+    eingabe = os.path.join(args.daten, generate_data.PARQUET_DATASET)
+
+    konfiguration = {"maschinen": args.maschinen, "tage": args.tage, "startdatum": args.startdatum.isoformat(), "seed": args.seed}
+    ergebnis = {
+        "zeitpunkt": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(), "rechner": platform.node(), "cpu_kerne": os.cpu_count(),
+        "konfiguration": konfiguration, "events": events, "laeufe": []
+    }
+    for kerne in [int(k) for k in args.kerne.split(",")]:
+        setze_datenbank_zurueck(pg_params)
+        dauer, spitze = 0.0, 0
+        for tag in tage:
+            tag_dauer, tag_spitze = fuehre_tag_aus(args, kerne, eingabe, tag, umgebung)
+            dauer += tag_dauer
+            spitze = max(spitze, tag_spitze)
+            print(f"  local[{kerne}] {tag}: {tag_dauer:.1f} s")
+        lauf = {
+            "kerne": kerne, "dauer_s": round(dauer, 2), "events_pro_s": round(events / dauer, 1),
+            "spitze_speicher_mb": round(spitze / 1024 / 1024, 1) if spitze else None,
+            "schritte": {schritt: round(sekunden, 2) for schritt, sekunden in schritt_zeiten(pg_params).items()}
+        }
+        ergebnis["laeufe"].append(lauf)
+        print(f"local[{kerne}]: {dauer:.1f} s, {lauf['events_pro_s']:,.0f} Events/s, Spitze {lauf['spitze_speicher_mb']} MB")
+
+    verlauf = lade_verlauf(args.verlauf)
+    baseline = finde_baseline(verlauf, konfiguration, args.baseline)
+    if baseline:
+        vergleiche(ergebnis, baseline)
+    elif args.baseline:
+        print(f"Kein Eintrag für Commit '{args.baseline}' mit dieser Konfiguration im Verlauf.")
+    os.makedirs(os.path.dirname(os.path.abspath(args.verlauf)), exist_ok=True)
+    with open(args.verlauf, "w", encoding="utf-8") as f:
+        json.dump(verlauf + [ergebnis], f, indent=2, ensure_ascii=False)
+    print(f"Ergebnis an '{args.verlauf}' angehängt ({len(verlauf) + 1} Einträge).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import sys
+import os
+import time
+import json
+import argparse
+import datetime
+import statistics
+import tempfile
+import urllib.request
+
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import DateType
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+import generate_data
+from daily_aggregator import lese_rohdaten, berechne_zyklen, finde_fehler_basierend_auf_schwellwerten, CYCLE_START_EVENT
+from kennzahlen import lade_kennzahlen, summary_spalten, berechne_stunden_zusammenfassung
+
+SCHWELLWERTE_PFAD = os.path.join(REPO_DIR, "config", "schwellwerte.json")
+KENNZAHLEN_PFAD = os.path.join(REPO_DIR, "config", "kennzahlen.json")
+
+
+# Vorher/Nachher-Vergleich der Stunden-Zusammenfassung: bisheriger Ablauf (groupBy mit countDistinct über die Zyklen,
+# groupBy mit 13 F.when-Ausdrücken über die Events, Outer Join) gegen das eine groupBy in berechne_stunden_zusammenfassung().
+# Gemessen werden Laufzeit und geschriebene Shuffle-Bytes; die Ergebnisse müssen identisch sein.
+
+def bisherige_zusammenfassung(events_mit_zyklus_df: DataFrame, zyklus_zeiten_df: DataFrame) -> DataFrame:
+    ist = lambda event_name, parameter_name: (F.col("event_name") == event_name) & (F.col("parameter_name") == parameter_name)
+    zyklus_summary_df = zyklus_zeiten_df \
+        .withColumn("summary_date", F.date_format(F.col("cycle_start_ts"), "yyyy-MM-dd").cast(DateType())) \
+        .withColumn("hour_of_day", F.hour(F.col("cycle_start_ts"))) \
+        .filter(F.col("summary_date").isNotNull()) \
+        .groupBy("summary_date", "hour_of_day", "machine_id") \
+        .agg(
+            F.countDistinct("cycle_seq").alias("cycle_count"),
+            F.avg("cycle_time_seconds").alias("avg_cycle_time_seconds"),
+            F.min("cycle_time_seconds").alias("min_cycle_time_seconds"),
+            F.max("cycle_time_seconds").alias("max_cycle_time_seconds")
+        )
+    event_summary_df = events_mit_zyklus_df \
+        .withColumn("summary_date", F.date_format(F.col("cycle_start_ts"), "yyyy-MM-dd").cast(DateType())) \
+        .withColumn("hour_of_day", F.hour(F.col("cycle_start_ts"))) \
+        .filter(F.col("summary_date").isNotNull()) \
+        .groupBy("summary_date", "hour_of_day", "machine_id") \
+        .agg(
+            F.avg(F.when(ist("Pick_Check", "PP_Force"), F.col("value"))).alias("avg_pick_force"),
+            F.max(F.when(ist("Pick_Check", "PP_Force"), F.col("value"))).alias("max_pick_force"),
+            F.min(F.when(ist("Pick_Check", "PP_Force"), F.col("value"))).alias("min_pick_force"),
+            F.avg(F.when(ist("Place_Check", "PP_Force"), F.col("value"))).alias("avg_place_force"),
+            F.max(F.when(ist("Place_Check", "PP_Force"), F.col("value"))).alias("max_place_force"),
+            F.min(F.when(ist("Place_Check", "PP_Force"), F.col("value"))).alias("min_place_force"),
+            F.sum(F.when(ist("AS_Check", "AS_VacuumUnits") & (F.col("is_error") == 1), 1).otherwise(0)).alias("as_vacuum_error_count"),
+            F.sum(F.when(ist("Pick_Check", "PP_VacuumUnits") & (F.col("is_error") == 1), 1).otherwise(0)).alias("pp_vacuum_error_count"),
+            F.sum(F.when(ist("AS_Blowoff_Check", "AS_VacuumUnits") & (F.col("is_error") == 1), 1).otherwise(0)).alias("as_release_error_count"),
+            F.sum(F.when(ist("Place_Check", "PP_VacuumUnits") & (F.col("is_error") == 1), 1).otherwise(0)).alias("pp_release_error_count"),
+            F.sum(F.when(ist("Pick_Check", "PP_Force") & (F.col("is_error") == 1), 1).otherwise(0)).alias("pick_force_error_count"),
+            F.sum(F.when(ist("Place_Check", "PP_Force") & (F.col("is_error") == 1), 1).otherwise(0)).alias("place_force_error_count"),
+            F.sum("is_error").alias("total_error_count")
+        )
+    zusammenfassung_df = zyklus_summary_df.join(event_summary_df, on=["summary_date", "hour_of_day", "machine_id"], how="outer") \
+        .fillna(0)
+    for spalte in ("min_cycle_time_seconds", "max_cycle_time_seconds", "avg_cycle_time_seconds"):
+        zusammenfassung_df = zusammenfassung_df.withColumn(spalte, F.round(F.col(spalte), 3))
+    for spalte in ("avg_pick_force", "max_pick_force", "min_pick_force", "avg_place_force", "max_place_force", "min_place_force"):
+        zusammenfassung_df = zusammenfassung_df.withColumn(spalte, F.round(F.col(spalte), 2))
+    return zusammenfassung_df
+
+
+def shuffle_bytes(spark: SparkSession) -> int:
+    # Summe der geschriebenen Shuffle-Bytes aller abgeschlossenen Stages (REST-API der Spark-UI)
+    sc = spark.sparkContext
+    sc._jsc.sc().listenerBus().waitUntilEmpty()
+    with urllib.request.urlopen(f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/stages?status=complete") as antwort:
+        return sum(stage["shuffleWriteBytes"] for stage in json.load(antwort))
+
+
+def miss_lauf(spark: SparkSession, zusammenfassung_df: DataFrame) -> tuple[float, int]:
+    bytes_vorher = shuffle_bytes(spark)
+    start = time.perf_counter()
+    zusammenfassung_df.write.format("noop").mode("overwrite").save()
+    dauer = time.perf_counter() - start
+    return dauer, shuffle_bytes(spark) - bytes_vorher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: Stunden-Zusammenfassung mit zwei groupBy + Join gegen ein groupBy")
+    parser.add_argument("--maschinen", default="DieBonder_01", help="Kommagetrennte Maschinen-IDs")
+    parser.add_argument("--datum", type=generate_data.parse_datum, default=datetime.date(2024, 10, 16))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--wiederholungen", type=int, default=3)
+    parser.add_argument("--master", default="local[*]")
+    args = parser.parse_args()
+
+    with open(SCHWELLWERTE_PFAD, 'r', encoding='utf-8') as f:
+        schwellwerte = json.load(f)
+    kennzahlen = lade_kennzahlen(KENNZAHLEN_PFAD)
+
+    with tempfile.TemporaryDirectory(prefix="bench_zusammenfassung_") as arbeitsverzeichnis:
+        generate_data.DATA_DIR = arbeitsverzeichnis
+        for maschine in args.maschinen.split(","):
+            generate_data.simuliere_maschinentag(maschine, args.datum, args.seed, "parquet")
+
+        spark = SparkSession.builder \
+            .master(args.master) \
+            .appName("Benchmark_Zusammenfassung") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.ui.showConsoleProgress", "false") \
+            .getOrCreate()
+        spark.sparkContext.setLogLevel("ERROR")
+
+        # Eingabe beider Varianten: Events mit Fehler-Flag und Zyklen wie in daily_aggregator.main, einmal berechnet
+        basis_events_df = lese_rohdaten(spark, os.path.join(arbeitsverzeichnis, generate_data.PARQUET_DATASET), args.datum)
+        events_mit_zyklus_df, zyklus_zeiten_df = berechne_zyklen(finde_fehler_basierend_auf_schwellwerten(basis_events_df, schwellwerte))
+        events_mit_zyklus_df.persist(StorageLevel.MEMORY_AND_DISK)
+        print(f"{events_mit_zyklus_df.count()} Events, "
+              f"{events_mit_zyklus_df.filter(F.col('event_name') == CYCLE_START_EVENT).count()} Zyklen vorbereitet.")
+
+        varianten = {
+            "bisher": bisherige_zusammenfassung(events_mit_zyklus_df, zyklus_zeiten_df),
+            "ein groupBy": berechne_stunden_zusammenfassung(events_mit_zyklus_df, kennzahlen)
+        }
+        # Vergleich über die Spalten des bisherigen Ablaufs (ohne die später ergänzten Summen/Anzahlen)
+        alt_df, neu_df = varianten.values()
+        spalten = [spalte for spalte in summary_spalten(kennzahlen) if spalte in alt_df.columns]
+        abweichungen = alt_df.select(spalten).exceptAll(neu_df.select(spalten)).count() \
+            + neu_df.select(spalten).exceptAll(alt_df.select(spalten)).count()
+        print(f"Abweichende Zeilen zwischen beiden Varianten: {abweichungen}")
+
+        print(f"{'Variante':<14}{'Shuffle (KiB)':>15}{'Median (s)':>12}{'Min (s)':>10}")
+        for name, zusammenfassung_df in varianten.items():
+            miss_lauf(spark, zusammenfassung_df)  # Aufwärmen
+            laeufe = [miss_lauf(spark, zusammenfassung_df) for _ in range(args.wiederholungen)]
+            zeiten = [dauer for dauer, _ in laeufe]
+            print(f"{name:<14}{statistics.median(b for _, b in laeufe) / 1024:>15.1f}"
+                  f"{statistics.median(zeiten):>12.2f}{min(zeiten):>10.2f}")
+        spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import sys
+import os
+import re
+import time
+import argparse
+import datetime
+import statistics
+import tempfile
+
+from pyspark.sql import SparkSession, Window, DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import FloatType
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+import generate_data
+from daily_aggregator import lese_rohdaten, berechne_zyklen, CYCLE_START_EVENT, CYCLE_END_EVENT
+
+
+# Vorher/Nachher-Vergleich der Zyklusberechnung: bisheriger Ablauf (Window + groupBy für die Zyklusgrenzen,
+# danach zwei Joins zurück auf die Events) gegen den einen Sortierlauf in berechne_zyklen().
+# Gemessen werden Laufzeit und Anzahl Shuffles (Exchange-Knoten im physischen Plan); die Ergebnisse müssen identisch sein.
+# Zusätzlich: berechne_zyklen auf zufällig umverteilter Eingabe muss dieselben cycle_seq liefern (unabhängig von der Partitionierung).
+
+def bisherige_zyklen(roh_events_df: DataFrame) -> tuple[DataFrame, DataFrame]:
+    df_mit_id = roh_events_df.withColumn("eindeutige_id", F.monotonically_increasing_id())
+    window_spec = Window.partitionBy("machine_id").orderBy("event_timestamp", "eindeutige_id")
+    events_mit_zyklus_nr_df = df_mit_id \
+        .withColumn("is_start_flag", F.when(F.col("event_name") == CYCLE_START_EVENT, 1).otherwise(0)) \
+        .withColumn("cycle_seq", F.sum("is_start_flag").over(window_spec))
+
+    zyklus_grenzen_df = events_mit_zyklus_nr_df \
+        .filter(F.col("cycle_seq") > 0) \
+        .filter(F.col("event_name").isin(CYCLE_START_EVENT, CYCLE_END_EVENT)) \
+        .groupBy("machine_id", "cycle_seq") \
+        .agg(F.min("event_timestamp").alias("cycle_start_ts"), F.max("event_timestamp").alias("cycle_end_ts"))
+    zyklus_zeiten_df = zyklus_grenzen_df.withColumn(
+        "cycle_time_seconds",
+        F.when(
+            F.col("cycle_start_ts").isNotNull() & F.col("cycle_end_ts").isNotNull(),
+            F.col("cycle_end_ts").cast("double") - F.col("cycle_start_ts").cast("double")
+        ).otherwise(None).cast(FloatType())
+    ).select("machine_id", "cycle_seq", "cycle_start_ts", "cycle_time_seconds")
+
+    events_df = events_mit_zyklus_nr_df.drop("eindeutige_id", "is_start_flag") \
+        .join(zyklus_zeiten_df.select("machine_id", "cycle_seq", "cycle_time_seconds"), on=["machine_id", "cycle_seq"], how="left") \
+        .join(zyklus_zeiten_df.select("machine_id", "cycle_seq", "cycle_start_ts"), on=["machine_id", "cycle_seq"], how="left")
+    return events_df, zyklus_zeiten_df
+
+
+def anzahl_shuffles(*dfs: DataFrame) -> int:
+    return sum(len(re.findall(r"Exchange (hashpartitioning|rangepartitioning|SinglePartition|RoundRobinPartitioning)",
+                              df._jdf.queryExecution().executedPlan().toString())) for df in dfs)
+
+
+def miss_lauf(events_df: DataFrame, zyklen_df: DataFrame) -> float:
+    start = time.perf_counter()
+    events_df.write.format("noop").mode("overwrite").save()
+    zyklen_df.write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - start
+
+
+def pruefe_reproduzierbarkeit(basis_events_df: DataFrame, partitionen: list, seed: int) -> int:
+    # Zufällige Zeilenreihenfolge und Partitionsanzahl; Vergleich mit der Berechnung auf der Eingabe wie gelesen
+    spalten = ["machine_id", "event_timestamp", "event_name", "parameter_name", "value", "cycle_seq", "cycle_time_seconds"]
+    referenz_df = berechne_zyklen(basis_events_df)[0].select(spalten)
+    abweichungen = 0
+    for nr, anzahl in enumerate(partitionen):
+        umverteilt_df = basis_events_df.orderBy(F.rand(seed + nr)).repartition(anzahl)
+        vergleich_df = berechne_zyklen(umverteilt_df)[0].select(spalten)
+        anzahl_abweichend = referenz_df.exceptAll(vergleich_df).count() + vergleich_df.exceptAll(referenz_df).count()
+        print(f"Reproduzierbarkeit bei {anzahl} zufällig gefüllten Partitionen: {anzahl_abweichend} abweichende Zeilen")
+        abweichungen += anzahl_abweichend
+    return abweichungen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: bisherige Zyklusberechnung mit Joins gegen einen Sortierlauf")
+    parser.add_argument("--maschinen", default="DieBonder_01", help="Kommagetrennte Maschinen-IDs")
+    parser.add_argument("--datum", type=generate_data.parse_datum, default=datetime.date(2024, 10, 16))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--wiederholungen", type=int, default=3)
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--partitionen", default="1,7,64", help="Kommagetrennte Partitionsanzahlen für die Reproduzierbarkeitsprüfung")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_zyklen_") as arbeitsverzeichnis:
+        generate_data.DATA_DIR = arbeitsverzeichnis
+        for maschine in args.maschinen.split(","):
+            generate_data.simuliere_maschinentag(maschine, args.datum, args.seed, "parquet")
+
+        spark = SparkSession.builder \
+            .master(args.master) \
+            .appName("Benchmark_Zyklen") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.ui.showConsoleProgress", "false") \
+            .getOrCreate()
+        spark.sparkContext.setLogLevel("ERROR")
+
+        basis_events_df = lese_rohdaten(spark, os.path.join(arbeitsverzeichnis, generate_data.PARQUET_DATASET), args.datum).cache()
+        print(f"{basis_events_df.count()} Events eingelesen.")
+
+        varianten = {"bisher": bisherige_zyklen(basis_events_df), "ein Sortierlauf": berechne_zyklen(basis_events_df)}
+
+        spalten = ["machine_id", "cycle_seq", "event_timestamp", "event_name", "parameter_name", "value", "cycle_start_ts", "cycle_time_seconds"]
+        (alt_events, alt_zyklen), (neu_events, neu_zyklen) = varianten.values()
+        abweichungen = alt_events.select(spalten).exceptAll(neu_events.select(spalten)).count() \
+            + neu_events.select(spalten).exceptAll(alt_events.select(spalten)).count() \
+            + alt_zyklen.exceptAll(neu_zyklen).count() + neu_zyklen.exceptAll(alt_zyklen).count()
+        print(f"Abweichende Zeilen zwischen beiden Varianten: {abweichungen}")
+        nicht_reproduzierbar = pruefe_reproduzierbarkeit(basis_events_df, [int(p) for p in args.partitionen.split(",")], args.seed)
+
+        print(f"{'Variante':<18}{'Shuffles':>10}{'Median (s)':>12}{'Min (s)':>10}")
+        for name, (events_df, zyklen_df) in varianten.items():
+            miss_lauf(events_df, zyklen_df)  # Aufwärmen
+            zeiten = [miss_lauf(events_df, zyklen_df) for _ in range(args.wiederholungen)]
+            print(f"{name:<18}{anzahl_shuffles(events_df, zyklen_df):>10}{statistics.median(zeiten):>12.2f}{min(zeiten):>10.2f}")
+        spark.stop()
+    if nicht_reproduzierbar:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
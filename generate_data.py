@@ -1,36 +1,21 @@
 import sys
 import datetime
-from datetime import timedelta
-import random
-import csv
+import argparse
 import os
+import io
+import glob
+import gzip
+import json
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-SimDauer = 1*24    # Angabe in Stunden.
 
-if len(sys.argv) != 3:
-    print("Benutzung: python generate_data.py <Maschine_ID> <Startdatum im Format YYYY-MM-DD>")
-    sys.exit(1)
-
-datum_input = sys.argv[2]
-StartZeit_STR = datum_input + "T00:00"
-MACHINE_ID = sys.argv[1]
-
-try:
-    dt_naive = datetime.datetime.strptime(StartZeit_STR, "%Y-%m-%dT%H:%M")
-except ValueError:
-    print(f"Fehler: Ungültiges Datumsformat '{datum_input}'. Erwartet z. B. 2024-10-16")
-    sys.exit(1)
-    
-StartZeit = dt_naive.replace(second=0, microsecond=0, tzinfo=datetime.UTC)
-EndeZeit = StartZeit + datetime.timedelta(hours=SimDauer)
-
-fehlerRate_AS_Vacuum = round(random.uniform(0, 0.03), 3)
-fehlerRate_PP_Vacuum = round(random.uniform(0, 0.03), 3)
-fehlerRate_AS_Blow = round(random.uniform(0, 0.03), 3)
-fehlerRate_PP_Blow = round(random.uniform(0, 0.03), 3)
-fehlerRate_Pick_Force = round(random.uniform(0, 0.03), 3)
-fehlerRate_Place_Force = round(random.uniform(0, 0.03), 3)
+SimDauer = 1*24    # Angabe in Stunden (pro Maschinentag).
 
 AS_Vacuum_ok_range = (40.0,70.0)
 AS_Vacuum_error_range = (70.1, 100.0)
@@ -45,55 +30,388 @@ AS_Blow_error_range = (350.0, 449.99)
 PP_Blow_ok_range = (450.0, 550.0)
 PP_Blow_error_range = (350.0, 449.99)
 
-delta1 = (130, 150)
-delta2 = (95, 105)
-delta3 = (50, 55)
-delta4 = (220, 250)
-delta5 = (80, 100)
-
-
-output_filename = f"machine_event_logs_{MACHINE_ID}_{StartZeit.strftime('%Y-%m-%d_%H-%M')}_to_{EndeZeit.strftime('%Y-%m-%d_%H-%M')}.csv"
-data_dir = "./raw_data"
-os.makedirs(data_dir, exist_ok=True)
-output_filepath = os.path.join(data_dir, output_filename)
-
-print(f"Schreibe Daten in: {output_filepath}")
-
-Simulationszeit_aktuell = StartZeit
-
-                
-with open(output_filepath, 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(["timestamp", "machine_id", "event_name", "parameter_name", "value"]) # Header
-    
-    GesamtDauer = (EndeZeit - StartZeit).total_seconds()
-    Prozentanzeige = -1
-    Datenzeilen_counter=0
-    
-    while Simulationszeit_aktuell < EndeZeit:
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "Cycle_Start", None, None])
-        Simulationszeit_aktuell += timedelta(milliseconds=random.uniform(*delta1)) # PP fährt zur Abholposition
-        
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "AS_Check", "AS_VacuumUnits", round(random.uniform(*(AS_Vacuum_error_range if random.random() <= fehlerRate_AS_Vacuum else AS_Vacuum_ok_range)),2)])
-        Simulationszeit_aktuell += timedelta(milliseconds=random.uniform(*delta2)) # Ausstechen und Pickup-Verzögerung
-        
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "Pick_Check", "PP_VacuumUnits", round(random.uniform(*(PP_Vacuum_error_range if random.random() <= fehlerRate_PP_Vacuum else PP_Vacuum_ok_range)),2)])
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "Pick_Check", "PP_Force", round(random.uniform(*(Pick_Force_error_range if random.random() <= fehlerRate_Pick_Force else Pick_Force_ok_range)), 2)])
-        Simulationszeit_aktuell += timedelta(milliseconds=random.uniform(*delta3)) # Maschinenverzögerung zw. Pickup und AS-BlowOff
-        
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "AS_Blowoff_Check", "AS_VacuumUnits", round(random.uniform(*(AS_Blow_error_range if random.random() <= fehlerRate_AS_Blow else AS_Blow_ok_range)), 2)])
-        Simulationszeit_aktuell += timedelta(milliseconds=random.uniform(*delta4)) # PP fährt zur Bestückposition
-        
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "Place_Check", "PP_Force", round(random.uniform(*(Place_Force_error_range if random.random() <= fehlerRate_Place_Force else Place_Force_ok_range)), 2)])
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "Place_Check", "PP_VacuumUnits", round(random.uniform(*(PP_Blow_error_range if random.random() <= fehlerRate_PP_Blow else PP_Blow_ok_range)), 2)])
-        Simulationszeit_aktuell += timedelta(milliseconds=random.uniform(*delta5)) # Bauteilsuche/Fahrt zur Warteposition
-        
-        writer.writerow([Simulationszeit_aktuell.isoformat(timespec='milliseconds').replace('+00:00', 'Z'), MACHINE_ID, "Cycle_End", None, None])
-        Datenzeilen_counter+=8
-        
-        Fortschritt_abs = (Simulationszeit_aktuell - StartZeit).total_seconds()
-        Fortschritt_rel = int((Fortschritt_abs / GesamtDauer) * 100)
-        if Fortschritt_rel // 10 > Prozentanzeige // 10:
-            Prozentanzeige = Fortschritt_rel
-            print(f"Fortschritt: {Fortschritt_rel}%")
-print(f"Simulation abgeschlossen. {Datenzeilen_counter} Datenzeilen erzeugt.")
\ No newline at end of file
+delta1 = (130, 150)  # PP fährt zur Abholposition
+delta2 = (95, 105)   # Ausstechen und Pickup-Verzögerung
+delta3 = (50, 55)    # Maschinenverzögerung zw. Pickup und AS-BlowOff
+delta4 = (220, 250)  # PP fährt zur Bestückposition
+delta5 = (80, 100)   # Bauteilsuche/Fahrt zur Warteposition
+DELTAS = [delta1, delta2, delta3, delta4, delta5]
+
+# Aufbau eines Zyklus: 8 Zeilen, die Zeitstempel ergeben sich aus der Anzahl bereits vergangener Deltas
+ZYKLUS_EVENTS = ["Cycle_Start", "AS_Check", "Pick_Check", "Pick_Check", "AS_Blowoff_Check", "Place_Check", "Place_Check", "Cycle_End"]
+ZYKLUS_PARAMETER = ["", "AS_VacuumUnits", "PP_VacuumUnits", "PP_Force", "AS_VacuumUnits", "PP_Force", "PP_VacuumUnits", ""]
+ZYKLUS_DELTA_STUFE = [0, 1, 2, 2, 3, 4, 4, 5]
+ZEILEN_PRO_ZYKLUS = len(ZYKLUS_EVENTS)
+
+# Messwerte: Zeile im Zyklus -> (ok_range, error_range)
+ZYKLUS_MESSUNGEN = {
+    1: (AS_Vacuum_ok_range, AS_Vacuum_error_range),
+    2: (PP_Vacuum_ok_range, PP_Vacuum_error_range),
+    3: (Pick_Force_ok_range, Pick_Force_error_range),
+    4: (AS_Blow_ok_range, AS_Blow_error_range),
+    5: (Place_Force_ok_range, Place_Force_error_range),
+    6: (PP_Blow_ok_range, PP_Blow_error_range),
+}
+
+# Sensorbereich: auch driftende Messwerte bleiben darin (und damit in den vorformatierten Texten von schreibe_csv)
+MAX_WERT = max(max(grenzen) for bereiche in ZYKLUS_MESSUNGEN.values() for grenzen in bereiche)
+
+CSV_HEADER = "timestamp,machine_id,event_name,parameter_name,value\n"
+DATA_DIR = "./raw_data"
+PARQUET_DATASET = "machine_event_logs.parquet"  # Partitioniert nach machine_id=<ID>/date=<YYYY-MM-DD>
+# Zyklen je Block: Simulation und Schreiben laufen blockweise, der Speicherbedarf hängt nicht von der Dauer ab
+ZYKLEN_PRO_SCHREIBVORGANG = 20000
+KOMPRESSIONEN = {"parquet": ("snappy", "zstd", "gzip", "keine"), "csv": ("keine", "gzip")}
+
+# Szenarien (config/szenarien.json) beziehen sich per "regel" auf eine Regel in schwellwerte.json
+SCHWELLWERTE_PFAD = "./config/schwellwerte.json"
+SZENARIO_TYPEN = ("drift", "fehlerhaeufung")
+
+
+def parse_datum(datum_input: str) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(datum_input, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ungültiges Datumsformat '{datum_input}'. Erwartet z. B. 2024-10-16")
+
+
+def erzeuge_rng(seed: int | None, machine_id: str, tag: datetime.date) -> np.random.Generator:
+    # Eigener Zufallsstrom je Maschinentag: reproduzierbar unabhängig von Reihenfolge und Prozessanzahl
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng([seed, zlib.crc32(machine_id.encode("utf-8")), tag.toordinal()])
+
+
+def _szenario_zeitpunkt(name: str, text: str) -> int:
+    # Datum (Tagesbeginn) oder Zeitstempel nach ISO 8601 in UTC, als Mikrosekunden seit 1970 wie die Zyklus-Zeitstempel
+    try:
+        zeitpunkt = datetime.datetime.fromisoformat(str(text).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Szenario '{name}': ungültiger Zeitpunkt '{text}', erwartet z. B. 2024-10-16 oder 2024-10-16T06:00:00Z")
+    if zeitpunkt.tzinfo:
+        zeitpunkt = zeitpunkt.astimezone(datetime.UTC).replace(tzinfo=None)
+    return int(np.datetime64(zeitpunkt, "us").astype(np.int64))
+
+
+def _drift_grenze(name: str, regel: dict, richtung: str) -> float:
+    if "error_if_above" in regel:
+        return float(regel["error_if_above"])
+    if "error_if_below" in regel:
+        return float(regel["error_if_below"])
+    if "error_if_outside_range" in regel:
+        untergrenze, obergrenze = regel["error_if_outside_range"]
+        return float(obergrenze if richtung == "oben" else untergrenze)
+    raise ValueError(f"Szenario '{name}': die Regel hat keine Grenze")
+
+
+def lade_szenarien(pfad: str, schwellwerte_pfad: str = SCHWELLWERTE_PFAD) -> list:
+    # drift: Messwert verschiebt sich ab "ab" über "dauer_stunden" linear bis "anteil" x (Grenze - Mitte des Normalbereichs)
+    # und bleibt danach verschoben. fehlerhaeufung: je Maschinentag "anzahl_pro_tag" Zeitfenster von "dauer_minuten"
+    # mit "fehlerrate". Optional "maschinen": nur diese Maschinen.
+    with open(pfad, encoding="utf-8") as f:
+        konfiguration = json.load(f)
+    with open(schwellwerte_pfad, encoding="utf-8") as f:
+        schwellwerte = json.load(f)
+    messungen = {(ZYKLUS_EVENTS[zeile], ZYKLUS_PARAMETER[zeile]): zeile for zeile in ZYKLUS_MESSUNGEN}
+
+    szenarien = []
+    for name, szenario in konfiguration.items():
+        if name.startswith("_") or not isinstance(szenario, dict):
+            continue
+        if szenario.get("typ") not in SZENARIO_TYPEN:
+            raise ValueError(f"Szenario '{name}': unbekannter Typ '{szenario.get('typ')}', erwartet {', '.join(SZENARIO_TYPEN)}")
+        regel = schwellwerte.get(szenario.get("regel"))
+        if not isinstance(regel, dict):
+            raise ValueError(f"Szenario '{name}': Regel '{szenario.get('regel')}' fehlt in '{schwellwerte_pfad}'")
+        zeile = messungen.get((regel.get("event_name"), regel.get("parameter_name")))
+        if zeile is None:
+            raise ValueError(f"Szenario '{name}': Regel '{szenario['regel']}' prüft keinen simulierten Messwert")
+
+        eintrag = {"name": name, "typ": szenario["typ"], "zeile": zeile, "maschinen": szenario.get("maschinen")}
+        if szenario["typ"] == "drift":
+            if "ab" not in szenario:
+                raise ValueError(f"Szenario '{name}': Drift ohne Beginn 'ab'")
+            ok_range = ZYKLUS_MESSUNGEN[zeile][0]
+            grenze = _drift_grenze(name, regel, szenario.get("richtung", "oben"))
+            eintrag.update(
+                ab_us=_szenario_zeitpunkt(name, szenario["ab"]),
+                dauer_us=max(1, int(float(szenario.get("dauer_stunden", 24)) * 3600 * 1_000_000)),
+                verschiebung=(grenze - sum(ok_range) / 2) * float(szenario.get("anteil", 1.0))
+            )
+        else:
+            eintrag.update(
+                anzahl_pro_tag=int(szenario.get("anzahl_pro_tag", 1)),
+                dauer_us=int(float(szenario.get("dauer_minuten", 15)) * 60 * 1_000_000),
+                fehlerrate=float(szenario.get("fehlerrate", 0.5))
+            )
+        szenarien.append(eintrag)
+    return szenarien
+
+
+def haeufungs_fenster(rng: np.random.Generator, szenarien: list, dauer_us: int) -> list:
+    # (Zeile, von, bis, Fehlerrate) relativ zum Start des Maschinentags, aus dessen Zufallsstrom gezogen
+    fenster = []
+    for szenario in szenarien:
+        if szenario["typ"] != "fehlerhaeufung":
+            continue
+        for von in rng.integers(0, max(1, dauer_us - szenario["dauer_us"]), size=szenario["anzahl_pro_tag"]):
+            fenster.append((szenario["zeile"], int(von), int(von) + szenario["dauer_us"], szenario["fehlerrate"]))
+    return fenster
+
+
+def erzeuge_zyklen(rng: np.random.Generator, StartZeit: datetime.datetime, EndeZeit: datetime.datetime, fehlerRaten: np.ndarray,
+                   szenarien: list = ()):
+    # Generator über Blöcke von ZYKLEN_PRO_SCHREIBVORGANG Zyklen: (Zeitstempel (n, 8), Werte (n, 8)) je Block
+    dauer_us = int((EndeZeit - StartZeit).total_seconds() * 1_000_000)
+    start_us = np.datetime64(StartZeit.replace(tzinfo=None), "us")
+    fenster = haeufungs_fenster(rng, szenarien, dauer_us)
+    drifts = [szenario for szenario in szenarien if szenario["typ"] == "drift"]
+
+    naechster_start_us = 0
+    while naechster_start_us < dauer_us:
+        deltas_us = np.column_stack([
+            np.rint(rng.uniform(*d, size=ZYKLEN_PRO_SCHREIBVORGANG) * 1000) for d in DELTAS
+        ]).astype(np.int64)
+        zyklus_dauer_us = deltas_us.sum(axis=1)
+        zyklus_ende_us = naechster_start_us + np.cumsum(zyklus_dauer_us)
+        zyklus_start_us = zyklus_ende_us - zyklus_dauer_us
+        anzahl = int(np.searchsorted(zyklus_start_us, dauer_us, side="left"))
+        naechster_start_us = int(zyklus_ende_us[-1]) if anzahl == ZYKLEN_PRO_SCHREIBVORGANG else dauer_us
+        deltas_us = deltas_us[:anzahl]
+        zyklus_start_us = zyklus_start_us[:anzahl]
+
+        # Zeitversatz jeder Zeile zum Zyklusstart (n, 8)
+        kumuliert_us = np.concatenate((np.zeros((anzahl, 1), dtype=np.int64), np.cumsum(deltas_us, axis=1)), axis=1)
+        zeit_us = zyklus_start_us[:, None] + kumuliert_us[:, ZYKLUS_DELTA_STUFE]
+        zeitstempel = start_us + zeit_us.astype("timedelta64[us]")
+
+        werte = np.full((anzahl, ZEILEN_PRO_ZYKLUS), np.nan)
+        for i, (zeile, (ok_range, error_range)) in enumerate(ZYKLUS_MESSUNGEN.items()):
+            fehler_rate = np.full(anzahl, fehlerRaten[i])
+            for fenster_zeile, von, bis, rate in fenster:
+                if fenster_zeile == zeile:
+                    im_fenster = (zyklus_start_us >= von) & (zyklus_start_us < bis)
+                    fehler_rate[im_fenster] = np.maximum(fehler_rate[im_fenster], rate)
+            ist_fehler = rng.random(anzahl) <= fehler_rate
+            wert = np.where(ist_fehler, rng.uniform(*error_range, size=anzahl), rng.uniform(*ok_range, size=anzahl))
+            for drift in drifts:
+                if drift["zeile"] == zeile:
+                    seit_beginn_us = start_us.astype(np.int64) + zyklus_start_us - drift["ab_us"]
+                    wert = wert + drift["verschiebung"] * np.clip(seit_beginn_us / drift["dauer_us"], 0.0, 1.0)
+            werte[:, zeile] = np.round(np.clip(wert, 0.0, MAX_WERT), 2)
+
+        if anzahl:
+            yield zeitstempel, werte
+
+
+@lru_cache(maxsize=None)
+def text_tabellen(max_wert: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Vorformatierte Textbausteine, damit pro Zeile nur noch Array-Indizes nachgeschlagen werden
+    uhrzeiten = np.array([f"T{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}." for s in range(86400)], dtype=object)
+    millis = np.array([f"{ms:03d}Z" for ms in range(1000)], dtype=object)
+    werte = np.array([str(c / 100) for c in range(int(max_wert * 100) + 1)], dtype=object)
+    return uhrzeiten, millis, werte
+
+
+def schreibe_csv(csvfile, MACHINE_ID: str, zeitstempel: np.ndarray, werte: np.ndarray):
+    uhrzeiten, millis, wert_texte = text_tabellen(MAX_WERT)
+
+    # Feste Zeilenpräfixe je Position im Zyklus, nur Zeitstempel und Werte variieren
+    praefixe = [f",{MACHINE_ID},{ev},{par}," for ev, par in zip(ZYKLUS_EVENTS, ZYKLUS_PARAMETER)]
+    praefix_spalte = np.tile(np.array(praefixe, dtype=object), len(zeitstempel) // ZEILEN_PRO_ZYKLUS)
+
+    ms = zeitstempel.astype("datetime64[ms]").astype(np.int64)
+    tage, tag_index = np.unique(ms // 86_400_000, return_inverse=True)
+    tag_texte = np.array([str(np.datetime64(int(t), "D")) for t in tage], dtype=object)
+    zeit_str = tag_texte[tag_index] + uhrzeiten[ms % 86_400_000 // 1000] + millis[ms % 1000]
+
+    ist_messwert = ~np.isnan(werte)
+    wert_str = np.full(len(werte), "", dtype=object)
+    wert_str[ist_messwert] = wert_texte[np.rint(werte[ist_messwert] * 100).astype(np.int64)]
+
+    zeilen = zeit_str + praefix_spalte + wert_str + "\n"
+    csvfile.write("".join(zeilen))
+
+
+def parquet_tabelle(zeitstempel: np.ndarray, werte: np.ndarray) -> pa.Table:
+    anzahl_zyklen = len(zeitstempel) // ZEILEN_PRO_ZYKLUS
+    event_dict = sorted(set(ZYKLUS_EVENTS))
+    parameter_dict = sorted(set(ZYKLUS_PARAMETER) - {""})
+    event_idx = np.tile(np.array([event_dict.index(ev) for ev in ZYKLUS_EVENTS], dtype=np.int8), anzahl_zyklen)
+    parameter_idx = np.tile(np.array([parameter_dict.index(par) if par else -1 for par in ZYKLUS_PARAMETER], dtype=np.int8), anzahl_zyklen)
+
+    # Typisierte Spalten: Zeitstempel als timestamp[ms, UTC], Namen dictionary-kodiert, Werte als float32
+    return pa.table({
+        "timestamp": pa.array(zeitstempel.astype("datetime64[ms]")).cast(pa.timestamp("ms", tz="UTC")),
+        "event_name": pa.DictionaryArray.from_arrays(pa.array(event_idx), pa.array(event_dict)),
+        "parameter_name": pa.DictionaryArray.from_arrays(pa.array(parameter_idx, mask=parameter_idx < 0), pa.array(parameter_dict)),
+        "value": pa.array(werte.astype(np.float32), mask=np.isnan(werte)),
+    })
+
+
+class RollendeDateien:
+    # Schreibt Blöcke in nummerierte Dateien; sobald eine Datei max_bytes erreicht, beginnt die nächste. Jede Datei
+    # entsteht unter verstecktem Namen und wird erst vollständig umbenannt: ein Streaming-Leser sieht nie eine halbe Datei.
+    def __init__(self, verzeichnis: str, dateiname, max_bytes: int | None, oeffne, schreibe):
+        self.verzeichnis = verzeichnis
+        self.dateiname = dateiname  # Teilnummer -> Dateiname
+        self.max_bytes = max_bytes
+        self._oeffne = oeffne       # Pfad -> (Rohdatei, Schreibziel)
+        self._schreibe = schreibe   # (Schreibziel, Zeitstempel, Werte)
+        self.dateien = []
+        self.bytes = 0
+        self._offen = None
+
+    def schreibe(self, zeitstempel: np.ndarray, werte: np.ndarray):
+        if self._offen is None:
+            name = self.dateiname(len(self.dateien))
+            temp_pfad = os.path.join(self.verzeichnis, f".{name}.tmp")
+            roh, ziel = self._oeffne(temp_pfad)
+            self._offen = (name, temp_pfad, roh, ziel)
+        _, _, roh, ziel = self._offen
+        self._schreibe(ziel, zeitstempel, werte)
+        # Komprimierte Ausgaben halten einen Rest im Puffer: die Größe ist eine Untergrenze
+        if self.max_bytes and roh.tell() >= self.max_bytes:
+            self._schliesse()
+
+    def _schliesse(self):
+        name, temp_pfad, roh, ziel = self._offen
+        ziel.close()
+        if not roh.closed:
+            roh.close()
+        ziel_pfad = os.path.join(self.verzeichnis, name)
+        os.replace(temp_pfad, ziel_pfad)
+        self.bytes += os.path.getsize(ziel_pfad)
+        self.dateien.append(ziel_pfad)
+        self._offen = None
+
+    def schliesse(self, alte_teile: str = None) -> list:
+        if self._offen is not None:
+            self._schliesse()
+        # Teile eines früheren Laufs mit mehr Dateien entfernen, sonst läsen die Aggregatoren sie mit
+        if alte_teile:
+            for pfad in glob.glob(os.path.join(self.verzeichnis, alte_teile)):
+                if pfad not in self.dateien:
+                    os.remove(pfad)
+        return self.dateien
+
+
+def parquet_ausgabe(partition_dir: str, max_bytes: int | None, kompression: str) -> RollendeDateien:
+    schema = parquet_tabelle(np.array([], dtype="datetime64[us]"), np.array([])).schema
+
+    def oeffne(pfad):
+        roh = pa.OSFile(pfad, "wb")
+        return roh, pq.ParquetWriter(roh, schema, use_dictionary=["event_name", "parameter_name"],
+                                     compression="none" if kompression == "keine" else kompression)
+
+    # Ein Block je Row Group
+    return RollendeDateien(partition_dir, lambda teil: f"part-{teil}.parquet", max_bytes, oeffne,
+                           lambda writer, zeitstempel, werte: writer.write_table(parquet_tabelle(zeitstempel, werte)))
+
+
+def csv_ausgabe(MACHINE_ID: str, basis_name: str, max_bytes: int | None, kompression: str) -> RollendeDateien:
+    endung = ".csv.gz" if kompression == "gzip" else ".csv"
+
+    def oeffne(pfad):
+        roh = open(pfad, "wb")
+        strom = gzip.GzipFile(fileobj=roh, mode="wb", compresslevel=6) if kompression == "gzip" else roh
+        csvfile = io.TextIOWrapper(strom, encoding="utf-8", newline="")
+        csvfile.write(CSV_HEADER)
+        return roh, csvfile
+
+    def schreibe(csvfile, zeitstempel, werte):
+        schreibe_csv(csvfile, MACHINE_ID, zeitstempel, werte)
+        csvfile.flush()
+
+    dateiname = (lambda teil: f"{basis_name}_teil-{teil + 1:03d}{endung}") if max_bytes else (lambda teil: f"{basis_name}{endung}")
+    return RollendeDateien(DATA_DIR, dateiname, max_bytes, oeffne, schreibe)
+
+
+def simuliere_maschinentag(MACHINE_ID: str, tag: datetime.date, seed: int | None, ausgabeformat: str,
+                           max_bytes: int | None = None, kompression: str = None, szenarien: list = ()) -> tuple[str, int, int, int]:
+    StartZeit = datetime.datetime.combine(tag, datetime.time(0, 0), tzinfo=datetime.UTC)
+    EndeZeit = StartZeit + datetime.timedelta(hours=SimDauer)
+    rng = erzeuge_rng(seed, MACHINE_ID, tag)
+    szenarien = [szenario for szenario in szenarien if not szenario["maschinen"] or MACHINE_ID in szenario["maschinen"]]
+
+    fehlerRaten = np.round(rng.uniform(0, 0.03, size=len(ZYKLUS_MESSUNGEN)), 3)
+
+    if ausgabeformat == "parquet":
+        partition_dir = os.path.join(DATA_DIR, PARQUET_DATASET, f"machine_id={MACHINE_ID}", f"date={tag.isoformat()}")
+        os.makedirs(partition_dir, exist_ok=True)
+        ausgabe = parquet_ausgabe(partition_dir, max_bytes, kompression or "snappy")
+        ziel, alte_teile = partition_dir, "part-*.parquet"
+    else:
+        basis_name = f"machine_event_logs_{MACHINE_ID}_{StartZeit.strftime('%Y-%m-%d_%H-%M')}_to_{EndeZeit.strftime('%Y-%m-%d_%H-%M')}"
+        ausgabe = csv_ausgabe(MACHINE_ID, basis_name, max_bytes, kompression or "keine")
+        ziel, alte_teile = os.path.join(DATA_DIR, basis_name + "*"), basis_name + "_teil-*"
+
+    anzahl_zeilen = 0
+    for zeitstempel, werte in erzeuge_zyklen(rng, StartZeit, EndeZeit, fehlerRaten, szenarien):
+        ausgabe.schreibe(zeitstempel.ravel(), werte.ravel())
+        anzahl_zeilen += zeitstempel.size
+    dateien = ausgabe.schliesse(alte_teile)
+    return ziel, anzahl_zeilen, len(dateien), ausgabe.bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simuliert Maschinen-Event-Logs (eine Datei bzw. Partition pro Maschine und Tag).")
+    parser.add_argument("maschinen", help="Maschinen-ID oder kommagetrennte Liste, z. B. DieBonder_01,DieBonder_02")
+    parser.add_argument("startdatum", type=parse_datum, help="Erster Tag im Format YYYY-MM-DD")
+    parser.add_argument("--enddatum", type=parse_datum, default=None, help="Letzter Tag (inklusive), Standard: Startdatum")
+    parser.add_argument("--seed", type=int, default=None, help="Startwert für reproduzierbare Daten")
+    parser.add_argument("--prozesse", type=int, default=os.cpu_count(), help="Anzahl paralleler Prozesse")
+    parser.add_argument("--format", dest="ausgabeformat", choices=["parquet", "csv"], default="parquet",
+                        help=f"Ausgabeformat: partitioniertes Parquet-Dataset '{PARQUET_DATASET}' (Standard) oder CSV-Dateien")
+    parser.add_argument("--max-datei-mb", type=float, default=None,
+                        help="Höchstgröße je Datei; größere Maschinentage werden auf mehrere Dateien verteilt")
+    parser.add_argument("--kompression", choices=sorted({k for ks in KOMPRESSIONEN.values() for k in ks}), default=None,
+                        help="Parquet: snappy (Standard), zstd, gzip, keine; CSV: keine (Standard), gzip (.csv.gz)")
+    parser.add_argument("--szenarien", metavar="PFAD", default=None,
+                        help="JSON mit Drift- und Fehlerhäufungs-Szenarien, z. B. config/szenarien.json")
+    parser.add_argument("--schwellwerte", metavar="PFAD", default=SCHWELLWERTE_PFAD,
+                        help="Schwellwert-Regeln, auf die sich die Szenarien beziehen")
+    args = parser.parse_args()
+
+    maschinen = [m.strip() for m in args.maschinen.split(",") if m.strip()]
+    enddatum = args.enddatum or args.startdatum
+    if enddatum < args.startdatum:
+        print(f"Fehler: Enddatum {enddatum} liegt vor dem Startdatum {args.startdatum}.")
+        sys.exit(1)
+    if args.kompression and args.kompression not in KOMPRESSIONEN[args.ausgabeformat]:
+        print(f"Fehler: Kompression '{args.kompression}' für {args.ausgabeformat} nicht möglich, erwartet {', '.join(KOMPRESSIONEN[args.ausgabeformat])}.")
+        sys.exit(1)
+    szenarien = []
+    if args.szenarien:
+        try:
+            szenarien = lade_szenarien(args.szenarien, args.schwellwerte)
+        except (OSError, ValueError) as e:
+            print(f"Fehler in den Szenarien: {e}")
+            sys.exit(1)
+        print("Szenarien: " + (", ".join(f"{szenario['name']} ({szenario['typ']})" for szenario in szenarien) or "keine"))
+    max_bytes = int(args.max_datei_mb * 1024 * 1024) if args.max_datei_mb else None
+    tage = [args.startdatum + datetime.timedelta(days=i) for i in range((enddatum - args.startdatum).days + 1)]
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    aufgaben = [(m, tag) for m in maschinen for tag in tage]
+    print(f"Simuliere {len(aufgaben)} Maschinentag(e) mit {args.prozesse} Prozess(en) nach: {DATA_DIR}")
+
+    Datenzeilen_counter = 0
+    bytes_gesamt = 0
+    with ProcessPoolExecutor(max_workers=args.prozesse) as pool:
+        futures = [
+            pool.submit(simuliere_maschinentag, m, tag, args.seed, args.ausgabeformat, max_bytes, args.kompression, szenarien)
+            for m, tag in aufgaben
+        ]
+        for i, future in enumerate(as_completed(futures), start=1):
+            ziel, anzahl_zeilen, anzahl_dateien, geschrieben = future.result()
+            Datenzeilen_counter += anzahl_zeilen
+            bytes_gesamt += geschrieben
+            print(f"Fortschritt: {i}/{len(aufgaben)} - {ziel} ({anzahl_zeilen} Datenzeilen, {anzahl_dateien} Datei(en), "
+                  f"{geschrieben / 1024 ** 2:.1f} MB; gesamt {bytes_gesamt / 1024 ** 3:.2f} GB)")
+
+    print(f"Simulation abgeschlossen. {Datenzeilen_counter} Datenzeilen, {bytes_gesamt / 1024 ** 2:.1f} MB erzeugt.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import functools
+import numpy as np
+import pandas as pd
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, FloatType, DoubleType, LongType
+from bulk_loader import COPY_TIMESTAMP_FORMAT, upsert_zeilen
+
+
+# Statistische Anomalie-Erkennung ergänzend zu den festen Schwellwerten: je (machine_id, event_name, parameter_name)
+# gleitender Mittelwert und Varianz (EWMA). Jeder neue Messwert erhält als anomaly_score seinen Abstand zum bisherigen
+# Mittelwert in Standardabweichungen; so fällt eine Drift auf, bevor sie eine harte Grenze erreicht.
+# Zwischen den Läufen bleibt nur der Zustand je Schlüssel (drei Zahlen) in machine_parameter_statistics, die Historie
+# wird im Normalbetrieb nie erneut gelesen. Jeder Lauf legt den Zustand zusätzlich als Schnappschuss zum letzten
+# bewerteten Messwert ab: --ersetzen setzt damit den Zustand auf den Stand vor den ersetzten Events zurück.
+
+STATISTIK_TABELLE = "machine_parameter_statistics"
+SCHNAPPSCHUSS_TABELLE = "machine_parameter_statistics_history"
+STATISTIK_SCHLUESSEL = ["machine_id", "event_name", "parameter_name"]
+STATISTIK_SPALTEN = STATISTIK_SCHLUESSEL + ["ewma_mean", "ewma_variance", "sample_count"]
+SCHNAPPSCHUSS_SPALTEN = STATISTIK_SPALTEN + ["last_event_timestamp"]
+
+# Nur am letzten Messwert je Schlüssel gesetzt: Zustand nach dem Lauf, vgl. neue_statistik
+ZUSTAND_FELDER = [
+    StructField("anomaly_score", FloatType(), True), StructField("ewma_mean", DoubleType(), True),
+    StructField("ewma_variance", DoubleType(), True), StructField("sample_count", LongType(), True)
+]
+
+
+def lade_anomalie_konfiguration() -> tuple[float, int]:
+    # alpha 0.01: Gedächtnis von etwa 100 Messwerten; ohne ausreichend Messwerte (Einschwingen) kein Score
+    alpha = float(os.environ.get('ANOMALIE_ALPHA', '0.01'))
+    if not 0 < alpha < 1:
+        raise ValueError(f"FEHLER: ANOMALIE_ALPHA '{alpha}' ungültig, erwartet 0 < alpha < 1")
+    min_anzahl = int(os.environ.get('ANOMALIE_MIN_ANZAHL', '200'))
+    return alpha, min_anzahl
+
+
+def lade_statistik(conn, maschinen: list) -> dict:
+    if not maschinen:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {', '.join(STATISTIK_SPALTEN)} FROM {STATISTIK_TABELLE} WHERE machine_id = ANY(%s)
+        """, (list(maschinen),))
+        return {(m, e, p): (float(mittel), float(varianz), int(anzahl)) for m, e, p, mittel, varianz, anzahl in cur.fetchall()}
+
+
+def _ewma(startwert: float, werte: np.ndarray, alpha: float) -> np.ndarray:
+    # Rekursion s_t = (1 - alpha) * s_{t-1} + alpha * x_t vektorisiert; Element 0 ist der Startwert
+    return pd.Series(np.concatenate(([startwert], werte))).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+
+def _ewma_reihe(startzustand: tuple, werte: np.ndarray, alpha: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Mittelwert und Varianz jeweils vor dem Messwert: Element t-1 der Rekursion; Element -1 ist der Zustand danach
+    mittel_start, varianz_start, _ = startzustand
+    mittel = _ewma(mittel_start, werte, alpha)
+    abweichung = werte - mittel[:-1]
+    varianz = _ewma(varianz_start, (1 - alpha) * abweichung ** 2, alpha)
+    return mittel, varianz, abweichung
+
+
+def _bewerte_reihe(events: pd.DataFrame, statistik: dict, alpha: float, min_anzahl: int) -> pd.DataFrame:
+    # Alle Events eines Schlüssels (machine_id, event_name, parameter_name), d. h. eine Messreihe
+    score = np.full(len(events), np.nan)
+    zustand = {feld.name: np.full(len(events), np.nan) for feld in ZUSTAND_FELDER[1:]}
+    # Nur neue Messwerte; mitgelesene, bereits gespeicherte Events sind schon im Zustand enthalten
+    messwerte = events[events["ist_neu"] & events["value"].notna()].sort_values("event_timestamp", kind="stable")
+    if len(messwerte):
+        werte = messwerte["value"].to_numpy(dtype=np.float64)
+        startzustand = statistik.get(tuple(events[spalte].iat[0] for spalte in STATISTIK_SCHLUESSEL), (werte[0], 0.0, 0))
+        mittel, varianz, abweichung = _ewma_reihe(startzustand, werte, alpha)
+        anzahl_start = startzustand[2]
+        anzahl_vorher = anzahl_start + np.arange(len(werte))
+        gueltig = (anzahl_vorher >= min_anzahl) & (varianz[:-1] > 0)
+        positionen = events.index.get_indexer(messwerte.index)
+        score[positionen[gueltig]] = np.abs(abweichung[gueltig]) / np.sqrt(varianz[:-1][gueltig])
+        zustand["ewma_mean"][positionen[-1]] = mittel[-1]
+        zustand["ewma_variance"][positionen[-1]] = varianz[-1]
+        zustand["sample_count"][positionen[-1]] = anzahl_start + len(werte)
+    return events.assign(
+        anomaly_score=np.round(score, 3).astype(np.float32), ewma_mean=zustand["ewma_mean"],
+        ewma_variance=zustand["ewma_variance"], sample_count=pd.array(zustand["sample_count"], dtype="Int64")
+    )
+
+
+def bewerte_anomalien(events_df: DataFrame, statistik: dict, alpha: float, min_anzahl: int) -> DataFrame:
+    # Eine Gruppe je Messreihe (machine_id, event_name, parameter_name): der Speicherbedarf je pandas-DataFrame wächst
+    # mit einer Reihe, nicht mit allen Events einer Maschine im Stapel. Die Events sind nach der Zyklusberechnung bereits
+    # nach machine_id verteilt, das genügt auch dieser feineren Gruppierung; die Bewertung braucht keinen weiteren
+    # Shuffle. Der Zustand aller Schlüssel ist klein und geht per Closure mit.
+    schema = StructType(events_df.schema.fields + ZUSTAND_FELDER)
+    return events_df.groupBy(*STATISTIK_SCHLUESSEL).applyInPandas(
+        functools.partial(_bewerte_reihe, statistik=statistik, alpha=alpha, min_anzahl=min_anzahl), schema
+    )
+
+
+def neue_statistik(bewertete_events_df: DataFrame) -> list:
+    # Zeilen in SCHNAPPSCHUSS_SPALTEN: Zustand und Zeitpunkt des letzten darin enthaltenen Messwerts
+    return [
+        tuple(zeile) for zeile in bewertete_events_df.filter(F.col("sample_count").isNotNull()).select(
+            *STATISTIK_SPALTEN, F.date_format("event_timestamp", COPY_TIMESTAMP_FORMAT).alias("last_event_timestamp")
+        ).collect()
+    ]
+
+
+def speichere_statistik(conn, zeilen: list, festschreiben: bool = True) -> int:
+    # Nur die im Lauf geänderten Schlüssel; der Schnappschuss kommt hinzu, der aktuelle Zustand wird überschrieben
+    upsert_zeilen(conn, SCHNAPPSCHUSS_TABELLE, SCHNAPPSCHUSS_SPALTEN, STATISTIK_SCHLUESSEL + ["last_event_timestamp"],
+                  zeilen, festschreiben=False)
+    return upsert_zeilen(conn, STATISTIK_TABELLE, STATISTIK_SPALTEN, STATISTIK_SCHLUESSEL,
+                         [zeile[:len(STATISTIK_SPALTEN)] for zeile in zeilen], festschreiben)
+
+
+def schreibe_statistik_fort(schnappschuesse: dict, messwerte: list, alpha: float) -> dict:
+    # Zustand je Schlüssel ab dem Schnappschuss (ohne Schnappschuss ab dem ersten Messwert wie in _bewerte_reihe), um
+    # die zeitlich geordneten Messwerte (Schlüssel, Wert) fortgeschrieben. Werte wie gespeichert als REAL, d. h. float32.
+    je_schluessel = {}
+    for schluessel, wert in messwerte:
+        je_schluessel.setdefault(schluessel, []).append(wert)
+    statistik = dict(schnappschuesse)
+    for schluessel, werte in je_schluessel.items():
+        werte = np.asarray(werte, dtype=np.float32).astype(np.float64)
+        startzustand = statistik.get(schluessel, (werte[0], 0.0, 0))
+        mittel, varianz, _ = _ewma_reihe(startzustand, werte, alpha)
+        statistik[schluessel] = (float(mittel[-1]), float(varianz[-1]), startzustand[2] + len(werte))
+    return statistik
+
+
+def statistik_vor(conn, tabelle: str, beginn: dict, alpha: float) -> dict:
+    # EWMA-Zustand, wie er vor dem Event beginn[machine_id] bestand (daily_aggregator.py --ersetzen, vgl. stand_vor):
+    # letzter Schnappschuss davor, fortgeschrieben um die gespeicherten Messwerte zwischen Schnappschuss und beginn.
+    # Jeder gespeicherte Messwert wurde genau einmal bewertet. Reihen ohne Schnappschuss davor werden aus allen
+    # gespeicherten Messwerten vor beginn aufgebaut, je Reihe über idx_processed_events_machine_param.
+    schnappschuesse, messwerte = {}, []
+    with conn.cursor() as cur:
+        for machine_id, ab in sorted(beginn.items()):
+            cur.execute(f"""
+                SELECT s.event_name, s.parameter_name, h.last_event_timestamp, h.ewma_mean, h.ewma_variance, h.sample_count
+                FROM {STATISTIK_TABELLE} s
+                LEFT JOIN LATERAL (
+                    SELECT last_event_timestamp, ewma_mean, ewma_variance, sample_count
+                    FROM {SCHNAPPSCHUSS_TABELLE} h
+                    WHERE h.machine_id = s.machine_id AND h.event_name = s.event_name AND h.parameter_name = s.parameter_name
+                      AND h.last_event_timestamp < %(ab)s
+                    ORDER BY h.last_event_timestamp DESC
+                    LIMIT 1
+                ) h ON true
+                WHERE s.machine_id = %(maschine)s
+            """, {"maschine": machine_id, "ab": ab})
+            for event_name, parameter_name, seit, mittel, varianz, anzahl in cur.fetchall():
+                schluessel = (machine_id, event_name, parameter_name)
+                if seit is not None:
+                    schnappschuesse[schluessel] = (float(mittel), float(varianz), int(anzahl))
+                cur.execute(f"""
+                    SELECT value
+                    FROM {tabelle}
+                    WHERE machine_key = (SELECT machine_key FROM dim_machine WHERE machine_id = %(maschine)s)
+                      AND parameter_key = (SELECT parameter_key FROM dim_parameter WHERE parameter_name = %(parameter)s)
+                      AND event_key = (SELECT event_key FROM dim_event WHERE event_name = %(event)s)
+                      AND event_timestamp > COALESCE(%(seit)s::timestamptz, '-infinity') AND event_timestamp < %(ab)s
+                      AND value IS NOT NULL
+                    ORDER BY event_timestamp ASC
+                """, {"maschine": machine_id, "parameter": parameter_name, "event": event_name, "seit": seit, "ab": ab})
+                messwerte += [(schluessel, wert) for wert, in cur.fetchall()]
+    conn.rollback()
+    return schreibe_statistik_fort(schnappschuesse, messwerte, alpha)
+
+
+def setze_statistik_zurueck(conn, beginn: dict, statistik: dict):
+    # Zustand der Maschinen in beginn durch den zurückgesetzten ersetzen und Schnappschüsse ab beginn verwerfen;
+    # ohne Festschreiben, Teil der Transaktion mit speichere_statistik
+    with conn.cursor() as cur:
+        for machine_id, ab in sorted(beginn.items()):
+            cur.execute(f"DELETE FROM {SCHNAPPSCHUSS_TABELLE} WHERE machine_id = %s AND last_event_timestamp >= %s", (machine_id, ab))
+            cur.execute(f"DELETE FROM {STATISTIK_TABELLE} WHERE machine_id = %s", (machine_id,))
+    upsert_zeilen(conn, STATISTIK_TABELLE, STATISTIK_SPALTEN, STATISTIK_SCHLUESSEL,
+                  [schluessel + zustand for schluessel, zustand in sorted(statistik.items()) if schluessel[0] in beginn],
+                  festschreiben=False)
@@ -0,0 +1,90 @@
+import os
+import math
+import datetime
+from pyspark.sql import SparkSession
+
+
+# Spark-Einstellungen eines Laufs von daily_aggregator.py aus der Eingabegröße und der Anzahl Maschinen: Shuffle-
+# Partitionen, AQE, Broadcast-Schwelle und Parallelität der Schreibverbindungen. Die Dateigrößen sind vor dem Lesen
+# bekannt, die Maschinen nach dem ersten Spark-Job; alle Werte sind Laufzeit-Einstellungen der Session und gelten ab
+# dem nächsten Shuffle. Umgebungsvariablen überschreiben die berechneten Werte.
+
+MB = 1024 * 1024
+# Dateibytes -> Bytes der Zeilen im Speicher, grob gemessen an Daten aus generate_data.py (CSV als Bezug)
+EXPANSION = {".csv": 1, ".csv.gz": 8, ".parquet": 10}
+ZIEL_BYTES_JE_PARTITION = 128 * MB
+MIN_BYTES_JE_PARTITION = 4 * MB
+MAX_SHUFFLE_PARTITIONEN = 2000
+ZIEL_BYTES_JE_VERBINDUNG = 16 * MB
+BROADCAST_BYTES = (10 * MB, 64 * MB) # Spark-Standard als Untergrenze; Obergrenze wegen Driver-Speicher
+
+
+def lade_plan_konfiguration() -> tuple[int, int, int]:
+    # Feste Werte für Shuffle-Partitionen bzw. COPY-Verbindungen; MAX_DB_VERBINDUNGEN begrenzt die berechnete Parallelität
+    shuffle_partitionen = int(os.environ['SPARK_SHUFFLE_PARTITIONEN']) if os.environ.get('SPARK_SHUFFLE_PARTITIONEN') else None
+    copy_parallelitaet = int(os.environ['COPY_PARALLELITAET']) if os.environ.get('COPY_PARALLELITAET') else None
+    max_verbindungen = int(os.environ.get('MAX_DB_VERBINDUNGEN', '8'))
+    return shuffle_partitionen, copy_parallelitaet, max_verbindungen
+
+
+def _endung(pfad: str) -> str:
+    pfad = pfad.lower()
+    return next((endung for endung in sorted(EXPANSION, key=len, reverse=True) if pfad.endswith(endung)), ".csv")
+
+
+def eingabe_bytes(pfade: list, datum: datetime.date = None) -> int:
+    # Geschätzte Bytes im Speicher; bei einem Parquet-Dataset mit datum nur die Verzeichnisse date=<datum>
+    gesamt = 0
+    for pfad in pfade:
+        if not os.path.isdir(pfad):
+            gesamt += os.path.getsize(pfad) * EXPANSION[_endung(pfad)]
+            continue
+        for verzeichnis, _, dateien in os.walk(pfad):
+            if datum and f"date={datum}" not in verzeichnis.split(os.sep):
+                continue
+            gesamt += sum(
+                os.path.getsize(os.path.join(verzeichnis, datei)) for datei in dateien if not datei.startswith((".", "_"))
+            ) * EXPANSION[".parquet"]
+    return gesamt
+
+
+def plane_ausfuehrung(eingabe: int, maschinen: int, kerne: int, konfiguration: tuple) -> dict:
+    feste_partitionen, feste_parallelitaet, max_verbindungen = konfiguration
+    # Fenster, Anomalie-Bewertung, Zyklen und Zusammenfassung verteilen nach machine_id: mehr Partitionen als Maschinen
+    # bleiben leer und werden von AQE zusammengefasst, verringern aber Hash-Kollisionen zweier Maschinen
+    partitionen = feste_partitionen or min(
+        max(kerne, math.ceil(eingabe / ZIEL_BYTES_JE_PARTITION), 2 * maschinen), MAX_SHUFFLE_PARTITIONEN
+    )
+    # Zielgröße nach dem Zusammenfassen: kleine Eingaben werden noch auf alle Kerne verteilt
+    zielgroesse = min(max(eingabe // max(kerne, 1), MIN_BYTES_JE_PARTITION), ZIEL_BYTES_JE_PARTITION)
+    # Ein Broadcast lohnt, solange er klein gegenüber einem Shuffle der Eingabe ist
+    broadcast = min(max(eingabe // 100, BROADCAST_BYTES[0]), BROADCAST_BYTES[1])
+    parallelitaet = feste_parallelitaet or min(max(math.ceil(eingabe / ZIEL_BYTES_JE_VERBINDUNG), 1), max(kerne, 1), max_verbindungen)
+    return {
+        "eingabe_mb": round(eingabe / MB, 1),
+        "maschinen": maschinen,
+        "kerne": kerne,
+        "shuffle_partitionen": partitionen,
+        "zielgroesse_mb": round(zielgroesse / MB, 1),
+        "broadcast_mb": round(broadcast / MB, 1),
+        "schreib_parallelitaet": parallelitaet,
+        "spark": {
+            "spark.sql.shuffle.partitions": str(partitionen),
+            "spark.sql.adaptive.enabled": "true",
+            "spark.sql.adaptive.coalescePartitions.enabled": "true",
+            # Zielgröße statt der Standard-Mindestgröße von 1 MB: wenige volle Tasks statt vieler kleiner
+            "spark.sql.adaptive.coalescePartitions.parallelismFirst": "false",
+            "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(zielgroesse),
+            "spark.sql.adaptive.skewJoin.enabled": "true",
+            "spark.sql.autoBroadcastJoinThreshold": str(broadcast),
+            "spark.sql.adaptive.autoBroadcastJoinThreshold": str(broadcast),
+        }
+    }
+
+
+def wende_plan_an(spark: SparkSession, plan: dict):
+    for schluessel, wert in plan["spark"].items():
+        spark.conf.set(schluessel, wert)
+    print(f"Ausführungsplan: {plan['eingabe_mb']} MB geschätzt, {plan['maschinen']} Maschinen, {plan['kerne']} Kerne -> "
+          f"{plan['shuffle_partitionen']} Shuffle-Partitionen (Ziel {plan['zielgroesse_mb']} MB), "
+          f"Broadcast bis {plan['broadcast_mb']} MB, {plan['schreib_parallelitaet']} parallele Schreibverbindungen")
@@ -0,0 +1,80 @@
+import os
+import glob
+import gzip
+import json
+import datetime
+
+
+# Stapelbetrieb von daily_aggregator.py: viele CSV-Dateien (je Maschine und Tag) in einer Spark-Session und einem
+# Lesevorgang. Das Manifest hält je Datei das Ergebnis des letzten Versuchs fest; fehlgeschlagene Dateien lassen sich
+# mit --wiederholen allein erneut verarbeiten. Eine Datei, deren Events alle hinter dem Wasserstand ihrer Maschinen
+# liegen, wurde nicht geladen und gilt weder als ok noch als wiederholbar.
+
+MANIFEST_NAME = "verarbeitung_manifest.json"
+STATUS_OK = "ok"
+STATUS_FEHLGESCHLAGEN = "fehlgeschlagen"
+STATUS_HINTER_WASSERSTAND = "hinter_wasserstand"
+CSV_KOPFZEILE = "timestamp,machine_id,event_name,parameter_name,value"
+# gzip-komprimierte CSV-Dateien (generate_data.py --kompression gzip) liest Spark direkt
+CSV_ENDUNGEN = (".csv", ".csv.gz")
+
+
+def finde_dateien(basis_verzeichnis: str, muster: str) -> list:
+    # Muster relativ zum Eingabeverzeichnis: Glob (z. B. "machine_event_logs_*_2024-10-16_*.csv") oder Unterverzeichnis
+    if os.path.isabs(muster) or ".." in muster.replace("\\", "/").split("/"):
+        raise ValueError(f"Ungültiges Muster '{muster}': nur relative Pfade innerhalb von '{basis_verzeichnis}' erlaubt.")
+    pfad = os.path.join(basis_verzeichnis, muster)
+    if os.path.isdir(pfad):
+        pfad = os.path.join(pfad, "*.csv*")
+    dateien = sorted(
+        os.path.relpath(datei, basis_verzeichnis) for datei in glob.glob(pfad)
+        if os.path.isfile(datei) and datei.lower().endswith(CSV_ENDUNGEN)
+    )
+    if not dateien:
+        raise ValueError(f"Keine CSV-Dateien für Muster '{muster}' in '{basis_verzeichnis}' gefunden.")
+    return dateien
+
+
+def pruefe_datei(pfad: str) -> str:
+    # Fehlertext oder None; Dateien mit falscher Kopfzeile würden sonst still als leere Events verworfen
+    try:
+        with (gzip.open if pfad.lower().endswith(".gz") else open)(pfad, "rt", encoding="utf-8") as f:
+            kopfzeile = f.readline().strip()
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        return f"Datei nicht lesbar: {e}"
+    if kopfzeile != CSV_KOPFZEILE:
+        return f"Unerwartete Kopfzeile '{kopfzeile[:100]}', erwartet '{CSV_KOPFZEILE}'."
+    return None
+
+
+class VerarbeitungsManifest:
+    def __init__(self, pfad: str):
+        self.pfad = pfad
+        self.eintraege = {}
+        if os.path.exists(pfad):
+            with open(pfad, encoding="utf-8") as f:
+                self.eintraege = json.load(f)
+
+    def fehlgeschlagene(self) -> list:
+        return sorted(datei for datei, eintrag in self.eintraege.items() if eintrag["status"] == STATUS_FEHLGESCHLAGEN)
+
+    def markiere(self, datei: str, status: str, fehler: str = None, zeilen: int = None, maschinen: list = None,
+                 verworfen: int = None):
+        # zeilen: geladene Events; verworfen: Events hinter dem Wasserstand, die nicht geladen wurden
+        self.eintraege[datei] = {
+            "status": status,
+            "zeitpunkt": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "zeilen": zeilen, "verworfen": verworfen, "maschinen": maschinen, "fehler": fehler,
+            "versuche": self.eintraege.get(datei, {}).get("versuche", 0) + 1
+        }
+
+    def speichere(self):
+        # Erst unter temporärem Namen schreiben, dann ersetzen: ein Abbruch hinterlässt kein halbes Manifest
+        temp_pfad = f"{self.pfad}.tmp"
+        with open(temp_pfad, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(self.eintraege.items())), f, indent=2, ensure_ascii=False)
+        os.replace(temp_pfad, self.pfad)
+        je_status = {}
+        for eintrag in self.eintraege.values():
+            je_status[eintrag["status"]] = je_status.get(eintrag["status"], 0) + 1
+        print(f"Manifest '{self.pfad}': " + ", ".join(f"{anzahl} Datei(en) {status}" for status, anzahl in sorted(je_status.items())) + ".")
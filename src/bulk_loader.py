@@ -0,0 +1,146 @@
+import io
+import csv
+import time
+from itertools import islice, groupby
+import psycopg2
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import TimestampType
+
+
+COPY_NULL = "\\N"
+COPY_TIMESTAMP_FORMAT = "yyyy-MM-dd HH:mm:ss.SSSSSSXXX"
+COPY_LESEPUFFER_ZEILEN = 10000
+
+# Eine Verbindung pro Python-Worker: Spark verwendet die Worker-Prozesse über Tasks hinweg wieder
+_worker_verbindung = None
+
+
+def _hole_worker_verbindung(db_params: dict):
+    global _worker_verbindung
+    if _worker_verbindung is None or _worker_verbindung.closed:
+        _worker_verbindung = psycopg2.connect(**db_params)
+    return _worker_verbindung
+
+
+class _CsvStrom:
+    # Datei-ähnliches Objekt für copy_expert: erzeugt die CSV-Zeilen stapelweise erst beim Lesen aus dem Partition-Iterator
+    def __init__(self, zeilen):
+        self.zeilen = iter(zeilen)
+        self.anzahl = 0
+
+    def read(self, size=-1):
+        stapel = list(islice(self.zeilen, COPY_LESEPUFFER_ZEILEN))
+        if not stapel:
+            return ""
+        puffer = io.StringIO()
+        csv.writer(puffer, lineterminator="\n").writerows(
+            [COPY_NULL if wert is None else wert for wert in zeile] for zeile in stapel
+        )
+        self.anzahl += len(stapel)
+        return puffer.getvalue()
+
+    readline = read
+
+
+def _kopiere_partition(zeilen, tabelle: str, spalten: list, db_params: dict, zeilen_zaehler):
+    zeilen_zaehler.add(_kopiere(zeilen, tabelle, spalten, db_params))
+
+
+def _kopiere_verteilt(zeilen, tabellen: list, spalten: list, db_params: dict, zeilen_zaehler):
+    # Zeilen sind innerhalb der Partition nach Zielnummer (erste Spalte) sortiert: ein COPY je Zieltabelle
+    for ziel_nr, gruppe in groupby(zeilen, key=lambda zeile: zeile[0]):
+        zeilen_zaehler.add(_kopiere((zeile[1:] for zeile in gruppe), tabellen[int(ziel_nr)], spalten, db_params))
+
+
+def _kopiere(zeilen, tabelle: str, spalten: list, db_params: dict) -> int:
+    conn = _hole_worker_verbindung(db_params)
+    strom = _CsvStrom(zeilen)
+    sql = f"COPY {tabelle} ({', '.join(spalten)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(sql, strom)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return strom.anzahl
+
+
+def als_copy_text(df: DataFrame) -> DataFrame:
+    # Formatierung in der JVM statt pro Zeile in Python; Zeitstempel mit Offset der Session-Zeitzone
+    return df.select([
+        F.date_format(F.col(feld.name), COPY_TIMESTAMP_FORMAT).alias(feld.name)
+        if isinstance(feld.dataType, TimestampType) else F.col(feld.name).cast("string").alias(feld.name)
+        for feld in df.schema.fields
+    ])
+
+
+def schreibe_per_copy(df: DataFrame, tabelle: str, db_params: dict, parallelitaet: int = 4) -> int:
+    spark = df.sparkSession
+    spalten = df.columns
+    zeilen_zaehler = spark.sparkContext.accumulator(0)
+
+    text_df = als_copy_text(df)
+    if parallelitaet and parallelitaet > 0:
+        text_df = text_df.repartition(parallelitaet)
+
+    start = time.perf_counter()
+    text_df.rdd.foreachPartition(
+        lambda zeilen: _kopiere_partition(zeilen, tabelle, spalten, db_params, zeilen_zaehler)
+    )
+    dauer = time.perf_counter() - start
+
+    anzahl = zeilen_zaehler.value
+    print(f"{anzahl} Zeilen per COPY in '{tabelle}' geschrieben: {dauer:.1f} s, "
+          f"{anzahl / dauer if dauer > 0 else 0:.0f} Zeilen/s ({parallelitaet} parallele Verbindungen)")
+    return anzahl
+
+
+def schreibe_per_copy_verteilt(df: DataFrame, ziel_spalte: str, tabellen: list, db_params: dict, parallelitaet: int = 4) -> int:
+    # Ein Spark-Job für mehrere Zieltabellen: ziel_spalte enthält je Zeile den Index in tabellen. Jede der parallelen
+    # Partitionen schreibt ihre Zeilen nach Ziel gruppiert, statt die Events je Zieltabelle erneut zu filtern und zu lesen.
+    spark = df.sparkSession
+    spalten = [spalte for spalte in df.columns if spalte != ziel_spalte]
+    zeilen_zaehler = spark.sparkContext.accumulator(0)
+
+    text_df = als_copy_text(df.select([ziel_spalte] + spalten))
+    if parallelitaet and parallelitaet > 0:
+        text_df = text_df.repartition(parallelitaet)
+    text_df = text_df.sortWithinPartitions(ziel_spalte)
+
+    start = time.perf_counter()
+    text_df.rdd.foreachPartition(
+        lambda zeilen: _kopiere_verteilt(zeilen, tabellen, spalten, db_params, zeilen_zaehler)
+    )
+    dauer = time.perf_counter() - start
+
+    anzahl = zeilen_zaehler.value
+    print(f"{anzahl} Zeilen per COPY in {len(tabellen)} Tabelle(n) geschrieben: {dauer:.1f} s, "
+          f"{anzahl / dauer if dauer > 0 else 0:.0f} Zeilen/s ({parallelitaet} parallele Verbindungen)")
+    return anzahl
+
+
+def upsert_zeilen(conn, tabelle: str, spalten: list, schluessel: list, zeilen: list, festschreiben: bool = True) -> int:
+    # Für kleine, im Driver gesammelte Ergebnisse (z. B. Stunden-Zusammenfassung): vorhandene Schlüssel werden überschrieben.
+    # COPY in eine temporäre Staging-Tabelle (ohne WAL, nur in dieser Sitzung sichtbar), dann ein einziges
+    # INSERT ... SELECT ... ON CONFLICT. festschreiben=False: Teil einer größeren Transaktion des Aufrufers.
+    if not zeilen:
+        return 0
+    staging = f"{tabelle}_staging"
+    aktualisierung = ", ".join(f"{spalte} = EXCLUDED.{spalte}" for spalte in spalten if spalte not in schluessel)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{staging}")
+        cur.execute(f"CREATE TEMP TABLE {staging} (LIKE {tabelle} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cur.copy_expert(
+            f"COPY {staging} ({', '.join(spalten)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')", _CsvStrom(zeilen)
+        )
+        cur.execute(f"""
+            INSERT INTO {tabelle} ({', '.join(spalten)})
+            SELECT {', '.join(spalten)} FROM {staging}
+            ON CONFLICT ({', '.join(schluessel)}) DO UPDATE SET {aktualisierung}
+        """)
+    if festschreiben:
+        conn.commit()
+    print(f"{len(zeilen)} Zeilen in '{tabelle}' eingefügt bzw. aktualisiert.")
+    return len(zeilen)
@@ -1,286 +1,646 @@
 import sys
 import os
+import argparse
 import json
+import datetime
 import traceback
+import urllib.parse
+from functools import reduce, partial
+import psycopg2
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession, Window, DataFrame
 from pyspark.sql import functions as F
-from pyspark.sql.types import (StructType, StructField, StringType, TimestampType, FloatType, IntegerType, DateType)
+from pyspark.sql.types import (StructType, StructField, StringType, TimestampType, FloatType, IntegerType, DateType, LongType)
+import bulk_loader
+from bulk_loader import schreibe_per_copy_verteilt, upsert_zeilen, COPY_TIMESTAMP_FORMAT
+from partition_manager import plane_ladeziele, haenge_partitionen_an, entferne_alte_partitionen
+from dimensionen import LESBARE_SICHT, vergebe_alle_schluessel, speicher_format, lade_schluessel
+from kennzahlen import SUMMARY_SCHLUESSEL, lade_kennzahlen, ergaenze_summary_spalten, berechne_stunden_zusammenfassung
+from zyklus_tabelle import ergaenze_zyklen_spalten, berechne_maschinen_zyklen, schreibe_maschinen_zyklen
+from verdichtung import TAGES_TABELLE, WOCHEN_TABELLE, aktualisiere_verdichtungen
+from schwellwert_regeln import erstelle_regel_tabelle, markiere_fehler
+from lauf_metriken import LaufMetriken
+from ausfuehrungsplan import lade_plan_konfiguration, eingabe_bytes, plane_ausfuehrung, wende_plan_an
+import anomalie
+from anomalie import (lade_anomalie_konfiguration, lade_statistik, statistik_vor, setze_statistik_zurueck, bewerte_anomalien,
+                      neue_statistik, speichere_statistik)
+from batch_manifest import (MANIFEST_NAME, STATUS_OK, STATUS_FEHLGESCHLAGEN, STATUS_HINTER_WASSERSTAND, CSV_ENDUNGEN,
+                            VerarbeitungsManifest, finde_dateien, pruefe_datei)
+from processing_state import (lade_verarbeitungsstand, stand_vor, kontext_abfrage, kontext_beginn, schliesse_zyklen,
+                              entferne_abgebrochene_events, speichere_verarbeitungsstand, setze_verarbeitungsmarker)
 
 
 SCHWELLWERTE_PFAD = "/app/config/schwellwerte.json"
 INPUT_DATA_PFAD_TEMPLATE = "/data/raw/{}"
+PARQUET_ENDUNG = ".parquet"
 PROCESSED_EVENTS_TABLE = "processed_machine_events"
 HOURLY_SUMMARY_TABLE = "hourly_machine_summary"
 DB_DRIVER = "org.postgresql.Driver"
+EVENTS_SCHREIBMODI = ("copy", "jdbc")
 TIMESTAMP_FORMAT_INPUT = "yyyy-MM-dd'T'HH:mm:ss.SSS'Z'" # ISO 8601 UTC
-DATE_FORMAT_SUMMARY = "yyyy-MM-dd"
 CYCLE_START_EVENT = "Cycle_Start"
 CYCLE_END_EVENT = "Cycle_End"
-
-# Mapping: Schwellwert-Konfiguration -> DataFrame Parameter/Event für die prüfung Fehlerprüfung
-PARAMETER_EVENT_MAPPING = {
-    "AS_VacuumUnits":         {"df_param_name": "AS_VacuumUnits", "event_name": "AS_Check"},
-    "PP_VacuumUnits":         {"df_param_name": "PP_VacuumUnits", "event_name": "Pick_Check"},
-    "AS_VacuumUnits_Release": {"df_param_name": "AS_VacuumUnits", "event_name": "AS_Blowoff_Check"},
-    "PP_VacuumUnits_Release": {"df_param_name": "PP_VacuumUnits", "event_name": "Place_Check"},
-    "PickForce":              {"df_param_name": "PP_Force",       "event_name": "Pick_Check"},
-    "PlaceForce":             {"df_param_name": "PP_Force",       "event_name": "Place_Check"}
-}
+# Reihenfolge bei gleichem Zeitstempel: Cycle_End schließt den alten Zyklus vor dem Cycle_Start des nächsten
+EVENT_RANG = {CYCLE_END_EVENT: 0, CYCLE_START_EVENT: 2}
+
+CSV_INPUT_SCHEMA = StructType([
+    StructField("timestamp", StringType(), True), StructField("machine_id", StringType(), True),
+    StructField("event_name", StringType(), True), StructField("parameter_name", StringType(), True),
+    StructField("value", StringType(), True)
+])
+# Parquet-Dataset aus generate_data.py: typisierte Spalten, partitioniert nach machine_id/date
+PARQUET_INPUT_SCHEMA = StructType([
+    StructField("timestamp", TimestampType(), True), StructField("event_name", StringType(), True),
+    StructField("parameter_name", StringType(), True), StructField("value", FloatType(), True),
+    StructField("machine_id", StringType(), True), StructField("date", DateType(), True)
+])
+
+STAND_SCHEMA = StructType([
+    StructField("machine_id", StringType(), False), StructField("last_event_timestamp", TimestampType(), True),
+    StructField("last_cycle_seq", LongType(), True)
+])
+# (Tag, Maschine) -> Index der Zieltabelle in schreibe_events
+LADEZIEL_SCHEMA = StructType([
+    StructField("tag", DateType(), False), StructField("ziel_machine_id", StringType(), False),
+    StructField("ziel_nr", IntegerType(), False)
+])
 
 # Hilfsfunktionen
 
-def berechne_zyklen(roh_events_df: DataFrame) -> tuple[DataFrame, DataFrame]:
-    df_mit_id = roh_events_df.withColumn("eindeutige_id", F.monotonically_increasing_id())
-    window_spec = Window.partitionBy("machine_id").orderBy("event_timestamp", "eindeutige_id")
-
-    df_mit_start_flag = df_mit_id.withColumn(
-        "is_start_flag",
-        F.when(F.col("event_name") == CYCLE_START_EVENT, 1).otherwise(0)
-    )
-    events_mit_zyklus_nr_df = df_mit_start_flag.withColumn(
-        "cycle_seq",
-        F.sum("is_start_flag").over(window_spec)
-    )
-    
-    events_in_zyklen_df = events_mit_zyklus_nr_df.filter(F.col("cycle_seq") > 0)
-
-    nur_start_und_end_events_df = events_in_zyklen_df.filter(
-        F.col("event_name").isin(CYCLE_START_EVENT, CYCLE_END_EVENT)
-    )
-
-    zyklus_grenzen_df = nur_start_und_end_events_df.groupBy("machine_id", "cycle_seq").agg(
-        F.min("event_timestamp").alias("cycle_start_ts"),
-        F.max("event_timestamp").alias("cycle_end_ts")
+def lade_schwellwerte() -> dict:
+    schwellwerte = {}
+    try:
+        with open(SCHWELLWERTE_PFAD, 'r', encoding='utf-8') as f:
+            schwellwerte = json.load(f)
+    except FileNotFoundError:
+        print(f"Schwellwert-Datei '{SCHWELLWERTE_PFAD}' nicht gefunden.")
+    except json.JSONDecodeError as e:
+        print(f"Schwellwert-Datei '{SCHWELLWERTE_PFAD}' ist ungültiges JSON: {e}.")
+        raise
+    except Exception as e:
+        print(f"Unerwarteter Fehler beim Laden der Schwellwerte: {e}")
+    return schwellwerte
+
+
+def lade_db_konfiguration() -> tuple[str, dict, dict]:
+    db_host = os.environ.get('DB_HOST')
+    db_name = os.environ.get('DB_NAME')
+    db_user = os.environ.get('DB_USER')
+    db_pass = os.environ.get('DB_PASS')
+    if not all([db_host, db_name, db_user, db_pass]):
+        raise ValueError("FEHLER: DB-Zugangsdaten (DB_HOST, DB_NAME, DB_USER, DB_PASS) nicht vollständig gesetzt!")
+    db_url = f"jdbc:postgresql://{db_host}:5432/{db_name}"
+    db_properties = {"user": db_user, "password": db_pass, "driver": DB_DRIVER}
+    pg_params = {"host": db_host, "dbname": db_name, "user": db_user, "password": db_pass, "port": 5432}
+    return db_url, db_properties, pg_params
+
+
+def lade_schreib_konfiguration() -> tuple[str, bool, int, str]:
+    # Die Parallelität der Schreibverbindungen (COPY_PARALLELITAET) gehört zum Ausführungsplan (ausfuehrungsplan.py)
+    events_schreibmodus = os.environ.get('EVENTS_SCHREIBMODUS', 'copy').lower()
+    if events_schreibmodus not in EVENTS_SCHREIBMODI:
+        raise ValueError(f"FEHLER: EVENTS_SCHREIBMODUS '{events_schreibmodus}' ungültig, erlaubt: {', '.join(EVENTS_SCHREIBMODI)}")
+    partition_nach_maschine = os.environ.get('EVENTS_PARTITION_NACH_MASCHINE', 'true').lower() in ("1", "true", "ja")
+    aufbewahrung_tage = int(os.environ['EVENTS_AUFBEWAHRUNG_TAGE']) if os.environ.get('EVENTS_AUFBEWAHRUNG_TAGE') else None
+    # Ohne Archivpfad werden abgelaufene Tage ohne Sicherung entfernt
+    archiv_pfad = os.environ.get('EVENTS_ARCHIV_PFAD') or None
+    return events_schreibmodus, partition_nach_maschine, aufbewahrung_tage, archiv_pfad
+
+
+def ist_parquet_eingabe(input_pfad: str) -> bool:
+    return input_pfad.lower().endswith(PARQUET_ENDUNG) or os.path.isdir(input_pfad)
+
+
+def lese_csv(spark: SparkSession, input_pfad: str | list) -> DataFrame:
+    # Liste von Dateien (Stapelbetrieb): ein gemeinsamer Lesevorgang
+    print(f"Lese Rohdaten aus CSV: '{input_pfad}'" if isinstance(input_pfad, str) else f"Lese Rohdaten aus {len(input_pfad)} CSV-Dateien")
+    rohdaten_df = spark.read.csv(input_pfad, header=True, schema=CSV_INPUT_SCHEMA, timestampFormat=TIMESTAMP_FORMAT_INPUT)
+    return bereinige_csv(rohdaten_df)
+
+
+# Parsen/Bereinigen getrennt vom Lesen: auch für Streaming-DataFrames (stream_aggregator.py) verwendbar
+def bereinige_csv(rohdaten_df: DataFrame) -> DataFrame:
+    return rohdaten_df \
+        .withColumn("event_timestamp", F.to_timestamp(F.col("timestamp"), TIMESTAMP_FORMAT_INPUT)) \
+        .withColumn("value_float", F.col("value").cast(FloatType())) \
+        .fillna("", subset=["parameter_name"]) \
+        .dropna(subset=["event_timestamp", "machine_id", "event_name"]) \
+        .drop("timestamp", "value") \
+        .withColumnRenamed("value_float", "value") \
+        .filter(F.col("event_timestamp").isNotNull())
+
+
+def lese_parquet(spark: SparkSession, input_pfad: str, datum: datetime.date = None) -> DataFrame:
+    print(f"Lese Rohdaten aus Parquet: '{input_pfad}'" + (f" (date={datum})" if datum else ""))
+    rohdaten_df = spark.read.schema(PARQUET_INPUT_SCHEMA).parquet(input_pfad)
+    if datum:
+        # Filter auf die Partitionsspalte -> nur die Verzeichnisse des Tages werden gelesen
+        rohdaten_df = rohdaten_df.filter(F.col("date") == F.lit(datum))
+    return bereinige_parquet(rohdaten_df)
+
+
+def bereinige_parquet(rohdaten_df: DataFrame) -> DataFrame:
+    return rohdaten_df \
+        .select(
+            F.col("timestamp").alias("event_timestamp"), "machine_id",
+            "event_name", "parameter_name", "value"
+        ) \
+        .fillna("", subset=["parameter_name"]) \
+        .dropna(subset=["event_timestamp", "machine_id", "event_name"])
+
+
+def lese_rohdaten(spark: SparkSession, input_pfad: str, datum: datetime.date = None) -> DataFrame:
+    if ist_parquet_eingabe(input_pfad):
+        return lese_parquet(spark, input_pfad, datum)
+    return lese_csv(spark, input_pfad)
+
+
+def nummeriere_zyklen(roh_events_df: DataFrame, letzter_zyklus_spalte: str = None, neu_spalte: str = None) -> DataFrame:
+    # letzter_zyklus_spalte: bereits vergebener cycle_seq je Maschine aus einem vorherigen Lauf, die Nummerierung setzt dort fort
+    # neu_spalte: nur diese Zeilen werden nummeriert; mitgelesene, bereits gespeicherte Events liegen zeitlich davor,
+    # behalten ihren cycle_seq und zählen nicht mit
+    # Gleiche Zeitstempel werden nur über den Inhalt der Events geordnet, nicht über Lesereihenfolge oder Partitionierung:
+    # cycle_seq ist damit für jede Parallelität und jedes Eingabeformat gleich (wie in stream_aggregator.py).
+    # Nach Rang verbleibende Gleichstände (z. B. die beiden Pick_Check-Zeilen) liegen im selben Zyklus.
+    event_rang = F.coalesce(
+        F.element_at(F.create_map(*[F.lit(wert) for paar in EVENT_RANG.items() for wert in paar]), F.col("event_name")),
+        F.lit(1)
     )
-
-    zyklus_zeiten_df = zyklus_grenzen_df.withColumn(
+    df_mit_rang = roh_events_df \
+        .withColumn("event_rang", event_rang.cast("tinyint")) \
+        .withColumn("is_start_flag", F.when(F.col("event_name") == CYCLE_START_EVENT, 1).otherwise(0))
+    if neu_spalte:
+        df_mit_rang = df_mit_rang.withColumn("is_start_flag", F.when(F.col(neu_spalte), F.col("is_start_flag")).otherwise(0))
+    window_spec = Window.partitionBy("machine_id") \
+        .orderBy("event_timestamp", "event_rang", "parameter_name", "value") \
+        .rowsBetween(Window.unboundedPreceding, Window.currentRow)
+
+    zyklus_nr = F.sum("is_start_flag").over(window_spec)
+    if letzter_zyklus_spalte:
+        zyklus_nr = zyklus_nr + F.coalesce(F.col(letzter_zyklus_spalte), F.lit(0))
+    if neu_spalte:
+        zyklus_nr = F.when(F.col(neu_spalte), zyklus_nr).otherwise(F.col("cycle_seq"))
+    return df_mit_rang.withColumn("cycle_seq", zyklus_nr).drop("event_rang", "is_start_flag")
+
+
+def berechne_zyklus_grenzen(events_mit_zyklus_nr_df: DataFrame) -> tuple[DataFrame, DataFrame]:
+    # (machine_id, cycle_seq) ist feiner als die Partitionierung nach machine_id: nur zusätzliche Sortierung, kein Shuffle
+    zyklus_window = Window.partitionBy("machine_id", "cycle_seq")
+
+    # Start nur aus dem Cycle_Start: mitgelesene Zyklen, die vor dem Kontext-Beginn starteten, bleiben ohne Start und
+    # gehen nicht erneut in Zyklen und Zusammenfassung ein (sie zählen bereits zur Stunde ihres Starts)
+    ist_start_event = (F.col("cycle_seq") > 0) & (F.col("event_name") == CYCLE_START_EVENT)
+    ist_grenz_event = (F.col("cycle_seq") > 0) & F.col("event_name").isin(CYCLE_START_EVENT, CYCLE_END_EVENT)
+    events_mit_grenzen_df = events_mit_zyklus_nr_df \
+        .withColumn("cycle_start_ts", F.min(F.when(ist_start_event, F.col("event_timestamp"))).over(zyklus_window)) \
+        .withColumn("cycle_end_ts", F.max(F.when(ist_grenz_event, F.col("event_timestamp"))).over(zyklus_window))
+
+    events_mit_zyklus_df = events_mit_grenzen_df.withColumn(
         "cycle_time_seconds",
         F.when(
             F.col("cycle_start_ts").isNotNull() & F.col("cycle_end_ts").isNotNull(),
             F.col("cycle_end_ts").cast("double") - F.col("cycle_start_ts").cast("double")
         ).otherwise(None).cast(FloatType())
-    )
+    ).drop("cycle_end_ts")
 
-    events_mit_zyklus_nr_df = events_mit_zyklus_nr_df.drop("eindeutige_id", "is_start_flag")
-    zyklus_zeiten_df = zyklus_zeiten_df.select("machine_id", "cycle_seq", "cycle_start_ts", "cycle_time_seconds")
+    # Jeder Zyklus hat genau ein Cycle_Start-Event: eine Zeile pro Zyklus ohne groupBy
+    zyklus_zeiten_df = events_mit_zyklus_df \
+        .filter((F.col("event_name") == CYCLE_START_EVENT) & (F.col("cycle_seq") > 0)) \
+        .select("machine_id", "cycle_seq", "cycle_start_ts", "cycle_time_seconds")
 
-    return events_mit_zyklus_nr_df, zyklus_zeiten_df
+    return events_mit_zyklus_df, zyklus_zeiten_df
 
 
-def finde_fehler_basierend_auf_schwellwerten(events_df: DataFrame, schwellwerte_config: dict) -> DataFrame:
-    
-    fehler_bedingungen_liste = []
+def berechne_zyklen(roh_events_df: DataFrame) -> tuple[DataFrame, DataFrame]:
+    return berechne_zyklus_grenzen(nummeriere_zyklen(roh_events_df))
 
-    for config_key, regel in schwellwerte_config.items():
-        if config_key.startswith("_") or not isinstance(regel, dict):
-            continue
 
-        mapping_info = PARAMETER_EVENT_MAPPING.get(config_key)
-        param_name_im_df = mapping_info.get("df_param_name")
-        relevanter_event_name = mapping_info.get("event_name")
-        
-        ist_relevantes_event_und_parameter = (
-            (F.col("parameter_name") == param_name_im_df) &
-            (F.col("event_name") == relevanter_event_name) &
-            (F.col("value").isNotNull())
-        )
-
-        fehler_bedingung_fuer_regel = None
-        if "error_if_above" in regel:
-            fehler_bedingung_fuer_regel = (F.col("value") > regel["error_if_above"])
-        elif "error_if_below" in regel:
-            fehler_bedingung_fuer_regel = (F.col("value") < regel["error_if_below"])
-        elif "error_if_outside_range" in regel:
-            grenzen = regel["error_if_outside_range"]
-            
-            fehler_bedingung_fuer_regel = (F.col("value") < grenzen[0]) | (F.col("value") > grenzen[1])
+def finde_fehler_basierend_auf_schwellwerten(events_df: DataFrame, schwellwerte_config: dict) -> DataFrame:
+    # Regeln inkl. event_name/parameter_name-Zuordnung kommen aus schwellwerte.json, siehe schwellwert_regeln.py
+    regel_df = erstelle_regel_tabelle(events_df.sparkSession, schwellwerte_config)
+    return markiere_fehler(events_df, regel_df)
+
+
+def archiviere_partition(spark: SparkSession, db_url: str, db_properties: dict, archiv_pfad: str, maschinen_schluessel: dict,
+                         partition: str, tag: datetime.date):
+    # Tages-Partition als Parquet (zstd) mit lesbaren Namen statt Schlüsseln: auswertbar ohne die Datenbank, z. B. mit
+    # spark.read.parquet(<archiv>/processed_machine_events). Gelesen wird je Maschine parallel über die Sicht.
+    ziel = os.path.join(archiv_pfad, PROCESSED_EVENTS_TABLE, f"date={tag.isoformat()}")
+    von, bis = tag.isoformat(), (tag + datetime.timedelta(days=1)).isoformat()
+    archiv_df = spark.read.jdbc(
+        url=db_url,
+        table=f"""(
+            SELECT event_timestamp, machine_key, machine_id, event_name, parameter_name, value, is_error, cycle_seq,
+                   cycle_time_seconds, anomaly_score
+            FROM {LESBARE_SICHT}
+            WHERE event_timestamp >= '{von} 00:00:00+00' AND event_timestamp < '{bis} 00:00:00+00'
+        ) AS archiv""",
+        predicates=[f"machine_key = {int(schluessel)}" for schluessel in sorted(maschinen_schluessel.values())] or ["TRUE"],
+        properties=db_properties
+    )
+    archiv_df.drop("machine_key") \
+        .sortWithinPartitions("machine_id", "event_timestamp") \
+        .write.mode("overwrite").option("compression", "zstd").partitionBy("machine_id").parquet(ziel)
+    print(f"Partition '{partition}' nach '{ziel}' archiviert.")
+
+
+def schreibe_events(events_df: DataFrame, schreibmodus: str, pg_params: dict, copy_parallelitaet: int,
+                    db_url: str, db_properties: dict, nach_maschine: bool, aufbewahrung_tage: int = None,
+                    archiv_pfad: str = None, ersetzen: dict = None) -> int:
+    # Anzahl per COPY geschriebener Zeilen; beim JDBC-Schreiben None (Spark zählt sie selbst als Ausgabezeilen)
+    # ersetzen (machine_id -> erstes Event): gespeicherte Events ab diesem Zeitpunkt werden per Partitionstausch ersetzt
+    ziele = [
+        (zeile["tag"], zeile["machine_id"])
+        for zeile in events_df.select(F.to_date("event_timestamp").alias("tag"), "machine_id").distinct().collect()
+    ]
+    conn = psycopg2.connect(**pg_params)
+    try:
+        # Namen -> smallint-Schlüssel der Dimensionstabellen; neue Namen erhalten dabei einen Schlüssel
+        schluessel = vergebe_alle_schluessel(conn, events_df)
+        ladeziele = plane_ladeziele(conn, PROCESSED_EVENTS_TABLE, ziele, schluessel["machine_id"], nach_maschine, ersetzen)
+        geschrieben = None
+        if schreibmodus == "copy":
+            # Alle Zieltabellen (je Tag bzw. Tag und Maschine) in einem Durchlauf über die Events
+            zuordnung_df = events_df.sparkSession.createDataFrame(
+                [(tag, machine_id, ziel_nr) for ziel_nr, ziel in enumerate(ladeziele) for tag, machine_id in ziel["schluessel"]],
+                LADEZIEL_SCHEMA
+            )
+            ziel_df = events_df \
+                .join(F.broadcast(zuordnung_df), on=[F.to_date(events_df["event_timestamp"]) == zuordnung_df["tag"],
+                                                     events_df["machine_id"] == zuordnung_df["ziel_machine_id"]]) \
+                .select(events_df.columns + ["ziel_nr"])
+            geschrieben = schreibe_per_copy_verteilt(
+                speicher_format(ziel_df, schluessel), "ziel_nr", [ziel["tabelle"] for ziel in ladeziele], pg_params, copy_parallelitaet
+            )
         else:
-             continue
+            for ziel in ladeziele:
+                bedingung = reduce(lambda a, b: a | b, [
+                    (F.to_date("event_timestamp") == F.lit(tag)) & (F.col("machine_id") == machine_id)
+                    for tag, machine_id in ziel["schluessel"]
+                ])
+                speicher_format(events_df.filter(bedingung), schluessel) \
+                    .write.jdbc(url=db_url, table=ziel["tabelle"], mode="append", properties=db_properties)
+        haenge_partitionen_an(conn, ladeziele)
+
+        if aufbewahrung_tage:
+            archivieren = None
+            if archiv_pfad:
+                archivieren = partial(archiviere_partition, events_df.sparkSession, db_url, db_properties, archiv_pfad,
+                                      lade_schluessel(conn, "machine_id"))
+            entferne_alte_partitionen(conn, PROCESSED_EVENTS_TABLE, aufbewahrung_tage, archivieren=archivieren)
+        return geschrieben
+    finally:
+        conn.close()
 
-        if fehler_bedingung_fuer_regel is not None:
-            gesamte_bedingung_fuer_diese_regel = ist_relevantes_event_und_parameter & fehler_bedingung_fuer_regel
-            fehler_bedingungen_liste.append(gesamte_bedingung_fuer_diese_regel)
 
-    if fehler_bedingungen_liste:
-        gesamte_fehler_bedingung = fehler_bedingungen_liste[0]
-        for bedingung in fehler_bedingungen_liste[1:]:
-            gesamte_fehler_bedingung = gesamte_fehler_bedingung | bedingung
-    else:
-        gesamte_fehler_bedingung = F.lit(False)
+def melde_laufmetriken(metriken: LaufMetriken, pg_params: dict):
+    # Fehlende Metriken sollen einen sonst erfolgreichen Lauf nicht abbrechen
+    try:
+        conn = psycopg2.connect(**pg_params)
+        try:
+            metriken.melde(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"WARNUNG: Laufmetriken konnten nicht gespeichert werden: {e}")
+
 
-    events_mit_fehler_spalte = events_df.withColumn(
-        "is_error",
-        F.when(gesamte_fehler_bedingung, 1).otherwise(0).cast(IntegerType())
+def pruefe_stapel(input_datei_namen: list, manifest: VerarbeitungsManifest) -> list:
+    # Unlesbare Dateien oder falsche Kopfzeilen scheitern einzeln, statt den ganzen Stapel abzubrechen
+    gueltige_dateien = []
+    for datei in input_datei_namen:
+        fehler = pruefe_datei(INPUT_DATA_PFAD_TEMPLATE.format(datei))
+        if fehler:
+            print(f"WARNUNG: '{datei}' wird übersprungen: {fehler}")
+            manifest.markiere(datei, STATUS_FEHLGESCHLAGEN, fehler=fehler)
+        else:
+            gueltige_dateien.append(datei)
+    return gueltige_dateien
+
+
+def zaehle_je_datei(events_df: DataFrame, input_datei_namen: list, staende: dict) -> dict:
+    # Datei -> (Zeilen, davon neu, Maschinen) für das Manifest; ersetzt im Stapelbetrieb die Abfrage der Maschinen.
+    # Neu sind wie in main() nur Events nach dem Wasserstand ihrer Maschine, nur sie werden geladen.
+    pfad_zu_datei = {os.path.abspath(INPUT_DATA_PFAD_TEMPLATE.format(datei)): datei for datei in input_datei_namen}
+    stand_df = events_df.sparkSession.createDataFrame(
+        [(machine_id, stand["last_event_timestamp"], stand["last_cycle_seq"]) for machine_id, stand in staende.items()],
+        STAND_SCHEMA
     )
+    ist_neu = F.col("last_event_timestamp").isNull() | (F.col("event_timestamp") > F.col("last_event_timestamp"))
+    zaehlung_df = events_df \
+        .withColumn("datei", F.input_file_name()) \
+        .join(F.broadcast(stand_df), on="machine_id", how="left") \
+        .groupBy("datei", "machine_id") \
+        .agg(F.count(F.lit(1)).alias("zeilen"), F.count(F.when(ist_neu, True)).alias("neu"))
+    je_datei = {datei: (0, 0, set()) for datei in input_datei_namen}
+    for zeile in zaehlung_df.collect():
+        datei = pfad_zu_datei[urllib.parse.unquote(urllib.parse.urlparse(zeile["datei"]).path)]
+        zeilen, neu, maschinen = je_datei[datei]
+        je_datei[datei] = (zeilen + zeile["zeilen"], neu + zeile["neu"], maschinen | {zeile["machine_id"]})
+    return {datei: (zeilen, neu, sorted(maschinen)) for datei, (zeilen, neu, maschinen) in je_datei.items()}
+
+
+def schliesse_manifest_ab(manifest: VerarbeitungsManifest, dateien: list, je_datei: dict = None, fehler: str = None):
+    if not manifest:
+        return
+    for datei in dateien:
+        if fehler:
+            manifest.markiere(datei, STATUS_FEHLGESCHLAGEN, fehler=fehler)
+            continue
+        zeilen, neu, maschinen = je_datei[datei]
+        if zeilen and not neu:
+            # Nichts geladen: die Maschinen sind bereits über diese Datei hinaus verarbeitet. Eine Wiederholung änderte
+            # daran nichts; übernehmen lässt sie sich nur mit --ersetzen zusammen mit den späteren Dateien.
+            print(f"WARNUNG: '{datei}' nicht geladen: alle {zeilen} Events liegen hinter dem Wasserstand.")
+            manifest.markiere(datei, STATUS_HINTER_WASSERSTAND, zeilen=0, maschinen=maschinen, verworfen=zeilen,
+                              fehler="Alle Events liegen hinter dem Wasserstand ihrer Maschine(n), nichts geladen.")
+            continue
+        if neu < zeilen:
+            print(f"WARNUNG: '{datei}': {zeilen - neu} von {zeilen} Events liegen hinter dem Wasserstand und wurden nicht geladen.")
+        manifest.markiere(datei, STATUS_OK, zeilen=neu, maschinen=maschinen, verworfen=zeilen - neu)
+    manifest.speichere()
+
+
+def pruefe_ersetzen(basis_events_df: DataFrame, staende: dict) -> dict:
+    # Erstes Event je Maschine; ersetzt werden kann nur bis zum Ende der Eingabe: spätere, bereits verarbeitete Events
+    # bauten auf den ersetzten Zyklen und dem Wasserstand auf
+    grenzen = basis_events_df.groupBy("machine_id") \
+        .agg(F.min("event_timestamp").alias("erstes"), F.max("event_timestamp").alias("letztes")) \
+        .collect()
+    for zeile in grenzen:
+        stand = staende.get(zeile["machine_id"])
+        letztes = zeile["letztes"].astimezone(datetime.timezone.utc)
+        if stand and stand["last_event_timestamp"] > letztes:
+            raise ValueError(
+                f"'{zeile['machine_id']}' ist bereits bis {stand['last_event_timestamp']} verarbeitet, die Eingabe endet "
+                f"{letztes}. Ersetzen ist nur für die jüngsten Events einer Maschine möglich."
+            )
+    return {zeile["machine_id"]: zeile["erstes"] for zeile in grenzen}
 
-    return events_mit_fehler_spalte
+
+def entferne_ersetzte_stunden(conn, staende: dict, ersatz_beginn: dict) -> set:
+    # Stunden-Zusammenfassung ab der ersten neu berechneten Stunde je Maschine löschen (ohne Festschreiben, vgl. upsert_zeilen);
+    # Rückgabe: betroffene (Tag, Maschine) für die Verdichtungen
+    tage = set()
+    with conn.cursor() as cur:
+        for machine_id, erstes in sorted(ersatz_beginn.items()):
+            if machine_id in staende:
+                ab = kontext_beginn(staende[machine_id])
+            else:
+                ab = erstes.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+            cur.execute(f"""
+                DELETE FROM {HOURLY_SUMMARY_TABLE}
+                WHERE machine_id = %s AND (summary_date, hour_of_day) >= (%s, %s)
+                RETURNING summary_date
+            """, (machine_id, ab.date(), ab.hour))
+            tage |= {(tag, machine_id) for tag, in cur.fetchall()}
+    return tage
 
 
 # Hauptfunktion
-def main(input_datei_name: str):
-    
+def main(input_datei_namen: list, datum: datetime.date = None, manifest: VerarbeitungsManifest = None,
+         ersetzen: bool = False):
+    # Mehrere Dateien (Stapelbetrieb) werden in einer Spark-Session und einem Lesevorgang verarbeitet; das Manifest
+    # erhält je Datei das Ergebnis.
+    # ersetzen: bereits verarbeitete Events der Maschinen ab dem ersten Event der Eingabe werden neu berechnet und
+    # ersetzt (korrigierte Rohdaten), statt sie anhand des Wasserstands zu überspringen
     spark: SparkSession = None
+    gueltige_dateien = pruefe_stapel(input_datei_namen, manifest) if manifest else input_datei_namen
+    if not gueltige_dateien:
+        schliesse_manifest_ab(manifest, [])
+        print("FEHLER: Keine verarbeitbare Eingabedatei.")
+        sys.exit(1)
+    eingabe_name = gueltige_dateien[0] if len(gueltige_dateien) == 1 else f"stapel_{len(gueltige_dateien)}_dateien"
+    je_datei = {}
 
     try:
-        app_name = f"MaschinenEventVerarbeitung_{os.path.basename(input_datei_name)}"
+        app_name = f"MaschinenEventVerarbeitung_{os.path.basename(eingabe_name)}" + (f"_{datum}" if datum else "")
         spark = SparkSession.builder \
             .appName(app_name) \
             .config("spark.sql.session.timeZone", "UTC") \
             .getOrCreate()
         
-        schwellwerte = {}
-        try:
-            with open(SCHWELLWERTE_PFAD, 'r', encoding='utf-8') as f:
-                schwellwerte = json.load(f)
-        except FileNotFoundError:
-            print(f"Schwellwert-Datei '{SCHWELLWERTE_PFAD}' nicht gefunden.")
-        except json.JSONDecodeError as e:
-            print(f"Schwellwert-Datei '{SCHWELLWERTE_PFAD}' ist ungültiges JSON: {e}.")
-            raise
-        except Exception as e:
-            print(f"Unerwarteter Fehler beim Laden der Schwellwerte: {e}")
-
-        db_host = os.environ.get('DB_HOST')
-        db_name = os.environ.get('DB_NAME')
-        db_user = os.environ.get('DB_USER')
-        db_pass = os.environ.get('DB_PASS')
-        if not all([db_host, db_name, db_user, db_pass]):
-            raise ValueError("FEHLER: DB-Zugangsdaten (DB_HOST, DB_NAME, DB_USER, DB_PASS) nicht vollständig gesetzt!")
-        db_url = f"jdbc:postgresql://{db_host}:5432/{db_name}"
-        db_properties = {"user": db_user, "password": db_pass, "driver": DB_DRIVER}
-
-        input_schema = StructType([
-            StructField("timestamp", StringType(), True), StructField("machine_id", StringType(), True),
-            StructField("event_name", StringType(), True), StructField("parameter_name", StringType(), True),
-            StructField("value", StringType(), True)
-        ])
-        input_pfad = INPUT_DATA_PFAD_TEMPLATE.format(input_datei_name)
-        print(f"Lese Rohdaten aus CSV: '{input_pfad}'")
-        rohdaten_df = spark.read.csv(input_pfad, header=True, schema=input_schema, timestampFormat=TIMESTAMP_FORMAT_INPUT)
-
-        basis_events_df = rohdaten_df \
-            .withColumn("event_timestamp", F.to_timestamp(F.col("timestamp"), TIMESTAMP_FORMAT_INPUT)) \
-            .withColumn("value_float", F.col("value").cast(FloatType())) \
-            .fillna("", subset=["parameter_name"]) \
-            .dropna(subset=["event_timestamp", "machine_id", "event_name"]) \
-            .drop("timestamp", "value") \
-            .withColumnRenamed("value_float", "value") \
-            .filter(F.col("event_timestamp").isNotNull())
-
-        events_mit_zyklus_nr_df, zyklus_zeiten_df = berechne_zyklen(basis_events_df)
-        events_mit_fehler_df = finde_fehler_basierend_auf_schwellwerten(events_mit_zyklus_nr_df, schwellwerte)
-
-        finale_events_df = events_mit_fehler_df.join(
-            zyklus_zeiten_df.select("machine_id", "cycle_seq", "cycle_time_seconds"),
-            on=["machine_id", "cycle_seq"],
-            how="left"
-        )
-        finale_events_gerundet_df = finale_events_df.withColumn(
-            "cycle_time_seconds", F.round(F.col("cycle_time_seconds"), 3)
-        )
-        events_zum_speichern_df = finale_events_gerundet_df.select(
-            "event_timestamp", "machine_id", "event_name", "parameter_name",
-            "value", "is_error", "cycle_seq", "cycle_time_seconds"
-        )
-        try:
-            events_zum_speichern_df.write.jdbc(
-                url=db_url, table=PROCESSED_EVENTS_TABLE, mode="append", properties=db_properties
+        schwellwerte = lade_schwellwerte()
+        kennzahlen = lade_kennzahlen()
+        db_url, db_properties, pg_params = lade_db_konfiguration()
+
+        events_schreibmodus, partition_nach_maschine, aufbewahrung_tage, archiv_pfad = lade_schreib_konfiguration()
+        plan_konfiguration = lade_plan_konfiguration()
+        anomalie_alpha, anomalie_min_anzahl = lade_anomalie_konfiguration()
+        # Die Module werden in den Python-Workern für foreachPartition bzw. applyInPandas benötigt
+        spark.sparkContext.addPyFile(bulk_loader.__file__)
+        spark.sparkContext.addPyFile(anomalie.__file__)
+
+        metriken = LaufMetriken(spark, "daily_aggregator", eingabe_name + (f" {datum}" if datum else ""))
+
+        with metriken.schritt("lesen"):
+            input_pfade = [INPUT_DATA_PFAD_TEMPLATE.format(datei) for datei in gueltige_dateien]
+            geschaetzte_bytes = eingabe_bytes(input_pfade, datum)
+            if len(input_pfade) == 1:
+                basis_events_df = lese_rohdaten(spark, input_pfade[0], datum)
+            else:
+                basis_events_df = lese_csv(spark, input_pfade)
+
+            if manifest:
+                # Stand aller Maschinen vorab (eine Zeile je Maschine): die Zählung je Datei trennt damit geladene
+                # Events von solchen hinter dem Wasserstand. Beim Ersetzen wird jedes Event der Eingabe geladen.
+                conn = psycopg2.connect(**pg_params)
+                try:
+                    alle_staende = {} if ersetzen else lade_verarbeitungsstand(conn)
+                finally:
+                    conn.close()
+                je_datei = zaehle_je_datei(basis_events_df, gueltige_dateien, alle_staende)
+                maschinen = sorted({machine_id for *_, datei_maschinen in je_datei.values() for machine_id in datei_maschinen})
+            else:
+                maschinen = [zeile["machine_id"] for zeile in basis_events_df.select("machine_id").distinct().collect()]
+            # Ab hier (erster Shuffle nach machine_id) mit an Eingabe und Maschinenzahl angepassten Einstellungen
+            plan = plane_ausfuehrung(geschaetzte_bytes, len(maschinen), spark.sparkContext.defaultParallelism, plan_konfiguration)
+            wende_plan_an(spark, plan)
+            copy_parallelitaet = plan["schreib_parallelitaet"]
+            # Spark-JDBC schreibt mit höchstens so vielen Verbindungen wie beim COPY
+            db_properties["numPartitions"] = str(copy_parallelitaet)
+            conn = psycopg2.connect(**pg_params)
+            try:
+                staende = lade_verarbeitungsstand(conn, maschinen)
+                ersatz_beginn = None
+                if ersetzen:
+                    ersatz_beginn = pruefe_ersetzen(basis_events_df, staende)
+                    # Stand und EWMA-Zustand vor dem ersten Event der Eingabe: alles danach wird wie neu verarbeitet
+                    staende = stand_vor(conn, PROCESSED_EVENTS_TABLE, ersatz_beginn)
+                    anomalie_statistik = statistik_vor(conn, PROCESSED_EVENTS_TABLE, ersatz_beginn, anomalie_alpha)
+                else:
+                    anomalie_statistik = lade_statistik(conn, maschinen)
+            finally:
+                conn.close()
+
+        with metriken.schritt("fehler_und_zyklen") as schritt:
+            # Nur Events nach dem Wasserstand der jeweiligen Maschine; die Zyklusnummerierung setzt beim letzten cycle_seq fort
+            stand_df = spark.createDataFrame(
+                [(machine_id, stand["last_event_timestamp"], stand["last_cycle_seq"]) for machine_id, stand in staende.items()],
+                STAND_SCHEMA
             )
-        except Exception as e:
-            print(f"FEHLER beim Speichern der Events in '{PROCESSED_EVENTS_TABLE}': {e}")
-            traceback.print_exc()
-
-        zyklen_mit_stunde_df = zyklus_zeiten_df \
-            .withColumn("summary_date", F.date_format(F.col("cycle_start_ts"), DATE_FORMAT_SUMMARY).cast(DateType())) \
-            .withColumn("hour_of_day", F.hour(F.col("cycle_start_ts"))) \
-            .filter(F.col("summary_date").isNotNull())
-
-        zyklus_summary_df = zyklen_mit_stunde_df \
-            .groupBy("summary_date", "hour_of_day", "machine_id") \
-            .agg(
-                F.countDistinct("cycle_seq").alias("cycle_count"),
-                F.avg("cycle_time_seconds").alias("avg_cycle_time_seconds"),
-                F.min("cycle_time_seconds").alias("min_cycle_time_seconds"), 
-                F.max("cycle_time_seconds").alias("max_cycle_time_seconds") 
+            neue_events_df = basis_events_df \
+                .join(F.broadcast(stand_df), on="machine_id", how="left") \
+                .filter(F.col("last_event_timestamp").isNull() | (F.col("event_timestamp") > F.col("last_event_timestamp"))) \
+                .drop("last_event_timestamp")
+
+            # Fehlerprüfung ist zeilenweise und läuft vor der Zyklusberechnung: Events und Zyklen stammen aus demselben,
+            # einmal berechneten und gecachten Sortierlauf
+            events_df = finde_fehler_basierend_auf_schwellwerten(neue_events_df, schwellwerte) \
+                .withColumn("cycle_seq", F.lit(None).cast(LongType())) \
+                .withColumn("ist_neu", F.lit(True))
+
+            if staende:
+                # Bereits gespeicherte Events der betroffenen Stunden: schließen über die Dateigrenze laufende Zyklen
+                # und gehen in die Neuberechnung der Stunden-Zusammenfassung ein
+                conn = psycopg2.connect(**pg_params)
+                try:
+                    kontext_sql = kontext_abfrage(conn, LESBARE_SICHT, staende)
+                finally:
+                    conn.close()
+                kontext_df = spark.read.jdbc(url=db_url, table=f"({kontext_sql}) AS kontext", properties=db_properties) \
+                    .select(
+                        "event_timestamp", "machine_id", "event_name", "parameter_name",
+                        F.col("value").cast(FloatType()).alias("value"), F.col("is_error").cast(IntegerType()).alias("is_error"),
+                        "cycle_seq", F.lit(False).alias("ist_neu")
+                    )
+                events_df = events_df.unionByName(kontext_df, allowMissingColumns=True)
+
+            # Der einzige Shuffle der Events: einmal nach machine_id verteilt genügt er der Nummerierung, dem Zyklus-Window
+            # (machine_id, cycle_seq), der Anomalie-Bewertung, den Zyklen und der Zusammenfassung je Maschine.
+            # Die Anzahl Partitionen kommt aus dem Ausführungsplan, AQE fasst leere und kleine zusammen.
+            events_mit_zyklus_nr_df = nummeriere_zyklen(events_df.repartition("machine_id"), "last_cycle_seq", "ist_neu") \
+                .drop("last_cycle_seq")
+            events_mit_zyklus_df, _ = berechne_zyklus_grenzen(events_mit_zyklus_nr_df)
+            # Anomalie-Bewertung auf den bereits nach Maschine verteilten und sortierten Events, ohne weiteren Shuffle
+            events_mit_zyklus_df = bewerte_anomalien(events_mit_zyklus_df, anomalie_statistik, anomalie_alpha, anomalie_min_anzahl)
+            events_mit_zyklus_df.persist(StorageLevel.MEMORY_AND_DISK)
+            # Fehlerprüfung, Zyklen und Anomalien laufen in denselben Spark-Stages; count() füllt den Cache, den alle weiteren Schritte lesen
+            schritt["ausgabe_zeilen"] = events_mit_zyklus_df.count()
+
+        with metriken.schritt("events_schreiben") as schritt:
+            finale_events_gerundet_df = events_mit_zyklus_df.filter(F.col("ist_neu")).withColumn(
+                "cycle_time_seconds", F.round(F.col("cycle_time_seconds"), 3)
             )
-
-        events_mit_zyklus_start_df = events_mit_fehler_df.join(
-            zyklus_zeiten_df.select("machine_id", "cycle_seq", "cycle_start_ts"),
-            on=["machine_id", "cycle_seq"], how="left"
-        )
-        events_mit_stunde_df = events_mit_zyklus_start_df \
-             .withColumn("summary_date", F.date_format(F.col("cycle_start_ts"), DATE_FORMAT_SUMMARY).cast(DateType())) \
-             .withColumn("hour_of_day", F.hour(F.col("cycle_start_ts"))) \
-             .filter(F.col("summary_date").isNotNull())
-
-        event_summary_df = events_mit_stunde_df \
-             .groupBy("summary_date", "hour_of_day", "machine_id") \
-             .agg(
-                 F.avg(F.when((F.col("event_name") == "Pick_Check") & (F.col("parameter_name") == "PP_Force"), F.col("value"))).alias("avg_pick_force"),
-                 F.max(F.when((F.col("event_name") == "Pick_Check") & (F.col("parameter_name") == "PP_Force"), F.col("value"))).alias("max_pick_force"),
-                 F.min(F.when((F.col("event_name") == "Pick_Check") & (F.col("parameter_name") == "PP_Force"), F.col("value"))).alias("min_pick_force"),
-                 F.avg(F.when((F.col("event_name") == "Place_Check") & (F.col("parameter_name") == "PP_Force"), F.col("value"))).alias("avg_place_force"),
-                 F.max(F.when((F.col("event_name") == "Place_Check") & (F.col("parameter_name") == "PP_Force"), F.col("value"))).alias("max_place_force"),
-                 F.min(F.when((F.col("event_name") == "Place_Check") & (F.col("parameter_name") == "PP_Force"), F.col("value"))).alias("min_place_force"),
-                 F.sum(F.when((F.col("parameter_name") == "AS_VacuumUnits") & (F.col("event_name") == "AS_Check") & (F.col("is_error") == 1), 1).otherwise(0)).alias("as_vacuum_error_count"),
-                 F.sum(F.when((F.col("parameter_name") == "PP_VacuumUnits") & (F.col("event_name") == "Pick_Check") & (F.col("is_error") == 1), 1).otherwise(0)).alias("pp_vacuum_error_count"),
-                 F.sum(F.when((F.col("parameter_name") == "AS_VacuumUnits") & (F.col("event_name") == "AS_Blowoff_Check") & (F.col("is_error") == 1), 1).otherwise(0)).alias("as_release_error_count"),
-                 F.sum(F.when((F.col("parameter_name") == "PP_VacuumUnits") & (F.col("event_name") == "Place_Check") & (F.col("is_error") == 1), 1).otherwise(0)).alias("pp_release_error_count"),
-                 F.sum(F.when((F.col("parameter_name") == "PP_Force") & (F.col("event_name") == "Pick_Check") & (F.col("is_error") == 1), 1).otherwise(0)).alias("pick_force_error_count"),
-                 F.sum(F.when((F.col("parameter_name") == "PP_Force") & (F.col("event_name") == "Place_Check") & (F.col("is_error") == 1), 1).otherwise(0)).alias("place_force_error_count"),
-                 F.sum("is_error").alias("total_error_count")
-             )
-
-        stunden_zusammenfassung_df = zyklus_summary_df.join(
-            event_summary_df,
-            on=["summary_date", "hour_of_day", "machine_id"],
-            how="outer"
-        ).fillna(0, subset=[
-            "cycle_count", "avg_cycle_time_seconds", "min_cycle_time_seconds", "max_cycle_time_seconds",
-            "avg_pick_force", "max_pick_force", "min_pick_force", "avg_place_force", "max_place_force", "min_place_force",
-            "as_vacuum_error_count", "pp_vacuum_error_count", "as_release_error_count", "pp_release_error_count",
-            "pick_force_error_count", "place_force_error_count", "total_error_count"
-        ])
-        
-        stunden_zusammenfassung_gerundet_df = stunden_zusammenfassung_df \
-            .withColumn("min_cycle_time_seconds", F.round(F.col("min_cycle_time_seconds"), 3)) \
-            .withColumn("max_cycle_time_seconds", F.round(F.col("max_cycle_time_seconds"), 3)) \
-            .withColumn("avg_cycle_time_seconds", F.round(F.col("avg_cycle_time_seconds"), 3)) \
-            .withColumn("avg_pick_force", F.round(F.col("avg_pick_force"), 2)) \
-            .withColumn("max_pick_force", F.round(F.col("max_pick_force"), 2)) \
-            .withColumn("min_pick_force", F.round(F.col("min_pick_force"), 2)) \
-            .withColumn("avg_place_force", F.round(F.col("avg_place_force"), 2)) \
-            .withColumn("max_place_force", F.round(F.col("max_place_force"), 2)) \
-            .withColumn("min_place_force", F.round(F.col("min_place_force"), 2))
-
-        zusammenfassung_zum_speichern_df = stunden_zusammenfassung_gerundet_df.select(
-            "summary_date", "hour_of_day", "machine_id",
-            "avg_pick_force", "max_pick_force", "min_pick_force",
-            "avg_place_force", "max_place_force", "min_place_force",
-            "as_vacuum_error_count", "pp_vacuum_error_count",
-            "as_release_error_count", "pp_release_error_count",
-            "pick_force_error_count", "place_force_error_count",
-            "cycle_count", "min_cycle_time_seconds",
-            "max_cycle_time_seconds", "avg_cycle_time_seconds"
-        )
-        try:
-            zusammenfassung_zum_speichern_df.write.jdbc(
-                url=db_url, table=HOURLY_SUMMARY_TABLE, mode="append", properties=db_properties
+            events_zum_speichern_df = finale_events_gerundet_df.select(
+                "event_timestamp", "machine_id", "event_name", "parameter_name",
+                "value", "is_error", "cycle_seq", "cycle_time_seconds", "anomaly_score"
             )
-        except Exception as e:
-            if "duplicate key value violates unique constraint" in str(e).lower() and "hourly_machine_summary_pkey" in str(e).lower():
-                 print(f"Primary Key-Verletzung beim einfügen in '{HOURLY_SUMMARY_TABLE}'Übersprungen.")
-            else:
-                print(f"FEHLER beim Anhängen der Zusammenfassung an '{HOURLY_SUMMARY_TABLE}': {e}")
-                traceback.print_exc()
+            keine_neuen_events = events_zum_speichern_df.isEmpty()
+            if not keine_neuen_events:
+                if not ersetzen:
+                    # Ein wiederholter Lauf nach einem Abbruch zwischen Events und Wasserstand schreibt keine Zeile doppelt
+                    erste_neue = events_zum_speichern_df.groupBy("machine_id").agg(F.min("event_timestamp").alias("erstes")).collect()
+                    conn = psycopg2.connect(**pg_params)
+                    try:
+                        entferne_abgebrochene_events(conn, PROCESSED_EVENTS_TABLE, staende,
+                                                     {zeile["machine_id"]: zeile["erstes"] for zeile in erste_neue})
+                    finally:
+                        conn.close()
+                try:
+                    schritt["ausgabe_zeilen"] = schreibe_events(
+                        events_zum_speichern_df, events_schreibmodus, pg_params, copy_parallelitaet,
+                        db_url, db_properties, partition_nach_maschine, aufbewahrung_tage, archiv_pfad, ersatz_beginn
+                    )
+                except Exception as e:
+                    print(f"FEHLER beim Speichern der Events in '{PROCESSED_EVENTS_TABLE}': {e}")
+                    raise
+
+                offene_maschinen = [machine_id for machine_id, stand in staende.items() if stand["open_cycle_start_ts"]]
+                if offene_maschinen:
+                    geschlossene_zyklen = events_mit_zyklus_df \
+                        .filter(~F.col("ist_neu") & (F.col("event_name") == CYCLE_START_EVENT)) \
+                        .filter(reduce(lambda a, b: a | b, [
+                            (F.col("machine_id") == machine_id) & (F.col("cycle_seq") == staende[machine_id]["last_cycle_seq"])
+                            for machine_id in offene_maschinen
+                        ])) \
+                        .select("machine_id", F.round("cycle_time_seconds", 3).alias("cycle_time_seconds")) \
+                        .collect()
+                    if geschlossene_zyklen:
+                        conn = psycopg2.connect(**pg_params)
+                        try:
+                            schliesse_zyklen(conn, PROCESSED_EVENTS_TABLE, staende,
+                                             {zeile["machine_id"]: zeile["cycle_time_seconds"] for zeile in geschlossene_zyklen})
+                        finally:
+                            conn.close()
+
+        if keine_neuen_events:
+            print(f"Keine neuen Events in '{eingabe_name}' (bereits bis zum Wasserstand verarbeitet).")
+            melde_laufmetriken(metriken, pg_params)
+            schliesse_manifest_ab(manifest, gueltige_dateien, je_datei)
+            return
+
+        conn = psycopg2.connect(**pg_params)
+        try:
+            with metriken.schritt("zyklen") as schritt:
+                # Aus den gecachten, nach machine_id verteilten Events derselben Zyklusberechnung; mitgelesene Zyklen
+                # ohne neue Events sind bereits gespeichert
+                ergaenze_zyklen_spalten(conn, kennzahlen)
+                schritt["ausgabe_zeilen"] = schreibe_maschinen_zyklen(
+                    conn, berechne_maschinen_zyklen(events_mit_zyklus_df, kennzahlen, "ist_neu"),
+                    events_schreibmodus, pg_params, copy_parallelitaet, db_url, db_properties
+                )
+
+            with metriken.schritt("zusammenfassung") as schritt:
+                zusammenfassung_zum_speichern_df = berechne_stunden_zusammenfassung(events_mit_zyklus_df, kennzahlen)
+                # Nur Stunden ab dem Kontext-Beginn enthalten Zyklen mit Cycle_Start: genau diese Stunden werden ersetzt
+                ergaenze_summary_spalten(conn, HOURLY_SUMMARY_TABLE, kennzahlen)
+                for tabelle in (TAGES_TABELLE, WOCHEN_TABELLE):
+                    ergaenze_summary_spalten(conn, tabelle, kennzahlen, mit_avg=False)
+                zusammenfassung_zeilen = zusammenfassung_zum_speichern_df.collect()
+                tage = {(zeile["summary_date"], zeile["machine_id"]) for zeile in zusammenfassung_zeilen}
+                # Stunden und Verdichtungen in einer Transaktion: ein Abbruch hinterlässt keine halb geschriebenen Stunden
+                if ersetzen:
+                    # Stunden der ersetzten Events, die in der neuen Eingabe nicht mehr vorkommen, entfallen
+                    tage |= entferne_ersetzte_stunden(conn, staende, ersatz_beginn)
+                schritt["ausgabe_zeilen"] = upsert_zeilen(
+                    conn, HOURLY_SUMMARY_TABLE, zusammenfassung_zum_speichern_df.columns, SUMMARY_SCHLUESSEL,
+                    [tuple(zeile) for zeile in zusammenfassung_zeilen], festschreiben=False
+                )
+                aktualisiere_verdichtungen(conn, kennzahlen, sorted(tage), festschreiben=False)
+                conn.commit()
+
+            with metriken.schritt("verarbeitungsstand"):
+                # Wasserstand erst nach erfolgreichem Schreiben fortschreiben
+                # Offener Zyklus: letzter Cycle_Start ohne nachfolgendes Cycle_End (cycle_time_seconds ist dort 0, nicht NULL)
+                letzter_start_seq = F.max(F.when(F.col("event_name") == CYCLE_START_EVENT, F.col("cycle_seq")))
+                letzter_end_seq = F.max(F.when(F.col("event_name") == CYCLE_END_EVENT, F.col("cycle_seq")))
+                neue_staende = events_mit_zyklus_df \
+                    .groupBy("machine_id") \
+                    .agg(
+                        F.date_format(F.max("event_timestamp"), COPY_TIMESTAMP_FORMAT).alias("last_event_timestamp"),
+                        F.max("cycle_seq").alias("last_cycle_seq"),
+                        F.date_format(
+                            F.when(
+                                letzter_start_seq > F.coalesce(letzter_end_seq, F.lit(0)),
+                                F.max(F.when(F.col("event_name") == CYCLE_START_EVENT, F.col("event_timestamp")))
+                            ),
+                            COPY_TIMESTAMP_FORMAT
+                        ).alias("open_cycle_start_ts")
+                    ) \
+                    .collect()
+                # EWMA-Zustand und Wasserstand gemeinsam festschreiben: ein wiederholter Lauf zählt keinen Messwert doppelt,
+                # beim Ersetzen baut der Zustand auf dem Stand vor den ersetzten Messwerten auf
+                if ersetzen:
+                    setze_statistik_zurueck(conn, ersatz_beginn, anomalie_statistik)
+                speichere_statistik(conn, neue_statistik(events_mit_zyklus_df), festschreiben=False)
+                speichere_verarbeitungsstand(conn, [zeile.asDict() for zeile in neue_staende])
+                setze_verarbeitungsmarker(conn, "daily_aggregator")
+        finally:
+            conn.close()
+
+        melde_laufmetriken(metriken, pg_params)
+        schliesse_manifest_ab(manifest, gueltige_dateien, je_datei)
 
     except ValueError as ve:
         print(f"Konfigurations- oder Daten-Fehler: {ve}")
+        schliesse_manifest_ab(manifest, gueltige_dateien, fehler=str(ve))
         if spark: spark.stop()
         sys.exit(1)
     except Exception as e:
         print(f"Unerwarteter Fehler: {e}")
         traceback.print_exc()
+        schliesse_manifest_ab(manifest, gueltige_dateien, fehler=str(e))
         if spark: spark.stop()
         sys.exit(1)
 
@@ -289,18 +649,58 @@ def main(input_datei_name: str):
             print("Spark Session wird beendet.")
             spark.stop()
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        datei_name_arg = sys.argv[1]
-        if not datei_name_arg or "/" in datei_name_arg or "\\" in datei_name_arg or not datei_name_arg.lower().endswith(".csv"):
-             print(f"FEHLER: Ungültiger Dateiname '{datei_name_arg}'. Nur Dateiname erwartet.")
-             sys.exit(1)
+def lies_argumente(argumente: list):
+    parser = argparse.ArgumentParser(
+        description="Verarbeitet Maschinen-Events aus /data/raw (eine Datei bzw. ein Parquet-Dataset oder ein Stapel von CSV-Dateien).",
+        epilog="Beispiele: daily_aggregator.py machine_event_logs.parquet 2024-10-16 | daily_aggregator.py daten.csv | "
+               "daily_aggregator.py --batch 'nacht_2024-10-16/*.csv' | daily_aggregator.py --wiederholen | "
+               "daily_aggregator.py --ersetzen machine_event_logs.parquet 2024-10-16"
+    )
+    parser.add_argument("eingabe", nargs="?", help="Name einer CSV-Datei oder eines Parquet-Datasets in /data/raw")
+    parser.add_argument("datum", nargs="?", help="Nur dieser Tag des Parquet-Datasets, z. B. 2024-10-16")
+    parser.add_argument("--batch", metavar="MUSTER", help="Glob oder Verzeichnis relativ zu /data/raw: alle CSV-Dateien in einem Lauf")
+    parser.add_argument("--manifest", default=INPUT_DATA_PFAD_TEMPLATE.format(MANIFEST_NAME),
+                        help="Manifest mit dem Ergebnis je Datei (Stapelbetrieb)")
+    parser.add_argument("--wiederholen", action="store_true", help="Nur die im Manifest als fehlgeschlagen markierten Dateien verarbeiten")
+    parser.add_argument("--ersetzen", action="store_true",
+                        help="Bereits verarbeitete Events ab dem ersten Event der Eingabe je Maschine neu berechnen und ersetzen")
+    args = parser.parse_args(argumente)
+
+    if sum(bool(option) for option in (args.eingabe, args.batch, args.wiederholen)) != 1:
+        parser.error("Genau eine Eingabe angeben: Dateiname, --batch MUSTER oder --wiederholen.")
+    if (args.batch or args.wiederholen) and args.datum:
+        parser.error("Ein Datum ist nur für ein einzelnes Parquet-Dataset vorgesehen.")
+    datum = None
+    if args.datum:
+        try:
+            datum = datetime.date.fromisoformat(args.datum)
+        except ValueError:
+            parser.error(f"Ungültiges Datum '{args.datum}'. Erwartet z. B. 2024-10-16")
+
+    if args.eingabe:
+        datei_name = args.eingabe.rstrip("/")
+        if not datei_name or "/" in datei_name or "\\" in datei_name or not datei_name.lower().endswith(CSV_ENDUNGEN + (PARQUET_ENDUNG,)):
+            parser.error(f"Ungültiger Name '{datei_name}'. Nur Name einer CSV-Datei oder eines Parquet-Datasets erwartet.")
+        return [datei_name], datum, None, args.ersetzen
+
+    manifest = VerarbeitungsManifest(args.manifest)
+    if args.wiederholen:
+        dateien = manifest.fehlgeschlagene()
+        if not dateien:
+            print(f"Keine fehlgeschlagenen Dateien in '{args.manifest}'.")
+            sys.exit(0)
     else:
-        print("FEHLER: Name der CSV-Datei als Argument benötigt.")
-        print("Beispiel: python daily_aggregator.py daten.csv")
-        sys.exit(1)
-    print("Starte Verarbeitung der Datei '{datei_name_arg}'")
-    main(datei_name_arg)
+        try:
+            dateien = finde_dateien(os.path.dirname(INPUT_DATA_PFAD_TEMPLATE.format("")), args.batch)
+        except ValueError as e:
+            parser.error(str(e))
+    return dateien, None, manifest, args.ersetzen
+
+
+if __name__ == "__main__":
+    datei_namen_arg, datum_arg, manifest_arg, ersetzen_arg = lies_argumente(sys.argv[1:])
+    beschreibung = datei_namen_arg[0] if len(datei_namen_arg) == 1 else f"{len(datei_namen_arg)} Dateien"
+    print(f"Starte Verarbeitung von '{beschreibung}'" + (f" für {datum_arg}" if datum_arg else ""))
+    main(datei_namen_arg, datum_arg, manifest_arg, ersetzen_arg)
 
-    print(f"Verarbeitung der Datei '{datei_name_arg}' abgeschlossen.")
-    
\ No newline at end of file
+    print(f"Verarbeitung von '{beschreibung}' abgeschlossen.")
@@ -1,38 +1,74 @@
 import streamlit as st
-import pandas as pd
-import psycopg2
 import os
 import traceback
 import datetime
-import plotly.graph_objects as go
+from dashboard_db import VerbindungsPool, AbfrageCache
 
+# Zeitraum-Ansicht: gröbste Verdichtung, die für den Zeitraum noch genug Punkte liefert
+MAX_TAGE_STUENDLICH = 3
+MAX_TAGE_TAEGLICH = 120
+AUFLOESUNGEN = {"stunde": "Stündlich", "tag": "Täglich", "woche": "Wöchentlich"}
+# Ab dieser Punktzahl je Spur zeichnet plotly per WebGL (Scattergl) statt SVG: lange Reihen bleiben beim Zoomen flüssig
+SCATTERGL_AB_PUNKTE = 1000
+# Drill-down auf Rohdaten: Verlauf auf min/max je Pixelspalte verdichtet (in SQL), Tabelle seitenweise nach ganzen Zyklen
+DRILLDOWN_PUNKTE = 1000
+DRILLDOWN_SEITE_ZEILEN = 2000
+DRILLDOWN_MAX_FEHLER = 5000
+# Zyklen, die in der Stunde beginnen, enden spätestens so lange nach Stundenende (begrenzt die gelesenen Partitionen)
+ZYKLUS_PUFFER = datetime.timedelta(hours=1)
+MESSWERTE = {
+    ("Pick_Check", "PP_Force"): "Pick Kraft (g)",
+    ("Place_Check", "PP_Force"): "Place Kraft (g)",
+    ("AS_Check", "AS_VacuumUnits"): "AS Vakuum",
+    ("Pick_Check", "PP_VacuumUnits"): "PP Vakuum",
+    ("AS_Blowoff_Check", "AS_VacuumUnits"): "AS Vakuum (Blowoff)",
+    ("Place_Check", "PP_VacuumUnits"): "PP Vakuum (Place)"
+}
+# Seite „Läufe“: Laufzeiten der letzten Läufe aus pipeline_run_metrics (siehe lauf_metriken.py)
+MAX_LAEUFE = 200
+# Verdichtungen speichern Mittelwerte als Summe/Anzahl (siehe verdichtung.py)
+ROLLUP_SPALTEN_SQL = """
+    machine_id,
+    ROUND(pick_force_sum / NULLIF(pick_force_count, 0), 2) AS avg_pick_force, max_pick_force, min_pick_force,
+    ROUND(place_force_sum / NULLIF(place_force_count, 0), 2) AS avg_place_force, max_place_force, min_place_force,
+    as_vacuum_error_count, pp_vacuum_error_count,
+    as_release_error_count, pp_release_error_count,
+    pick_force_error_count, place_force_error_count,
+    cycle_count, ROUND(sum_cycle_time_seconds / NULLIF(cycle_count, 0), 3) AS avg_cycle_time_seconds,
+    min_cycle_time_seconds, max_cycle_time_seconds
+"""
 
+
+# Pool und Cache gelten für alle Sessions des Prozesses (st.cache_resource)
 @st.cache_resource
-def get_db_connection():
+def get_query_cache():
     try:
-        conn = psycopg2.connect(
+        pool = VerbindungsPool(
+            1, int(os.environ.get('DASHBOARD_MAX_VERBINDUNGEN', '8')),
             host=os.environ.get('DB_HOST', 'postgres_db'),
             database=os.environ.get('DB_NAME', 'manufacturing_db'),
             user=os.environ.get('DB_USER'),
             password=os.environ.get('DB_PASS'),
-            port=5432
+            port=5432,
+            connect_timeout=10
         )
-        return conn
+        return AbfrageCache(pool, int(os.environ.get('DASHBOARD_CACHE_MB', '256')) * 1024 * 1024)
     except Exception as e:
         st.error(f"Fehler bei Datenbankverbindung: {e}")
         traceback.print_exc()
         return None
 
 
-@st.cache_data(ttl=600)
-def get_available_dates(_conn):
+def get_available_dates(cache):
+    # Kalender-Tabelle (verdichtung.py) statt SELECT DISTINCT über alle Stunden
+    import pandas as pd
     try:
         query = """
-            SELECT DISTINCT summary_date
-            FROM hourly_machine_summary
+            SELECT summary_date
+            FROM available_dates
             ORDER BY summary_date DESC;
         """
-        df = pd.read_sql_query(query, _conn)
+        df = cache.abfrage("verfuegbare_tage", query)
         df['summary_date'] = pd.to_datetime(df['summary_date']).dt.date
         return df
     except Exception as e:
@@ -41,8 +77,28 @@ def get_available_dates(_conn):
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=600)
-def load_summary_data(_conn, selected_date):
+def baue_kalender(date_df):
+    # Jahr -> Monat -> Tage für die Datumsauswahl in einem Durchlauf (vektorisiert über .dt), absteigend wie date_df
+    import pandas as pd
+    tage = pd.to_datetime(date_df['summary_date'])
+    kalender = {}
+    for jahr, monat, tag in zip(tage.dt.year.tolist(), tage.dt.month.tolist(), tage.dt.day.tolist()):
+        kalender.setdefault(jahr, {}).setdefault(monat, []).append(tag)
+    return kalender
+
+
+def load_maschinen(cache):
+    try:
+        df = cache.abfrage("maschinen", "SELECT machine_id FROM dim_machine ORDER BY machine_id;")
+        return df['machine_id'].tolist()
+    except Exception as e:
+        st.error(f"Fehler beim Laden der Maschinen: {e}")
+        traceback.print_exc()
+        return []
+
+
+def load_summary_data(cache, selected_date, maschinen):
+    import pandas as pd
     try:
         query = """
             SELECT
@@ -55,12 +111,12 @@ def load_summary_data(_conn, selected_date):
                 cycle_count, avg_cycle_time_seconds,
                 min_cycle_time_seconds, max_cycle_time_seconds
             FROM hourly_machine_summary
-            WHERE summary_date = %(date)s
+            WHERE summary_date = %(date)s AND machine_id IN %(maschinen)s
             ORDER BY hour_of_day ASC;
         """
-        df = pd.read_sql_query(query, _conn, params={"date": selected_date})
+        df = cache.abfrage("stunden_eines_tages", query, {"date": selected_date, "maschinen": tuple(maschinen)}, copy=True)
         if not df.empty:
-            df['timestamp_hour'] = pd.to_datetime(df['summary_date']) + pd.to_timedelta(df['hour_of_day'], unit='h')
+            df['zeitpunkt'] = pd.to_datetime(df['summary_date']) + pd.to_timedelta(df['hour_of_day'], unit='h')
         return df
     except Exception as e:
         st.error(f"Fehler beim Laden der Daten für {selected_date}: {e}")
@@ -68,10 +124,181 @@ def load_summary_data(_conn, selected_date):
         return pd.DataFrame()
 
 
+def waehle_aufloesung(von, bis):
+    tage = (bis - von).days + 1
+    if tage <= MAX_TAGE_STUENDLICH:
+        return "stunde"
+    return "tag" if tage <= MAX_TAGE_TAEGLICH else "woche"
+
+
+def load_range_data(cache, von, bis, aufloesung, maschinen):
+    # Eine Abfrage für den ganzen Zeitraum und alle gewählten Maschinen, gefiltert in SQL und per COPY übertragen
+    import pandas as pd
+    try:
+        if aufloesung == "stunde":
+            query = """
+                SELECT
+                    summary_date + make_interval(hours => hour_of_day) AS zeitpunkt, machine_id,
+                    avg_pick_force, max_pick_force, min_pick_force,
+                    avg_place_force, max_place_force, min_place_force,
+                    as_vacuum_error_count, pp_vacuum_error_count,
+                    as_release_error_count, pp_release_error_count,
+                    pick_force_error_count, place_force_error_count,
+                    cycle_count, avg_cycle_time_seconds,
+                    min_cycle_time_seconds, max_cycle_time_seconds
+                FROM hourly_machine_summary
+                WHERE summary_date BETWEEN %(von)s AND %(bis)s AND machine_id IN %(maschinen)s
+                ORDER BY zeitpunkt ASC;
+            """
+        elif aufloesung == "tag":
+            query = f"""
+                SELECT summary_date AS zeitpunkt, {ROLLUP_SPALTEN_SQL}
+                FROM daily_machine_summary
+                WHERE summary_date BETWEEN %(von)s AND %(bis)s AND machine_id IN %(maschinen)s
+                ORDER BY zeitpunkt ASC;
+            """
+        else:
+            query = f"""
+                SELECT week_start AS zeitpunkt, {ROLLUP_SPALTEN_SQL}
+                FROM weekly_machine_summary
+                WHERE week_start BETWEEN date_trunc('week', %(von)s::date) AND %(bis)s AND machine_id IN %(maschinen)s
+                ORDER BY zeitpunkt ASC;
+            """
+        df = cache.abfrage(f"zeitraum_{aufloesung}", query, {"von": von, "bis": bis, "maschinen": tuple(maschinen)}, copy=True)
+        if not df.empty:
+            df['zeitpunkt'] = pd.to_datetime(df['zeitpunkt'])
+        return df
+    except Exception as e:
+        st.error(f"Fehler beim Laden der Daten von {von} bis {bis}: {e}")
+        traceback.print_exc()
+        return pd.DataFrame()
+
+
+def load_stunden_verlauf(cache, machine_id, stunde_beginn, event_name, parameter_name):
+    # width_bucket teilt die Stunde in DRILLDOWN_PUNKTE Spalten; je Spalte bleiben min und max, Ausreißer gehen nicht verloren
+    import pandas as pd
+    try:
+        query = """
+            SELECT
+                to_timestamp(%(von_s)s + (spalte - 1) * %(breite_s)s) AS zeitpunkt,
+                min_wert, max_wert, anzahl, fehler
+            FROM (
+                SELECT
+                    width_bucket(extract(epoch FROM event_timestamp), %(von_s)s, %(bis_s)s, %(punkte)s) AS spalte,
+                    min(value) AS min_wert, max(value) AS max_wert,
+                    count(*) AS anzahl, count(*) FILTER (WHERE is_error) AS fehler
+                FROM processed_machine_events
+                WHERE machine_key = (SELECT machine_key FROM dim_machine WHERE machine_id = %(maschine)s)
+                  AND parameter_key = (SELECT parameter_key FROM dim_parameter WHERE parameter_name = %(parameter)s)
+                  AND event_key = (SELECT event_key FROM dim_event WHERE event_name = %(event)s)
+                  AND event_timestamp >= %(von)s AND event_timestamp < %(bis)s
+                GROUP BY spalte
+            ) AS spalten
+            ORDER BY zeitpunkt ASC;
+        """
+        stunde_ende = stunde_beginn + datetime.timedelta(hours=1)
+        df = cache.abfrage("drilldown_verlauf", query, {
+            "maschine": machine_id, "event": event_name, "parameter": parameter_name,
+            "von": stunde_beginn, "bis": stunde_ende,
+            "von_s": stunde_beginn.timestamp(), "bis_s": stunde_ende.timestamp(),
+            "punkte": DRILLDOWN_PUNKTE, "breite_s": 3600 / DRILLDOWN_PUNKTE
+        })
+        fehler_df = cache.abfrage("drilldown_fehler", """
+            SELECT event_timestamp, value, cycle_seq
+            FROM processed_machine_events
+            WHERE machine_key = (SELECT machine_key FROM dim_machine WHERE machine_id = %(maschine)s)
+              AND parameter_key = (SELECT parameter_key FROM dim_parameter WHERE parameter_name = %(parameter)s)
+              AND event_key = (SELECT event_key FROM dim_event WHERE event_name = %(event)s)
+              AND event_timestamp >= %(von)s AND event_timestamp < %(bis)s AND is_error
+            ORDER BY event_timestamp ASC
+            LIMIT %(limit)s;
+        """, {
+            "maschine": machine_id, "event": event_name, "parameter": parameter_name,
+            "von": stunde_beginn, "bis": stunde_ende, "limit": DRILLDOWN_MAX_FEHLER
+        })
+        return df, fehler_df
+    except Exception as e:
+        st.error(f"Fehler beim Laden des Verlaufs von '{machine_id}' ab {stunde_beginn}: {e}")
+        traceback.print_exc()
+        return pd.DataFrame(), pd.DataFrame()
+
+
+def load_zyklus_bereich(cache, machine_id, stunde_beginn):
+    # Erster und letzter Zyklus, der in der Stunde beginnt (entspricht der Zuordnung in hourly_machine_summary)
+    import pandas as pd
+    query = """
+        SELECT min(cycle_seq) AS erster_zyklus, max(cycle_seq) AS letzter_zyklus
+        FROM processed_machine_events
+        WHERE machine_key = (SELECT machine_key FROM dim_machine WHERE machine_id = %(maschine)s)
+          AND event_key = (SELECT event_key FROM dim_event WHERE event_name = 'Cycle_Start')
+          AND event_timestamp >= %(von)s AND event_timestamp < %(bis)s;
+    """
+    df = cache.abfrage("drilldown_zyklen", query, {
+        "maschine": machine_id, "von": stunde_beginn, "bis": stunde_beginn + datetime.timedelta(hours=1)
+    })
+    if df.empty or pd.isna(df['erster_zyklus'].iloc[0]):
+        return None
+    return int(df['erster_zyklus'].iloc[0]), int(df['letzter_zyklus'].iloc[0])
+
+
+def load_rohdaten_seite(cache, machine_id, stunde_beginn, nach_zyklus, letzter_zyklus):
+    # Keyset-Pagination über idx_processed_events_cycle (machine_key, cycle_seq): die Seite beginnt nach dem letzten
+    # vollständig angezeigten Zyklus, statt per OFFSET alle vorherigen Zeilen zu überspringen. Die Sicht ergänzt die Namen.
+    query = """
+        SELECT cycle_seq, event_timestamp, event_name, parameter_name, value, is_error, anomaly_score, cycle_time_seconds
+        FROM processed_machine_events_view
+        WHERE machine_key = (SELECT machine_key FROM dim_machine WHERE machine_id = %(maschine)s)
+          AND cycle_seq > %(nach)s AND cycle_seq <= %(letzter)s
+          AND event_timestamp >= %(von)s AND event_timestamp < %(bis)s
+        ORDER BY cycle_seq ASC, event_timestamp ASC
+        LIMIT %(limit)s;
+    """
+    df = cache.abfrage("drilldown_seite", query, {
+        "maschine": machine_id, "nach": nach_zyklus, "letzter": letzter_zyklus,
+        "von": stunde_beginn, "bis": stunde_beginn + datetime.timedelta(hours=1) + ZYKLUS_PUFFER,
+        "limit": DRILLDOWN_SEITE_ZEILEN
+    })
+    # Volle Seite: der letzte Zyklus ist evtl. abgeschnitten und beginnt die nächste Seite (außer er ist der einzige)
+    if len(df) == DRILLDOWN_SEITE_ZEILEN and df['cycle_seq'].nunique() > 1:
+        df = df[df['cycle_seq'] < df['cycle_seq'].iloc[-1]]
+    return df
+
+
+def load_laufmetriken(cache):
+    import pandas as pd
+    try:
+        query = """
+            SELECT run_id, job_name, input_name, run_started_at, step_name, step_order, wall_seconds, task_seconds,
+                   input_records, output_records, shuffle_write_bytes, spill_bytes
+            FROM pipeline_run_metrics
+            WHERE run_id IN (
+                SELECT run_id FROM pipeline_run_metrics WHERE step_name = 'gesamt'
+                ORDER BY run_started_at DESC LIMIT %(laeufe)s
+            )
+            ORDER BY run_started_at ASC, step_order ASC;
+        """
+        df = cache.abfrage("laufmetriken", query, {"laeufe": MAX_LAEUFE})
+        if not df.empty:
+            df['run_started_at'] = pd.to_datetime(df['run_started_at'], utc=True)
+        return df
+    except Exception as e:
+        st.error(f"Fehler beim Laden der Laufmetriken: {e}")
+        traceback.print_exc()
+        return pd.DataFrame()
+
+
+def scatter_spur(anzahl_punkte, **argumente):
+    # plotly erst beim ersten Diagramm laden: der Start des Dashboards und Seiten ohne Diagramm kommen ohne aus
+    import plotly.graph_objects as go
+    return (go.Scattergl if anzahl_punkte >= SCATTERGL_AB_PUNKTE else go.Scatter)(**argumente)
+
+
 def create_timeseries_plot(df, x_col, y_cols, title, y_axis_title, height=400, custom_names=None):
+    import plotly.graph_objects as go
     fig = go.Figure()
     for col in y_cols:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(scatter_spur(
+            len(df),
             x=df[x_col],
             y=df[col],
             mode='lines+markers',
@@ -88,52 +315,232 @@ def create_timeseries_plot(df, x_col, y_cols, title, y_axis_title, height=400, c
     return fig
 
 
+def create_vergleichs_plot(df, x_col, y_col, title, y_axis_title, height=400):
+    # Eine Spur je Maschine: Vergleich einer Kennzahl über Zeitraum und Maschinen
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    for machine_id, maschinen_df in df.groupby('machine_id', sort=True):
+        fig.add_trace(scatter_spur(
+            len(maschinen_df), x=maschinen_df[x_col], y=maschinen_df[y_col], mode='lines+markers', name=machine_id
+        ))
+    fig.update_layout(
+        title=title, xaxis_title='Zeit', yaxis_title=y_axis_title, height=height, legend_title_text='Maschine'
+    )
+    return fig
+
+
+def zeige_drilldown(cache, summary_df):
+    st.header("Drill-down: Rohdaten einer Stunde")
+    spalte_maschine, spalte_stunde, spalte_messwert = st.columns(3)
+    machine_id = spalte_maschine.selectbox("Maschine", options=sorted(summary_df['machine_id'].unique()))
+    stunden_df = summary_df[summary_df['machine_id'] == machine_id].sort_values('zeitpunkt')
+    zeitpunkt = spalte_stunde.selectbox(
+        "Stunde", options=list(stunden_df['zeitpunkt']), format_func=lambda z: f"{z:%H}:00–{z:%H}:59"
+    )
+    event_name, parameter_name = spalte_messwert.selectbox(
+        "Messwert", options=list(MESSWERTE), format_func=lambda messwert: MESSWERTE[messwert]
+    )
+    stunde_beginn = zeitpunkt.to_pydatetime().replace(tzinfo=datetime.timezone.utc)
+
+    verlauf_df, fehler_df = load_stunden_verlauf(cache, machine_id, stunde_beginn, event_name, parameter_name)
+    if verlauf_df.empty:
+        st.info(f"Keine Rohdaten für '{machine_id}' um {stunde_beginn:%H}:00 vorhanden.")
+        return
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=verlauf_df['zeitpunkt'], y=verlauf_df['max_wert'], mode='lines', name='Max', line=dict(width=1)))
+    fig.add_trace(go.Scatter(
+        x=verlauf_df['zeitpunkt'], y=verlauf_df['min_wert'], mode='lines', name='Min', line=dict(width=1), fill='tonexty'
+    ))
+    if not fehler_df.empty:
+        fig.add_trace(go.Scatter(
+            x=fehler_df['event_timestamp'], y=fehler_df['value'], mode='markers', name='Fehler',
+            marker=dict(color='red', size=6), customdata=fehler_df['cycle_seq'], hovertemplate='Zyklus %{customdata}: %{y}'
+        ))
+    fig.update_layout(
+        title=f"{MESSWERTE[(event_name, parameter_name)]}: {int(verlauf_df['anzahl'].sum())} Werte, "
+              f"verdichtet auf {len(verlauf_df)} Spalten (min/max)",
+        xaxis_title='Zeit', yaxis_title=MESSWERTE[(event_name, parameter_name)], height=400, legend_title_text='Werte'
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    zyklen = load_zyklus_bereich(cache, machine_id, stunde_beginn)
+    if zyklen is None:
+        return
+    erster_zyklus, letzter_zyklus = zyklen
+    # Je Maschine und Stunde ein Stapel der Seitenanfänge (letzter Zyklus der Vorseite), für Zurück/Weiter
+    seiten = st.session_state.setdefault(f"drilldown_{machine_id}_{stunde_beginn:%Y%m%d%H}", [erster_zyklus - 1])
+    seite_df = load_rohdaten_seite(cache, machine_id, stunde_beginn, seiten[-1], letzter_zyklus)
+    if seite_df.empty:
+        st.info("Keine weiteren Rohdaten.")
+        return
+    st.subheader(f"Zyklen {seite_df['cycle_seq'].iloc[0]}–{seite_df['cycle_seq'].iloc[-1]} "
+                 f"von {erster_zyklus}–{letzter_zyklus} (Seite {len(seiten)})")
+    st.dataframe(seite_df, use_container_width=True, hide_index=True)
+
+    spalte_zurueck, spalte_weiter = st.columns(2)
+    if spalte_zurueck.button("◀ Zurück", disabled=len(seiten) == 1):
+        seiten.pop()
+        st.rerun()
+    if spalte_weiter.button("Weiter ▶", disabled=seite_df['cycle_seq'].iloc[-1] >= letzter_zyklus):
+        seiten.append(int(seite_df['cycle_seq'].iloc[-1]))
+        st.rerun()
+
+
+def zeige_lauf_seite(cache):
+    st.header("Läufe: Dauer je Verarbeitungsschritt")
+    metriken_df = load_laufmetriken(cache)
+    if metriken_df.empty:
+        st.info("Noch keine Laufmetriken vorhanden.")
+        return
+    gesamt_df = metriken_df[metriken_df['step_name'] == 'gesamt']
+    schritte_df = metriken_df[metriken_df['step_name'] != 'gesamt']
+
+    import plotly.graph_objects as go
+    fig_gesamt = go.Figure()
+    for job_name, job_df in gesamt_df.groupby('job_name'):
+        fig_gesamt.add_trace(go.Scatter(
+            x=job_df['run_started_at'], y=job_df['wall_seconds'], mode='lines+markers', name=job_name,
+            customdata=job_df['input_name'], hovertemplate='%{customdata}: %{y:.1f} s'
+        ))
+    fig_gesamt.update_layout(title='Gesamtdauer je Lauf', xaxis_title='Start', yaxis_title='Dauer (s)', height=400)
+    st.plotly_chart(fig_gesamt, use_container_width=True)
+
+    # Gestapelt je Schritt: eine Regression zeigt sich als wachsender Anteil eines Schritts
+    fig_schritte = go.Figure()
+    for step_name, step_df in schritte_df.sort_values('step_order').groupby('step_name', sort=False):
+        fig_schritte.add_trace(go.Bar(x=step_df['run_started_at'], y=step_df['wall_seconds'], name=step_name))
+    fig_schritte.update_layout(
+        title='Dauer je Schritt', barmode='stack', xaxis_title='Start', yaxis_title='Dauer (s)', height=400,
+        legend_title_text='Schritt'
+    )
+    st.plotly_chart(fig_schritte, use_container_width=True)
+
+    letzter_lauf = gesamt_df.iloc[-1]
+    st.subheader(f"Letzter Lauf: {letzter_lauf['input_name']} ({letzter_lauf['run_started_at']:%Y-%m-%d %H:%M} UTC)")
+    letzter_df = metriken_df[metriken_df['run_id'] == letzter_lauf['run_id']]
+    st.dataframe(
+        letzter_df[['step_name', 'wall_seconds', 'task_seconds', 'input_records', 'output_records', 'shuffle_write_bytes', 'spill_bytes']]
+            .rename(columns={
+                "step_name": "Schritt", "wall_seconds": "Dauer (s)", "task_seconds": "Task-Zeit (s)",
+                "input_records": "Eingabe-Zeilen", "output_records": "Ausgabe-Zeilen",
+                "shuffle_write_bytes": "Shuffle (Bytes)", "spill_bytes": "Spill (Bytes)"
+            }),
+        use_container_width=True, hide_index=True
+    )
+
+
+def zeige_debug_seite(cache):
+    import pandas as pd
+    st.header("Debug: Abfrage-Cache und Verbindungspool")
+    statistik = cache.statistik()
+    pool_statistik = cache.pool.statistik()
+    abfragen = statistik["treffer"] + statistik["fehlschlaege"]
+
+    spalte1, spalte2, spalte3, spalte4 = st.columns(4)
+    spalte1.metric("Cache-Treffer", statistik["treffer"])
+    spalte2.metric("Cache-Fehlschläge", statistik["fehlschlaege"])
+    spalte3.metric("Trefferquote", f"{statistik['treffer'] / abfragen:.0%}" if abfragen else "–")
+    spalte4.metric("Invalidierungen", statistik["invalidierungen"])
+    st.write(
+        f"Einträge: {statistik['eintraege']}, Speicher: {statistik['bytes'] / 1024 / 1024:.1f} von "
+        f"{statistik['max_bytes'] / 1024 / 1024:.0f} MB, letzter Verarbeitungsmarker: {statistik['marker']}"
+    )
+    st.write(
+        f"Verbindungen: {pool_statistik['in_benutzung']} in Benutzung, {pool_statistik['offen']} offen, "
+        f"maximal {pool_statistik['max_verbindungen']}, {pool_statistik['neu_verbunden']} neu aufgebaut"
+    )
+
+    latenzen_df = pd.DataFrame(list(cache.latenzen), columns=["abfrage", "treffer", "latenz_ms"])
+    if latenzen_df.empty:
+        st.info("Noch keine Abfragen.")
+    else:
+        st.subheader(f"Latenzen der letzten {len(latenzen_df)} Abfragen (ms)")
+        st.dataframe(
+            latenzen_df.groupby(["abfrage", "treffer"])["latenz_ms"]
+                .describe(percentiles=[0.5, 0.95])[["count", "50%", "95%", "max"]]
+                .rename(columns={"count": "Anzahl", "50%": "Median", "95%": "p95", "max": "Max"})
+                .round(1),
+            use_container_width=True
+        )
+    if st.button("Cache leeren"):
+        cache.leeren()
+        st.rerun()
+
 
 st.set_page_config(page_title="Maschinen-Dashboard", layout="wide")
 st.title("⚙️ Maschinen-Event Dashboard")
 st.caption("Tägliche Prozessdatenübersicht")
 
-conn = get_db_connection()
+cache = get_query_cache()
 
-if not conn:
+if not cache:
     st.error("Datenbankverbindung nicht hergestellt!")
     st.stop() 
 
-date_df = get_available_dates(conn)
+seite = st.sidebar.radio("📄 Seite", options=["Dashboard", "Läufe", "Debug"], horizontal=True)
+if seite == "Läufe":
+    zeige_lauf_seite(cache)
+    st.stop()
+if seite == "Debug":
+    zeige_debug_seite(cache)
+    st.stop()
+
+date_df = get_available_dates(cache)
 
 if date_df.empty:
     st.warning("Keine Daten in der Datenbank gefunden.")
     st.stop() 
 
-available_years = sorted(date_df['summary_date'].apply(lambda d: d.year).unique(), reverse=True)
-selected_year = st.sidebar.selectbox("📅 Jahr", options=available_years)
+ansicht = st.sidebar.radio("🔎 Ansicht", options=["Tag", "Zeitraum"], horizontal=True)
+# Die Maschinenauswahl geht in die Abfrage ein, statt das Ergebnis nachträglich zu filtern
+available_machines = load_maschinen(cache)
 
-months_in_year = sorted(date_df[date_df['summary_date'].apply(lambda d: d.year) == selected_year]['summary_date'].apply(lambda d: d.month).unique())
-selected_month = st.sidebar.selectbox("📅 Monat", options=months_in_year, format_func=lambda m: f"{m:02d}")
+if ansicht == "Tag":
+    kalender = baue_kalender(date_df)
+    selected_year = st.sidebar.selectbox("📅 Jahr", options=list(kalender))
 
-days_in_month = sorted(date_df[
-    (date_df['summary_date'].apply(lambda d: d.year) == selected_year) &
-    (date_df['summary_date'].apply(lambda d: d.month) == selected_month)
-]['summary_date'].apply(lambda d: d.day).unique())
-selected_day = st.sidebar.selectbox("📅 Tag", options=days_in_month, format_func=lambda d: f"{d:02d}")
+    months_in_year = sorted(kalender[selected_year])
+    selected_month = st.sidebar.selectbox("📅 Monat", options=months_in_year, format_func=lambda m: f"{m:02d}")
 
-selected_date = datetime.date(selected_year, selected_month, selected_day)
-st.sidebar.success(f"Zeige Daten für: {selected_date}")
+    days_in_month = sorted(kalender[selected_year][selected_month])
+    selected_day = st.sidebar.selectbox("📅 Tag", options=days_in_month, format_func=lambda d: f"{d:02d}")
 
-summary_df = load_summary_data(conn, selected_date)
+    selected_date = datetime.date(selected_year, selected_month, selected_day)
+    st.sidebar.success(f"Zeige Daten für: {selected_date}")
+    zeitraum_text = f"das ausgewählte Datum ({selected_date})"
+else:
+    erster_tag, letzter_tag = date_df['summary_date'].min(), date_df['summary_date'].max()
+    zeitraum = st.sidebar.date_input(
+        "📅 Zeitraum", value=(max(erster_tag, letzter_tag - datetime.timedelta(days=29)), letzter_tag),
+        min_value=erster_tag, max_value=letzter_tag
+    )
+    if len(zeitraum) != 2:
+        st.info("Bitte Start- und Enddatum des Zeitraums wählen.")
+        st.stop()
+    von, bis = zeitraum
+    aufloesung = waehle_aufloesung(von, bis)
+    st.sidebar.success(f"Zeige Daten von {von} bis {bis} ({AUFLOESUNGEN[aufloesung]})")
+    zeitraum_text = f"den ausgewählten Zeitraum ({von} bis {bis})"
 
-available_machines = summary_df['machine_id'].unique()
 selected_machines = st.sidebar.multiselect("🛠️ Maschinen auswählen", options=available_machines, default=available_machines)
-summary_df = summary_df[summary_df['machine_id'].isin(selected_machines)]
+if not selected_machines:
+    st.info("Bitte mindestens eine Maschine auswählen.")
+    st.stop()
+
+if ansicht == "Tag":
+    summary_df = load_summary_data(cache, selected_date, selected_machines)
+else:
+    summary_df = load_range_data(cache, von, bis, aufloesung, selected_machines)
 
 
 if summary_df.empty:
-    st.info(f"Keine Daten für das ausgewählte Datum ({selected_date}) vorhanden.")
+    st.info(f"Keine Daten für {zeitraum_text} vorhanden.")
 else:
-    st.header("Übersicht der stündlichen Aggregate")
+    st.header("Übersicht der stündlichen Aggregate" if ansicht == "Tag" else f"Übersicht ({AUFLOESUNGEN[aufloesung]})")
 
     display_columns_map = {
-        "timestamp_hour": "Zeitstempel",
+        "zeitpunkt": "Zeitstempel",
         "machine_id": "Maschine",
         "cycle_count": "Zyklen",
         "min_cycle_time_seconds": "Min Zeit (s)",
@@ -167,7 +574,7 @@ else:
     }
     fig_error = create_timeseries_plot(
         summary_df,
-        x_col='timestamp_hour',
+        x_col='zeitpunkt',
         y_cols=error_columns,
         title='Fehleranzahl über Zeit',
         y_axis_title='Anzahl',
@@ -187,7 +594,7 @@ else:
     }
     fig_cycle = create_timeseries_plot(
         summary_df,
-        x_col='timestamp_hour',
+        x_col='zeitpunkt',
         y_cols=cycle_time_columns,
         title='Zykluszeit (min/avg/max) über Zeit',
         y_axis_title='Zykluszeit (s)',
@@ -195,4 +602,22 @@ else:
     )
     st.plotly_chart(fig_cycle, use_container_width=True)
 
+    if summary_df['machine_id'].nunique() > 1:
+        st.subheader("Maschinenvergleich")
+        vergleich_spalten = ['cycle_count', 'avg_cycle_time_seconds', 'avg_pick_force', 'avg_place_force'] + error_columns
+        vergleich_spalte = st.selectbox(
+            "Kennzahl", options=vergleich_spalten, format_func=lambda spalte: display_columns_map.get(spalte, spalte)
+        )
+        fig_vergleich = create_vergleichs_plot(
+            summary_df,
+            x_col='zeitpunkt',
+            y_col=vergleich_spalte,
+            title=f"{display_columns_map.get(vergleich_spalte, vergleich_spalte)} je Maschine",
+            y_axis_title=display_columns_map.get(vergleich_spalte, vergleich_spalte)
+        )
+        st.plotly_chart(fig_vergleich, use_container_width=True)
+
+    if ansicht == "Tag":
+        zeige_drilldown(cache, summary_df)
+
 st.caption("Dashboard Ende.")
\ No newline at end of file
@@ -0,0 +1,227 @@
+import io
+import time
+import threading
+import collections
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+
+# Datenbankzugriff des Dashboards: ein Verbindungspool für alle Streamlit-Sessions und ein gemeinsamer Abfrage-Cache.
+# Der Cache wird nicht nach fester Zeit, sondern über den Verarbeitungsmarker (processing_marker) ungültig:
+# daily_aggregator.py und stream_aggregator.py setzen ihn nach jedem Schreiben.
+# pandas und pyarrow werden erst mit der ersten Abfrage geladen, nicht schon beim Import durch dashboard.py.
+
+MARKER_TABELLE = "processing_marker"
+MARKER_PRUEFINTERVALL_S = 5
+LEERLAUF_PRUEFUNG_S = 30
+LATENZ_VERLAUF = 200
+
+
+class VerbindungsPool:
+    def __init__(self, min_verbindungen: int, max_verbindungen: int, **db_params):
+        self._pool = ThreadedConnectionPool(min_verbindungen, max_verbindungen, **db_params)
+        # ThreadedConnectionPool wirft bei Erschöpfung einen Fehler: weitere Sessions warten stattdessen auf eine freie Verbindung
+        self._frei = threading.BoundedSemaphore(max_verbindungen)
+        self._zuletzt_benutzt = {}
+        self._lock = threading.Lock()
+        # Zählung über _hole/_gib_zurueck statt über die internen Listen von ThreadedConnectionPool: offen sind die
+        # bereits ausgegebenen Verbindungen, die der Pool noch nicht geschlossen hat
+        self._offen = set()
+        self._in_benutzung = 0
+        self.neu_verbunden = 0
+
+    def _gesund(self, conn, zuletzt_benutzt: float) -> bool:
+        if conn.closed:
+            return False
+        # Nur länger unbenutzte Verbindungen prüfen: ein Roundtrip pro Abfrage wäre unnötig teuer
+        if time.monotonic() - zuletzt_benutzt < LEERLAUF_PRUEFUNG_S:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _hole(self):
+        # Alle Verbindungen im Pool können abgebrochen sein: höchstens maxconn verwerfen, dann eine neue versuchen.
+        # getconn (ggf. Verbindungsaufbau bis connect_timeout) und die Prüfung laufen ohne Lock, ThreadedConnectionPool
+        # ist selbst threadsicher: eine langsame Verbindung hält die anderen Sessions nicht auf. Das Lock schützt nur die Zählung.
+        for versuch in range(self._pool.maxconn + 1):
+            conn = self._pool.getconn()
+            with self._lock:
+                if versuch:
+                    self.neu_verbunden += 1
+                self._offen.add(id(conn))
+                zuletzt_benutzt = self._zuletzt_benutzt.get(id(conn), 0)
+            if self._gesund(conn, zuletzt_benutzt):
+                with self._lock:
+                    self._in_benutzung += 1
+                return conn
+            with self._lock:
+                self._vergiss(conn)
+            self._pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError(f"Keine funktionierende Datenbankverbindung nach {self._pool.maxconn + 1} Versuchen")
+
+    def _vergiss(self, conn):
+        self._offen.discard(id(conn))
+        self._zuletzt_benutzt.pop(id(conn), None)
+
+    def _gib_zurueck(self, conn, schliessen: bool = False):
+        with self._lock:
+            self._in_benutzung -= 1
+            self._zuletzt_benutzt[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=schliessen or conn.closed)
+        # Über minconn hinaus schließt der Pool zurückgegebene Verbindungen selbst; eine geschlossene Verbindung kann
+        # keine andere Session mehr erhalten haben
+        if conn.closed:
+            with self._lock:
+                self._vergiss(conn)
+
+    @contextmanager
+    def verbindung(self):
+        # Abgebrochene Verbindungen (z. B. nach Neustart der Datenbank) werden verworfen und beim nächsten Mal ersetzt
+        self._frei.acquire()
+        try:
+            conn = self._hole()
+        except Exception:
+            self._frei.release()
+            raise
+        try:
+            yield conn
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._gib_zurueck(conn, schliessen=True)
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            self._gib_zurueck(conn)
+            raise
+        else:
+            self._gib_zurueck(conn)
+        finally:
+            self._frei.release()
+
+    def abfrage(self, sql: str, params=None) -> "pd.DataFrame":
+        import pandas as pd
+        # Ein Wiederholungsversuch mit neuer Verbindung, falls die bisherige inzwischen getrennt wurde
+        for versuch in range(2):
+            try:
+                with self.verbindung() as conn, conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    # Wie pd.read_sql_query: NUMERIC-Werte (Decimal) als float
+                    return pd.DataFrame.from_records(cur.fetchall(), columns=[spalte[0] for spalte in cur.description], coerce_float=True)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if versuch == 1:
+                    raise
+
+    def abfrage_copy(self, sql: str, params=None) -> "pd.DataFrame":
+        # Für große Ergebnisse (Zeiträume über viele Maschinen): COPY ... TO STDOUT liefert das Ergebnis als einen
+        # CSV-Strom statt als Python-Tupel je Zeile, Arrow liest ihn spaltenweise und typisiert (NUMERIC als float)
+        import pyarrow.csv as pa_csv
+        # COPY ... TO STDOUT (CSV): boolean als t/f, NULL als leeres Feld, leerer Text als ""
+        leseoptionen = pa_csv.ConvertOptions(
+            true_values=["t"], false_values=["f"], strings_can_be_null=True, quoted_strings_can_be_null=False
+        )
+        sql = sql.strip().rstrip(";")
+        for versuch in range(2):
+            try:
+                with self.verbindung() as conn, conn.cursor() as cur:
+                    puffer = io.BytesIO()
+                    cur.copy_expert(f"COPY ({cur.mogrify(sql, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER)", puffer)
+                puffer.seek(0)
+                return pa_csv.read_csv(puffer, convert_options=leseoptionen).to_pandas()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if versuch == 1:
+                    raise
+
+    def statistik(self) -> dict:
+        with self._lock:
+            return {
+                "max_verbindungen": self._pool.maxconn,
+                "offen": len(self._offen),
+                "in_benutzung": self._in_benutzung,
+                "neu_verbunden": self.neu_verbunden
+            }
+
+
+class AbfrageCache:
+    # LRU-Cache für Abfrageergebnisse, begrenzt über den Speicherbedarf der DataFrames
+    def __init__(self, pool: VerbindungsPool, max_bytes: int):
+        self.pool = pool
+        self.max_bytes = max_bytes
+        self._eintraege = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._marker = None
+        self._marker_geprueft = 0.0
+        self.treffer = 0
+        self.fehlschlaege = 0
+        self.invalidierungen = 0
+        self.latenzen = collections.deque(maxlen=LATENZ_VERLAUF)
+
+    def _pruefe_marker(self):
+        import pandas as pd
+        if time.monotonic() - self._marker_geprueft < MARKER_PRUEFINTERVALL_S:
+            return
+        self._marker_geprueft = time.monotonic()
+        try:
+            marker = self.pool.abfrage(f"SELECT max(last_processed_at) AS marker FROM {MARKER_TABELLE}")["marker"].iloc[0]
+        except Exception:
+            # Ohne Marker (Tabelle fehlt, Datenbank nicht erreichbar) bleibt der Cache bestehen
+            return
+        marker = None if pd.isna(marker) else marker
+        with self._lock:
+            if marker != self._marker:
+                if self._marker is not None or self._eintraege:
+                    self.invalidierungen += 1
+                self._eintraege.clear()
+                self._bytes = 0
+                self._marker = marker
+
+    def abfrage(self, name: str, sql: str, params: dict = None, copy: bool = False) -> "pd.DataFrame":
+        # copy: Ergebnis per COPY und Arrow übertragen (VerbindungsPool.abfrage_copy); Listen in params als Tupel
+        self._pruefe_marker()
+        schluessel = (sql, tuple(sorted((params or {}).items())), copy)
+        start = time.perf_counter()
+        with self._lock:
+            eintrag = self._eintraege.get(schluessel)
+            if eintrag is not None:
+                self._eintraege.move_to_end(schluessel)
+                self.treffer += 1
+        if eintrag is None:
+            df = self.pool.abfrage_copy(sql, params) if copy else self.pool.abfrage(sql, params)
+            groesse = int(df.memory_usage(deep=True).sum())
+            with self._lock:
+                self.fehlschlaege += 1
+                if schluessel not in self._eintraege and groesse <= self.max_bytes:
+                    self._eintraege[schluessel] = (df, groesse)
+                    self._bytes += groesse
+                    while self._bytes > self.max_bytes:
+                        _, (_, verdraengt) = self._eintraege.popitem(last=False)
+                        self._bytes -= verdraengt
+        else:
+            df = eintrag[0]
+        self.latenzen.append((name, eintrag is not None, (time.perf_counter() - start) * 1000))
+        # Kopie: Aufrufer ergänzen Spalten, der Cache-Eintrag bleibt unverändert
+        return df.copy()
+
+    def leeren(self):
+        with self._lock:
+            self._eintraege.clear()
+            self._bytes = 0
+
+    def statistik(self) -> dict:
+        with self._lock:
+            return {
+                "eintraege": len(self._eintraege),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "treffer": self.treffer,
+                "fehlschlaege": self.fehlschlaege,
+                "invalidierungen": self.invalidierungen,
+                "marker": self._marker
+            }
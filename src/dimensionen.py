@@ -0,0 +1,66 @@
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, StringType, ShortType
+
+
+# Dimensionstabellen von processed_machine_events: Maschine, Event- und Parametername stehen je Zeile nur als
+# smallint-Schlüssel in der Faktentabelle. Neue Namen erhalten beim Laden einen Schlüssel, Spark ersetzt die Namen
+# per Broadcast-Join. Lesende Abfragen lösen die Schlüssel über die Dimensionstabellen bzw. processed_machine_events_view auf.
+
+# Namensspalte -> (Dimensionstabelle, Schlüsselspalte)
+DIMENSIONEN = {
+    "machine_id": ("dim_machine", "machine_key"),
+    "event_name": ("dim_event", "event_key"),
+    "parameter_name": ("dim_parameter", "parameter_key"),
+}
+LESBARE_SICHT = "processed_machine_events_view"
+
+
+def vergebe_schluessel(conn, spalte: str, werte: list) -> dict:
+    # Name -> Schlüssel; nur fehlende Namen einfügen: ON CONFLICT allein würde bei jedem Lauf Werte der
+    # smallint-Identity verbrauchen. Der Konflikt fängt nur gleichzeitige Läufe (Batch und Streaming) ab.
+    tabelle, schluessel_spalte = DIMENSIONEN[spalte]
+    werte = sorted(set(werte))
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {tabelle} ({spalte})
+            SELECT wert FROM unnest(%s::varchar[]) AS neu(wert)
+            WHERE NOT EXISTS (SELECT 1 FROM {tabelle} WHERE {spalte} = neu.wert)
+            ON CONFLICT ({spalte}) DO NOTHING
+        """, (werte,))
+        if cur.rowcount > 0:
+            print(f"{cur.rowcount} neue Einträge in '{tabelle}'.")
+        cur.execute(f"SELECT {spalte}, {schluessel_spalte} FROM {tabelle} WHERE {spalte} = ANY(%s)", (werte,))
+        zuordnung = dict(cur.fetchall())
+    conn.commit()
+    return zuordnung
+
+
+def lade_schluessel(conn, spalte: str, werte: list = None) -> dict:
+    # Ohne werte: alle Einträge der Dimension; unbekannte Namen fehlen im Ergebnis
+    tabelle, schluessel_spalte = DIMENSIONEN[spalte]
+    with conn.cursor() as cur:
+        if werte is None:
+            cur.execute(f"SELECT {spalte}, {schluessel_spalte} FROM {tabelle}")
+        else:
+            cur.execute(f"SELECT {spalte}, {schluessel_spalte} FROM {tabelle} WHERE {spalte} = ANY(%s)", (sorted(set(werte)),))
+        return dict(cur.fetchall())
+
+
+def vergebe_alle_schluessel(conn, events_df: DataFrame) -> dict:
+    # Ein Spark-Job für die Namen aller Dimensionen
+    namen = events_df.agg(*[F.collect_set(spalte).alias(spalte) for spalte in DIMENSIONEN]).first()
+    return {spalte: vergebe_schluessel(conn, spalte, namen[spalte]) for spalte in DIMENSIONEN}
+
+
+def speicher_format(events_df: DataFrame, schluessel: dict) -> DataFrame:
+    # Namen durch Schlüssel ersetzen (Broadcast-Join je Dimension), is_error als boolean
+    spark = events_df.sparkSession
+    for spalte, (_, schluessel_spalte) in DIMENSIONEN.items():
+        zuordnung_df = spark.createDataFrame(
+            sorted(schluessel[spalte].items()),
+            StructType([StructField(spalte, StringType(), False), StructField(schluessel_spalte, ShortType(), False)])
+        )
+        events_df = events_df.join(F.broadcast(zuordnung_df), on=spalte).drop(spalte)
+    return events_df.withColumn("is_error", F.col("is_error").cast("boolean"))
+
@@ -1,22 +1,65 @@
+DROP TABLE IF EXISTS machine_cycles;
+DROP TABLE IF EXISTS machine_parameter_statistics_history;
+DROP TABLE IF EXISTS machine_parameter_statistics;
+DROP TABLE IF EXISTS pipeline_run_metrics;
+DROP TABLE IF EXISTS processing_marker;
+DROP TABLE IF EXISTS stream_progress;
+DROP TABLE IF EXISTS machine_processing_state;
+DROP TABLE IF EXISTS available_dates;
+DROP TABLE IF EXISTS weekly_machine_summary;
+DROP TABLE IF EXISTS daily_machine_summary;
 DROP TABLE IF EXISTS hourly_machine_summary;
+DROP VIEW IF EXISTS processed_machine_events_view;
 DROP TABLE IF EXISTS processed_machine_events;
+DROP TABLE IF EXISTS dim_parameter;
+DROP TABLE IF EXISTS dim_event;
+DROP TABLE IF EXISTS dim_machine;
 
+-- Dimensionen der Events: je Name ein smallint-Schlüssel (vergeben von dimensionen.py beim Laden)
+CREATE TABLE dim_machine (
+    machine_key SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    machine_id VARCHAR(50) NOT NULL UNIQUE
+);
+CREATE TABLE dim_event (
+    event_key SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    event_name VARCHAR(50) NOT NULL UNIQUE
+);
+-- Leerer parameter_name (Events ohne Messwert) ist ein eigener Eintrag
+CREATE TABLE dim_parameter (
+    parameter_key SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    parameter_name VARCHAR(50) NOT NULL UNIQUE
+);
+
+-- Range-Partitionierung nach Tag (UTC), Tages-Partitionen optional per LIST nach machine_key unterteilt.
+-- Partitionen legt daily_aggregator.py vor jedem Ladevorgang an (Staging-Tabelle + ATTACH PARTITION).
+-- Namen nur als Schlüssel der Dimensionstabellen, Messwerte als real: Spalten nach Breite geordnet, ohne Füllbytes.
 CREATE TABLE processed_machine_events (
-    event_id BIGSERIAL PRIMARY KEY,
     event_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
-    machine_id VARCHAR(50) NOT NULL,
-    event_name VARCHAR(50) NOT NULL,
-    parameter_name VARCHAR(50) NULL,
-    value NUMERIC(7, 2) NULL,
-    is_error INT CHECK (is_error IN (0, 1)) NOT NULL,
     cycle_seq BIGINT NOT NULL,
-    cycle_time_seconds NUMERIC(10, 3) NULL
-);
+    value REAL NULL,
+    cycle_time_seconds REAL NULL,
+    anomaly_score REAL NULL,
+    machine_key SMALLINT NOT NULL,
+    event_key SMALLINT NOT NULL,
+    parameter_key SMALLINT NOT NULL,
+    is_error BOOLEAN NOT NULL
+) PARTITION BY RANGE (event_timestamp);
 
--- Indizes
-CREATE INDEX idx_processed_events_time ON processed_machine_events (event_timestamp);
-CREATE INDEX idx_processed_events_machine_param ON processed_machine_events (machine_id, parameter_name, event_timestamp);
-CREATE INDEX idx_processed_events_cycle ON processed_machine_events (machine_id, cycle_seq);
+-- Indizes (werden beim Anhängen einer Partition einmalig für die ganze Partition aufgebaut)
+CREATE INDEX idx_processed_events_time ON processed_machine_events USING BRIN (event_timestamp);
+CREATE INDEX idx_processed_events_machine_param ON processed_machine_events (machine_key, parameter_key, event_timestamp);
+CREATE INDEX idx_processed_events_cycle ON processed_machine_events (machine_key, cycle_seq);
+
+-- Events mit aufgelösten Namen (Auswertungen von Hand, Archivierung). Filter auf die Schlüsselspalten erreichen
+-- weiterhin die Partitionierung, Filter auf die Namen nicht.
+CREATE VIEW processed_machine_events_view AS
+SELECT
+    e.event_timestamp, e.machine_key, m.machine_id, e.event_key, ev.event_name, e.parameter_key, p.parameter_name,
+    e.value, e.is_error, e.cycle_seq, e.cycle_time_seconds, e.anomaly_score
+FROM processed_machine_events e
+JOIN dim_machine m ON m.machine_key = e.machine_key
+JOIN dim_event ev ON ev.event_key = e.event_key
+JOIN dim_parameter p ON p.parameter_key = e.parameter_key;
 
 CREATE TABLE hourly_machine_summary (
     summary_date DATE NOT NULL,
@@ -28,6 +71,10 @@ CREATE TABLE hourly_machine_summary (
     avg_place_force NUMERIC(7, 2),
     max_place_force NUMERIC(7, 2),
     min_place_force NUMERIC(7, 2),
+    pick_force_sum NUMERIC(14, 3),
+    pick_force_count INT,
+    place_force_sum NUMERIC(14, 3),
+    place_force_count INT,
     as_vacuum_error_count INT,
     pp_vacuum_error_count INT,
     as_release_error_count INT,
@@ -38,6 +85,7 @@ CREATE TABLE hourly_machine_summary (
     min_cycle_time_seconds NUMERIC(10, 3),
 	max_cycle_time_seconds NUMERIC(10, 3),
 	avg_cycle_time_seconds NUMERIC(10, 3),
+    sum_cycle_time_seconds NUMERIC(14, 3),
     PRIMARY KEY (summary_date, hour_of_day, machine_id)
 );
 
@@ -45,5 +93,146 @@ CREATE TABLE hourly_machine_summary (
 CREATE INDEX idx_hourly_summary_time_agg ON hourly_machine_summary (summary_date, hour_of_day);
 CREATE INDEX idx_hourly_summary_machine_agg ON hourly_machine_summary (machine_id);
 
+-- Tages- und Wochen-Verdichtung (verdichtung.py): Mittelwerte als Summe/Anzahl, weitere Spalten aus config/kennzahlen.json
+-- legen daily_aggregator.py bzw. stream_aggregator.py bei Bedarf an
+CREATE TABLE daily_machine_summary (
+    summary_date DATE NOT NULL,
+    machine_id VARCHAR(50) NOT NULL,
+    max_pick_force NUMERIC(7, 2),
+    min_pick_force NUMERIC(7, 2),
+    pick_force_sum NUMERIC(14, 3),
+    pick_force_count INT,
+    pick_force_error_count INT,
+    max_place_force NUMERIC(7, 2),
+    min_place_force NUMERIC(7, 2),
+    place_force_sum NUMERIC(14, 3),
+    place_force_count INT,
+    place_force_error_count INT,
+    as_vacuum_error_count INT,
+    pp_vacuum_error_count INT,
+    as_release_error_count INT,
+    pp_release_error_count INT,
+    cycle_count INT,
+    min_cycle_time_seconds NUMERIC(10, 3),
+    max_cycle_time_seconds NUMERIC(10, 3),
+    sum_cycle_time_seconds NUMERIC(14, 3),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (summary_date, machine_id)
+);
+
+-- week_start: Montag der ISO-Woche
+CREATE TABLE weekly_machine_summary (LIKE daily_machine_summary INCLUDING DEFAULTS);
+ALTER TABLE weekly_machine_summary RENAME COLUMN summary_date TO week_start;
+ALTER TABLE weekly_machine_summary ADD PRIMARY KEY (week_start, machine_id);
+
+CREATE INDEX idx_daily_summary_machine ON daily_machine_summary (machine_id, summary_date);
+CREATE INDEX idx_weekly_summary_machine ON weekly_machine_summary (machine_id, week_start);
+
+-- Kalender der Tage mit Daten für die Datumsauswahl des Dashboards (verdichtung.py, mit den Verdichtungen gepflegt)
+CREATE TABLE available_dates (
+    summary_date DATE PRIMARY KEY
+);
+
+-- Wasserstand je Maschine für die inkrementelle Verarbeitung (gepflegt von daily_aggregator.py)
+CREATE TABLE machine_processing_state (
+    machine_id VARCHAR(50) PRIMARY KEY,
+    last_event_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_cycle_seq BIGINT NOT NULL,
+    open_cycle_start_ts TIMESTAMP WITH TIME ZONE NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Letzter vollständig geschriebener Micro-Batch je Streaming-Abfrage (stream_aggregator.py)
+CREATE TABLE stream_progress (
+    query_name VARCHAR(100) PRIMARY KEY,
+    last_batch_id BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Zeitpunkt des letzten Schreibens je Verarbeitung; das Dashboard leert seinen Abfrage-Cache, sobald er sich ändert
+CREATE TABLE processing_marker (
+    source VARCHAR(100) PRIMARY KEY,
+    last_processed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Laufzeit und Spark-Metriken je Lauf und Verarbeitungsschritt (lauf_metriken.py); step_name 'gesamt' fasst den Lauf zusammen
+CREATE TABLE pipeline_run_metrics (
+    run_id VARCHAR(150) NOT NULL,
+    job_name VARCHAR(50) NOT NULL,
+    input_name VARCHAR(255) NULL,
+    run_started_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    step_name VARCHAR(50) NOT NULL,
+    step_order INT NOT NULL,
+    wall_seconds NUMERIC(10, 3) NOT NULL,
+    task_seconds NUMERIC(12, 3) NULL,
+    input_records BIGINT NULL,
+    output_records BIGINT NULL,
+    shuffle_read_bytes BIGINT NULL,
+    shuffle_write_bytes BIGINT NULL,
+    spill_bytes BIGINT NULL,
+    PRIMARY KEY (run_id, step_name)
+);
+CREATE INDEX idx_pipeline_run_metrics_start ON pipeline_run_metrics (job_name, run_started_at);
+
+-- EWMA-Zustand je Maschine und Messgröße für anomaly_score (anomalie.py); nach jedem Lauf nur die geänderten Schlüssel
+CREATE TABLE machine_parameter_statistics (
+    machine_id VARCHAR(50) NOT NULL,
+    event_name VARCHAR(50) NOT NULL,
+    parameter_name VARCHAR(50) NOT NULL,
+    ewma_mean DOUBLE PRECISION NOT NULL,
+    ewma_variance DOUBLE PRECISION NOT NULL,
+    sample_count BIGINT NOT NULL,
+    PRIMARY KEY (machine_id, event_name, parameter_name)
+);
+
+-- Zustand je Lauf zum Zeitpunkt des letzten darin bewerteten Messwerts: Ausgangspunkt für --ersetzen (anomalie.statistik_vor)
+CREATE TABLE machine_parameter_statistics_history (
+    machine_id VARCHAR(50) NOT NULL,
+    event_name VARCHAR(50) NOT NULL,
+    parameter_name VARCHAR(50) NOT NULL,
+    last_event_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    ewma_mean DOUBLE PRECISION NOT NULL,
+    ewma_variance DOUBLE PRECISION NOT NULL,
+    sample_count BIGINT NOT NULL,
+    PRIMARY KEY (machine_id, event_name, parameter_name, last_event_timestamp)
+);
+
+-- Eine Zeile je Zyklus (zyklus_tabelle.py); Messwert-Spalten und Bits der error_mask je Kennzahl mit "zyklus" in
+-- config/kennzahlen.json, weitere Messwert-Spalten legen daily_aggregator.py bzw. stream_aggregator.py bei Bedarf an
+CREATE TABLE machine_cycles (
+    machine_id VARCHAR(50) NOT NULL,
+    cycle_seq BIGINT NOT NULL,
+    cycle_start_ts TIMESTAMP WITH TIME ZONE NOT NULL,
+    cycle_time_seconds REAL NULL,
+    pick_force REAL NULL,
+    place_force REAL NULL,
+    as_vacuum REAL NULL,
+    pp_vacuum REAL NULL,
+    as_release REAL NULL,
+    pp_release REAL NULL,
+    error_mask SMALLINT NOT NULL,
+    error_count SMALLINT NOT NULL,
+    PRIMARY KEY (machine_id, cycle_seq)
+);
+CREATE INDEX idx_machine_cycles_start ON machine_cycles USING BRIN (cycle_start_ts);
+
 COMMENT ON TABLE processed_machine_events IS 'Einzelne Maschinen-Events nach minimaler Bereinigung, Fehlerprüfung und Anreicherung um Zyklus-Sequenz.';
-COMMENT ON TABLE hourly_machine_summary IS 'Stündlich aggregierte Kennzahlen und Fehlerzählungen für DieBonder Maschinen-Events.';
\ No newline at end of file
+COMMENT ON VIEW processed_machine_events_view IS 'processed_machine_events mit machine_id, event_name und parameter_name aus den Dimensionstabellen.';
+COMMENT ON TABLE dim_machine IS 'Schlüssel je machine_id für processed_machine_events.';
+COMMENT ON TABLE dim_event IS 'Schlüssel je event_name für processed_machine_events.';
+COMMENT ON TABLE dim_parameter IS 'Schlüssel je parameter_name (auch leer) für processed_machine_events.';
+COMMENT ON TABLE hourly_machine_summary IS 'Stündlich aggregierte Kennzahlen und Fehlerzählungen für DieBonder Maschinen-Events.';
+COMMENT ON TABLE daily_machine_summary IS 'Tägliche Verdichtung von hourly_machine_summary; Mittelwerte als Summe und Anzahl.';
+COMMENT ON TABLE weekly_machine_summary IS 'Wöchentliche Verdichtung (ab Montag) von daily_machine_summary; Mittelwerte als Summe und Anzahl.';
+COMMENT ON TABLE available_dates IS 'Tage mit Einträgen in hourly_machine_summary; ersetzt SELECT DISTINCT über die Stunden im Dashboard.';
+COMMENT ON TABLE machine_processing_state IS 'Letzter verarbeiteter Zeitstempel, letzter cycle_seq und offener Zyklus je Maschine.';
+COMMENT ON TABLE stream_progress IS 'Zuletzt vollständig in die Datenbank geschriebener Micro-Batch je Streaming-Abfrage.';
+COMMENT ON TABLE processing_marker IS 'Letzter Schreibzeitpunkt je Verarbeitung (daily_aggregator, stream_aggregator); invalidiert den Dashboard-Cache.';
+COMMENT ON TABLE pipeline_run_metrics IS 'Laufzeit, Zeilen, Shuffle und Spill je Verarbeitungsschritt eines daily_aggregator-Laufs.';
+COMMENT ON TABLE machine_parameter_statistics IS 'Gleitender Mittelwert und Varianz (EWMA) je Maschine, Event und Parameter für die Anomalie-Bewertung.';
+COMMENT ON TABLE machine_parameter_statistics_history IS 'EWMA-Zustand nach jedem Lauf je Schlüssel, zum Zurücksetzen beim Ersetzen bereits verarbeiteter Events.';
+COMMENT ON TABLE machine_cycles IS 'Ein Zyklus je Zeile: Start, Dauer, Messwerte je Kennzahl und Fehler-Bitmaske, aus processed_machine_events abgeleitet.';
+COMMENT ON COLUMN machine_cycles.cycle_time_seconds IS 'NULL, solange der Zyklus noch kein Cycle_End hat.';
+COMMENT ON COLUMN machine_cycles.error_mask IS 'Bit fehler_bit der Kennzahl (config/kennzahlen.json) gesetzt, wenn eines ihrer Events im Zyklus is_error hat.';
+COMMENT ON COLUMN machine_cycles.error_count IS 'Anzahl Events mit is_error im Zyklus, auch solcher ohne Kennzahl.';
+COMMENT ON COLUMN processed_machine_events.anomaly_score IS 'Abstand des Messwerts zum bisherigen EWMA-Mittelwert in Standardabweichungen; NULL ohne Messwert oder während des Einschwingens.';
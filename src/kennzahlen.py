@@ -0,0 +1,162 @@
+import json
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import (StructType, StructField, StringType, IntegerType, DateType)
+
+
+# Kennzahlen der Stunden-Zusammenfassung aus config/kennzahlen.json. Jede Kennzahl ordnet einem (event_name, parameter_name)
+# eine kennzahl_id zu; die Events werden einmal darauf abgebildet (kennzahl_id, wert, is_error) und in einem einzigen
+# groupBy je Stunde und Maschine aggregiert. Zyklen zählen als Kennzahl 0 (Cycle_Start-Zeile mit cycle_time_seconds als Wert).
+
+KENNZAHLEN_PFAD = "/app/config/kennzahlen.json"
+SUMMARY_SCHLUESSEL = ["summary_date", "hour_of_day", "machine_id"]
+DATE_FORMAT_SUMMARY = "yyyy-MM-dd"
+CYCLE_START_EVENT = "Cycle_Start" # wie in daily_aggregator.py
+ZYKLUS_KENNZAHL_ID = 0
+ZYKLUS_SPALTEN = {
+    "cycle_count": "anzahl", "min_cycle_time_seconds": "min",
+    "max_cycle_time_seconds": "max", "avg_cycle_time_seconds": "avg",
+    "sum_cycle_time_seconds": "summe"
+}
+# Aggregat -> (Spaltentyp in hourly_machine_summary, Nachkommastellen der Kennzahl bzw. des Zyklus)
+AGGREGATE = {
+    "avg":    ("NUMERIC(7, 2)", 2),
+    "min":    ("NUMERIC(7, 2)", 2),
+    "max":    ("NUMERIC(7, 2)", 2),
+    "summe":  ("NUMERIC(14, 3)", 3),
+    "anzahl": ("INT", None),
+    "fehler": ("INT", None)
+}
+ZYKLUS_TYPEN = {"avg": "NUMERIC(10, 3)", "min": "NUMERIC(10, 3)", "max": "NUMERIC(10, 3)", "summe": "NUMERIC(14, 3)", "anzahl": "INT"}
+ZYKLUS_NACHKOMMASTELLEN = 3
+# machine_cycles (zyklus_tabelle.py): feste Spalten; optional je Kennzahl eine Messwert-Spalte und ein Bit in error_mask
+ZYKLUS_TABELLE_FESTE_SPALTEN = ["machine_id", "cycle_seq", "cycle_start_ts", "cycle_time_seconds", "error_mask", "error_count"]
+FEHLER_BITS = 15 # error_mask ist smallint
+
+KENNZAHL_SCHEMA = StructType([
+    StructField("event_name", StringType(), False), StructField("parameter_name", StringType(), False),
+    StructField("kennzahl_id", IntegerType(), False)
+])
+
+
+def lade_kennzahlen(pfad: str = KENNZAHLEN_PFAD) -> list:
+    try:
+        with open(pfad, 'r', encoding='utf-8') as f:
+            konfiguration = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"Kennzahlen-Datei '{pfad}' nicht gefunden.")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Kennzahlen-Datei '{pfad}' ist ungültiges JSON: {e}.")
+
+    kennzahlen, schluessel, spalten = [], set(), set(SUMMARY_SCHLUESSEL) | set(ZYKLUS_SPALTEN)
+    zyklus_spalten, fehler_bits = set(ZYKLUS_TABELLE_FESTE_SPALTEN), set()
+    for name, kennzahl in konfiguration.items():
+        if name.startswith("_") or not isinstance(kennzahl, dict):
+            continue
+        if not kennzahl.get("event_name") or kennzahl.get("parameter_name") is None or not kennzahl.get("spalten"):
+            raise ValueError(f"Kennzahl '{name}': 'event_name', 'parameter_name' und 'spalten' müssen gesetzt sein.")
+        paar = (kennzahl["event_name"], kennzahl["parameter_name"])
+        if paar[0] == CYCLE_START_EVENT:
+            raise ValueError(f"Kennzahl '{name}': {CYCLE_START_EVENT} ist den Zyklus-Spalten vorbehalten.")
+        if paar in schluessel:
+            raise ValueError(f"Kennzahl '{name}': {paar[0]}/{paar[1]} ist bereits einer anderen Kennzahl zugeordnet.")
+        for spalte, aggregat in kennzahl["spalten"].items():
+            if aggregat not in AGGREGATE:
+                raise ValueError(f"Kennzahl '{name}': Aggregat '{aggregat}' für '{spalte}' ungültig, erlaubt: {', '.join(AGGREGATE)}")
+            if spalte in spalten:
+                raise ValueError(f"Kennzahl '{name}': Spalte '{spalte}' ist mehrfach vergeben.")
+            spalten.add(spalte)
+        # Verdichtungen (verdichtung.py) berechnen Mittelwerte aus Summe/Anzahl und min/max nur über Stunden mit Werten
+        aggregate = set(kennzahl["spalten"].values())
+        if aggregate & {"avg", "min", "max", "summe"} and "anzahl" not in aggregate:
+            raise ValueError(f"Kennzahl '{name}': avg/min/max/summe erfordern eine Spalte mit Aggregat 'anzahl'.")
+        if "avg" in aggregate and "summe" not in aggregate:
+            raise ValueError(f"Kennzahl '{name}': avg erfordert eine Spalte mit Aggregat 'summe'.")
+        zyklus = kennzahl.get("zyklus")
+        if zyklus is not None:
+            if not isinstance(zyklus, dict) or not zyklus.get("spalte") or not isinstance(zyklus.get("fehler_bit"), int):
+                raise ValueError(f"Kennzahl '{name}': 'zyklus' erfordert 'spalte' und 'fehler_bit' (Ganzzahl).")
+            if zyklus["spalte"] in zyklus_spalten:
+                raise ValueError(f"Kennzahl '{name}': Spalte '{zyklus['spalte']}' in machine_cycles ist mehrfach vergeben.")
+            if not 0 <= zyklus["fehler_bit"] < FEHLER_BITS or zyklus["fehler_bit"] in fehler_bits:
+                raise ValueError(f"Kennzahl '{name}': fehler_bit {zyklus['fehler_bit']} ungültig oder mehrfach vergeben "
+                                 f"(erlaubt 0 bis {FEHLER_BITS - 1}).")
+            zyklus_spalten.add(zyklus["spalte"])
+            fehler_bits.add(zyklus["fehler_bit"])
+        schluessel.add(paar)
+        kennzahlen.append({
+            "name": name, "kennzahl_id": len(kennzahlen) + 1, "event_name": paar[0], "parameter_name": paar[1],
+            "spalten": dict(kennzahl["spalten"]), "zyklus": dict(zyklus) if zyklus else None
+        })
+    return kennzahlen
+
+
+def summary_spalten(kennzahlen: list) -> list:
+    return SUMMARY_SCHLUESSEL + [spalte for kennzahl in kennzahlen for spalte in kennzahl["spalten"]] + list(ZYKLUS_SPALTEN)
+
+
+def spalten_typen(kennzahlen: list, mit_avg: bool = True) -> dict:
+    # Kennzahl-Spalten mit Datentyp; die Verdichtungen speichern statt Mittelwerten nur Summe und Anzahl
+    typen = {
+        spalte: AGGREGATE[aggregat][0]
+        for kennzahl in kennzahlen for spalte, aggregat in kennzahl["spalten"].items() if mit_avg or aggregat != "avg"
+    }
+    typen.update({spalte: ZYKLUS_TYPEN[aggregat] for spalte, aggregat in ZYKLUS_SPALTEN.items() if mit_avg or aggregat != "avg"})
+    return typen
+
+
+def ergaenze_summary_spalten(conn, tabelle: str, kennzahlen: list, mit_avg: bool = True):
+    # Neue Kennzahlen aus der Konfiguration: fehlende Spalten anlegen, bestehende Zeilen bleiben NULL
+    with conn.cursor() as cur:
+        for spalte, typ in spalten_typen(kennzahlen, mit_avg).items():
+            cur.execute(f"ALTER TABLE {tabelle} ADD COLUMN IF NOT EXISTS {spalte} {typ}")
+    conn.commit()
+
+
+def _aggregiere(aggregat: str, kennzahl_id: int, spalte: str, nachkommastellen: int):
+    ist_kennzahl = F.col("kennzahl_id") == kennzahl_id
+    if aggregat == "fehler":
+        ausdruck = F.sum(F.when(ist_kennzahl, F.col("is_error")))
+    elif aggregat == "anzahl":
+        ausdruck = F.count(F.when(ist_kennzahl, F.col("wert")))
+    elif aggregat == "summe":
+        ausdruck = F.round(F.sum(F.when(ist_kennzahl, F.col("wert"))), nachkommastellen)
+    else:
+        ausdruck = F.round(getattr(F, aggregat)(F.when(ist_kennzahl, F.col("wert"))), nachkommastellen)
+    return ausdruck.alias(spalte)
+
+
+def berechne_stunden_zusammenfassung(events_mit_zyklus_df: DataFrame, kennzahlen: list) -> DataFrame:
+    # Zuordnung zur Stunde des Zyklusstarts; Events vor dem ersten Cycle_Start gehen nicht ein
+    kennzahl_df = events_mit_zyklus_df.sparkSession.createDataFrame(
+        [(kennzahl["event_name"], kennzahl["parameter_name"], kennzahl["kennzahl_id"]) for kennzahl in kennzahlen],
+        KENNZAHL_SCHEMA
+    )
+    ist_zyklus = (F.col("event_name") == CYCLE_START_EVENT) & (F.col("cycle_seq") > 0)
+    vorpivotiert_df = events_mit_zyklus_df \
+        .filter(F.col("cycle_start_ts").isNotNull()) \
+        .join(F.broadcast(kennzahl_df), on=["event_name", "parameter_name"], how="left") \
+        .select(
+            F.date_format(F.col("cycle_start_ts"), DATE_FORMAT_SUMMARY).cast(DateType()).alias("summary_date"),
+            F.hour(F.col("cycle_start_ts")).alias("hour_of_day"),
+            "machine_id",
+            F.when(ist_zyklus, F.lit(ZYKLUS_KENNZAHL_ID)).otherwise(F.col("kennzahl_id")).alias("kennzahl_id"),
+            F.when(ist_zyklus, F.col("cycle_time_seconds")).otherwise(F.col("value")).alias("wert"),
+            "is_error"
+        ) \
+        .filter(F.col("kennzahl_id").isNotNull())
+
+    aggregationen = [
+        _aggregiere(aggregat, kennzahl["kennzahl_id"], spalte, AGGREGATE[aggregat][1])
+        for kennzahl in kennzahlen for spalte, aggregat in kennzahl["spalten"].items()
+    ] + [
+        _aggregiere(aggregat, ZYKLUS_KENNZAHL_ID, spalte, ZYKLUS_NACHKOMMASTELLEN)
+        for spalte, aggregat in ZYKLUS_SPALTEN.items()
+    ]
+    spalten = summary_spalten(kennzahlen)
+    # Stunden ohne Werte einer Kennzahl: 0 statt NULL
+    return vorpivotiert_df \
+        .groupBy(SUMMARY_SCHLUESSEL) \
+        .agg(*aggregationen) \
+        .fillna(0, subset=spalten[len(SUMMARY_SCHLUESSEL):]) \
+        .select(spalten)
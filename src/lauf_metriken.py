@@ -0,0 +1,128 @@
+import json
+import time
+import datetime
+import urllib.request
+from contextlib import contextmanager
+from pyspark.sql import SparkSession
+from processing_state import setze_verarbeitungsmarker
+
+
+# Laufzeit und Spark-Metriken je logischem Verarbeitungsschritt eines Laufs. Jeder Schritt läuft in einer eigenen
+# Spark-Jobgruppe; der StatusTracker liefert die Jobs und Stages der Gruppe, die Stage-Metriken (Zeilen, Shuffle, Spill)
+# kommen aus der REST-API der Spark-UI. Ergebnis: Zeilen in pipeline_run_metrics und eine JSON-Zeile auf stdout.
+
+METRIK_TABELLE = "pipeline_run_metrics"
+GESAMT_SCHRITT = "gesamt"
+# Feld der Stage-API -> Kennzahl; Spill aus Arbeitsspeicher und Platte zusammen
+STAGE_FELDER = {
+    "inputRecords": "eingabe_zeilen",
+    "outputRecords": "ausgabe_zeilen",
+    "shuffleReadBytes": "shuffle_lese_bytes",
+    "shuffleWriteBytes": "shuffle_schreib_bytes",
+    "memoryBytesSpilled": "spill_bytes",
+    "diskBytesSpilled": "spill_bytes",
+    "executorRunTime": "task_ms"
+}
+KENNZAHLEN = ["eingabe_zeilen", "ausgabe_zeilen", "shuffle_lese_bytes", "shuffle_schreib_bytes", "spill_bytes", "task_ms"]
+
+
+class LaufMetriken:
+    def __init__(self, spark: SparkSession, job: str, eingabe: str):
+        self.spark = spark
+        self.job = job
+        self.eingabe = eingabe
+        self.gestartet = datetime.datetime.now(datetime.timezone.utc)
+        self.lauf_id = f"{spark.sparkContext.applicationId}-{self.gestartet:%Y%m%dT%H%M%S%f}"
+        self.schritte = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def schritt(self, name: str):
+        # Der Aufrufer kann Zeilenzahlen setzen, die Spark nicht kennt (z. B. per COPY geschriebene Zeilen)
+        werte = {"schritt": name, "gruppe": f"{self.lauf_id}:{name}"}
+        sc = self.spark.sparkContext
+        sc.setJobGroup(werte["gruppe"], f"{self.job}: {name}")
+        start = time.perf_counter()
+        try:
+            yield werte
+        finally:
+            werte["dauer_s"] = time.perf_counter() - start
+            sc.setLocalProperty("spark.jobGroup.id", None)
+            sc.setLocalProperty("spark.job.description", None)
+            self.schritte.append(werte)
+
+    def _stage_metriken(self) -> dict:
+        sc = self.spark.sparkContext
+        if not sc.uiWebUrl:
+            return {}
+        # Alle Listener-Ereignisse verarbeitet, sonst fehlen die letzten Stages
+        sc._jsc.sc().listenerBus().waitUntilEmpty()
+        with urllib.request.urlopen(f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/stages?status=complete") as antwort:
+            stages = json.load(antwort)
+        metriken = {}
+        for stage in stages:
+            summen = metriken.setdefault(stage["stageId"], dict.fromkeys(KENNZAHLEN, 0))
+            for feld, kennzahl in STAGE_FELDER.items():
+                summen[kennzahl] += stage.get(feld, 0)
+        return metriken
+
+    def ergebnis(self) -> dict:
+        try:
+            stage_metriken = self._stage_metriken()
+        except Exception as e:
+            print(f"WARNUNG: Stage-Metriken nicht verfügbar ({e}), nur Laufzeiten werden gemeldet.")
+            stage_metriken = {}
+        tracker = self.spark.sparkContext.statusTracker()
+        # Eine Stage, die ein späterer Job wiederverwendet (übersprungen), zählt nur für den Schritt, der sie ausgeführt hat
+        zugeordnet = set()
+        schritte = []
+        for werte in self.schritte:
+            stage_ids = set()
+            for job_id in tracker.getJobIdsForGroup(werte["gruppe"]):
+                job = tracker.getJobInfo(job_id)
+                if job:
+                    stage_ids.update(job.stageIds)
+            stage_ids = (stage_ids & stage_metriken.keys()) - zugeordnet
+            zugeordnet |= stage_ids
+            schritt = {"schritt": werte["schritt"], "dauer_s": round(werte["dauer_s"], 3), "stages": len(stage_ids)}
+            for kennzahl in KENNZAHLEN:
+                schritt[kennzahl] = sum(stage_metriken[stage_id][kennzahl] for stage_id in stage_ids)
+            for kennzahl in ("eingabe_zeilen", "ausgabe_zeilen"):
+                if werte.get(kennzahl) is not None:
+                    schritt[kennzahl] = werte[kennzahl]
+            schritte.append(schritt)
+        gesamt = {"schritt": GESAMT_SCHRITT, "dauer_s": round(time.perf_counter() - self._start, 3), "stages": len(zugeordnet)}
+        # Zeilenzahlen der Schritte bauen aufeinander auf und ergeben summiert keine sinnvolle Gesamtzahl
+        for kennzahl in KENNZAHLEN:
+            gesamt[kennzahl] = None if kennzahl.endswith("_zeilen") else sum(schritt[kennzahl] for schritt in schritte)
+        return {
+            "lauf_id": self.lauf_id, "job": self.job, "eingabe": self.eingabe,
+            "gestartet": self.gestartet.isoformat(), "schritte": schritte + [gesamt]
+        }
+
+    def melde(self, conn) -> dict:
+        ergebnis = self.ergebnis()
+        print(f"Laufmetriken: {json.dumps(ergebnis, ensure_ascii=False)}")
+        for schritt in ergebnis["schritte"]:
+            zeilen = "" if schritt["eingabe_zeilen"] is None else \
+                f"{schritt['eingabe_zeilen']:>11} -> {schritt['ausgabe_zeilen']:>11} Zeilen"
+            print(f"  {schritt['schritt']:<20}{schritt['dauer_s']:>9.1f} s  {zeilen:<35}"
+                  f"  Shuffle {schritt['shuffle_schreib_bytes'] / 1024 / 1024:.1f} MiB"
+                  f"  Spill {schritt['spill_bytes'] / 1024 / 1024:.1f} MiB")
+        with conn.cursor() as cur:
+            for reihenfolge, schritt in enumerate(ergebnis["schritte"]):
+                cur.execute(f"""
+                    INSERT INTO {METRIK_TABELLE} (
+                        run_id, job_name, input_name, run_started_at, step_name, step_order, wall_seconds, task_seconds,
+                        input_records, output_records, shuffle_read_bytes, shuffle_write_bytes, spill_bytes
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (run_id, step_name) DO NOTHING
+                """, (
+                    self.lauf_id, self.job, self.eingabe, self.gestartet, schritt["schritt"], reihenfolge,
+                    schritt["dauer_s"], schritt["task_ms"] / 1000, schritt["eingabe_zeilen"], schritt["ausgabe_zeilen"],
+                    schritt["shuffle_lese_bytes"], schritt["shuffle_schreib_bytes"], schritt["spill_bytes"]
+                ))
+        conn.commit()
+        # Neue Laufmetriken sollen im Dashboard ohne Warten auf den Cache erscheinen
+        setze_verarbeitungsmarker(conn, self.job)
+        return ergebnis
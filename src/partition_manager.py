@@ -0,0 +1,175 @@
+import re
+import zlib
+import datetime
+
+
+# Verwaltung der Tages-Partitionen (optional je Maschine unterteilt) von processed_machine_events.
+# Neue Partitionen werden als eigenständige Staging-Tabelle befüllt und erst danach per ATTACH PARTITION
+# eingehängt: die Indizes entstehen dabei einmalig im Bulk statt pro eingefügter Zeile.
+# Beim Ersetzen wird auch eine bestehende Partition neu als Staging-Tabelle aufgebaut und in einer Transaktion
+# gegen die alte getauscht: Abfragen sehen entweder den alten oder den neuen Stand eines Maschinentags.
+
+ERSATZ_ENDUNG = "_r" # Staging-Tabelle für eine bestehende Partition; der Name bleibt unter 63 Zeichen
+
+def partitions_name(tabelle: str, tag: datetime.date, machine_id: str = None) -> str:
+    name = f"{tabelle}_p{tag:%Y%m%d}"
+    if machine_id is None:
+        return name
+    # Postgres-Bezeichner sind auf 63 Zeichen begrenzt, die Prüfsumme hält gekürzte IDs eindeutig
+    kurzform = re.sub(r"[^a-z0-9]+", "_", machine_id.lower()).strip("_")[:16]
+    return f"{name}_{kurzform}_{zlib.crc32(machine_id.encode('utf-8')):08x}"
+
+
+def _tages_grenzen(tag: datetime.date) -> tuple[str, str]:
+    return f"{tag.isoformat()} 00:00:00+00", f"{(tag + datetime.timedelta(days=1)).isoformat()} 00:00:00+00"
+
+
+def _unterpartitionen(cur, eltern: str) -> dict:
+    # Name -> True, falls die Partition selbst wieder partitioniert ist
+    cur.execute("""
+        SELECT c.relname, c.relkind = 'p'
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (eltern,))
+    return dict(cur.fetchall())
+
+
+def _erstelle_staging_tabelle(cur, tabelle: str, name: str):
+    # Reste eines abgebrochenen Laufs (nicht angehängte Staging-Tabelle) werden verworfen
+    cur.execute(f"DROP TABLE IF EXISTS {name}")
+    cur.execute(f"CREATE TABLE {name} (LIKE {tabelle} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+
+
+def _erstelle_ersatz_tabelle(cur, tabelle: str, partition: str, ersetzen: dict, maschinen_schluessel: dict) -> str:
+    # Staging-Tabelle für eine bestehende Partition mit deren Zeilen, die nicht ersetzt werden: andere Maschinen
+    # und Events vor dem Beginn des Ersetzens (ersetzen: machine_id -> erstes Event der neuen Eingabe)
+    name = f"{partition}{ERSATZ_ENDUNG}"
+    _erstelle_staging_tabelle(cur, tabelle, name)
+    ersetzt = " OR ".join(
+        cur.mogrify("(machine_key = %s AND event_timestamp >= %s)", (int(maschinen_schluessel[machine_id]), beginn)).decode()
+        for machine_id, beginn in sorted(ersetzen.items())
+    )
+    cur.execute(f"INSERT INTO {name} SELECT * FROM {partition} WHERE NOT ({ersetzt})")
+    return name
+
+
+# Schreibziele für die (Tag, machine_id)-Paare eines Laufs. Für neue Partitionen entsteht eine leere Staging-Tabelle
+# (anhängen mit haenge_partitionen_an()), bestehende Partitionen (z. B. späte Datei) werden über die Elterntabelle befüllt.
+# "schluessel" enthält die (Tag, machine_id)-Paare, deren Zeilen in das jeweilige Ziel gehören. Partitioniert wird nach
+# machine_key (maschinen_schluessel: machine_id -> Schlüssel aus dim_machine), benannt nach der lesbaren machine_id.
+# ersetzen (machine_id -> Zeitstempel): bestehende Partitionen dieser Maschinen werden ab dem Zeitstempel ersetzt statt ergänzt.
+def plane_ladeziele(conn, tabelle: str, ziele: list, maschinen_schluessel: dict, nach_maschine: bool = True,
+                    ersetzen: dict = None) -> list:
+    maschinen_je_tag = {}
+    for tag, machine_id in ziele:
+        maschinen_je_tag.setdefault(tag, set()).add(machine_id)
+
+    ladeziele = []
+    direkt = []
+    with conn.cursor() as cur:
+        tages_partitionen = _unterpartitionen(cur, tabelle)
+        for tag, maschinen in sorted(maschinen_je_tag.items()):
+            von, bis = _tages_grenzen(tag)
+            tag_name = partitions_name(tabelle, tag)
+
+            if tag_name not in tages_partitionen:
+                if not nach_maschine:
+                    _erstelle_staging_tabelle(cur, tabelle, tag_name)
+                    ladeziele.append({
+                        "tabelle": tag_name, "eltern": tabelle, "schluessel": [(tag, m) for m in sorted(maschinen)],
+                        "bereich": f"FOR VALUES FROM ('{von}') TO ('{bis}')",
+                        "pruefung": f"event_timestamp >= '{von}' AND event_timestamp < '{bis}'"
+                    })
+                    continue
+                cur.execute(
+                    f"CREATE TABLE {tag_name} PARTITION OF {tabelle} "
+                    f"FOR VALUES FROM ('{von}') TO ('{bis}') PARTITION BY LIST (machine_key)"
+                )
+                tages_partitionen[tag_name] = True
+
+            if not tages_partitionen[tag_name]:
+                if ersetzen:
+                    # Tages-Partition ohne Unterteilung nach Maschine: als Ganzes tauschen
+                    ladeziele.append({
+                        "tabelle": _erstelle_ersatz_tabelle(cur, tabelle, tag_name, ersetzen, maschinen_schluessel),
+                        "eltern": tabelle, "ersetzt": tag_name, "schluessel": [(tag, m) for m in sorted(maschinen)],
+                        "bereich": f"FOR VALUES FROM ('{von}') TO ('{bis}')",
+                        "pruefung": f"event_timestamp >= '{von}' AND event_timestamp < '{bis}'"
+                    })
+                else:
+                    direkt.extend((tag, m) for m in sorted(maschinen))
+                continue
+
+            maschinen_partitionen = _unterpartitionen(cur, tag_name)
+            for machine_id in sorted(maschinen):
+                maschinen_name = partitions_name(tabelle, tag, machine_id)
+                machine_key = int(maschinen_schluessel[machine_id])
+                if maschinen_name in maschinen_partitionen and not (ersetzen and machine_id in ersetzen):
+                    direkt.append((tag, machine_id))
+                    continue
+                if maschinen_name in maschinen_partitionen:
+                    ziel_name = _erstelle_ersatz_tabelle(
+                        cur, tabelle, maschinen_name, {machine_id: ersetzen[machine_id]}, maschinen_schluessel
+                    )
+                else:
+                    ziel_name = maschinen_name
+                    _erstelle_staging_tabelle(cur, tabelle, maschinen_name)
+                ladeziele.append({
+                    "tabelle": ziel_name, "eltern": tag_name, "schluessel": [(tag, machine_id)],
+                    "ersetzt": maschinen_name if ziel_name != maschinen_name else None,
+                    "bereich": f"FOR VALUES IN ({machine_key})",
+                    "pruefung": f"event_timestamp >= '{von}' AND event_timestamp < '{bis}' AND machine_key = {machine_key}"
+                })
+    conn.commit()
+
+    if direkt:
+        ladeziele.append({"tabelle": tabelle, "eltern": None, "schluessel": direkt})
+    return ladeziele
+
+
+def haenge_partitionen_an(conn, ladeziele: list):
+    # CHECK-Constraint vorab: ATTACH PARTITION muss die Staging-Tabelle dann nicht erneut unter Sperre prüfen.
+    # Alle Partitionen des Laufs, auch getauschte, werden in einer Transaktion sichtbar.
+    with conn.cursor() as cur:
+        for ziel in ladeziele:
+            if not ziel["eltern"]:
+                continue
+            name = ziel["tabelle"]
+            if ziel.get("ersetzt"):
+                cur.execute(f"ALTER TABLE {ziel['eltern']} DETACH PARTITION {ziel['ersetzt']}")
+                cur.execute(f"DROP TABLE {ziel['ersetzt']}")
+                cur.execute(f"ALTER TABLE {name} RENAME TO {ziel['ersetzt']}")
+                name = ziel["ersetzt"]
+            constraint = f"{name}_bereich"
+            cur.execute(f"ALTER TABLE {name} ADD CONSTRAINT {constraint} CHECK ({ziel['pruefung']})")
+            cur.execute(f"ALTER TABLE {ziel['eltern']} ATTACH PARTITION {name} {ziel['bereich']}")
+            cur.execute(f"ALTER TABLE {name} DROP CONSTRAINT {constraint}")
+            print(f"Partition '{name}' an '{ziel['eltern']}' " + ("ersetzt." if ziel.get("ersetzt") else "angehängt."))
+    conn.commit()
+
+
+def entferne_alte_partitionen(conn, tabelle: str, aufbewahrung_tage: int, stichtag: datetime.date = None,
+                              archivieren=None) -> list:
+    # DETACH + DROP einer ganzen Tages-Partition: O(1) statt DELETE über Millionen Zeilen.
+    # archivieren(partition, tag) sichert die Partition vorher; schlägt es fehl, bleibt sie erhalten.
+    grenze = (stichtag or datetime.datetime.now(datetime.timezone.utc).date()) - datetime.timedelta(days=aufbewahrung_tage)
+    entfernt = []
+    with conn.cursor() as cur:
+        for name in sorted(_unterpartitionen(cur, tabelle)):
+            treffer = re.fullmatch(rf"{re.escape(tabelle)}_p(\d{{8}})", name)
+            if not treffer:
+                continue
+            tag = datetime.datetime.strptime(treffer.group(1), "%Y%m%d").date()
+            if tag >= grenze:
+                continue
+            if archivieren:
+                archivieren(name, tag)
+            cur.execute(f"ALTER TABLE {tabelle} DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+            # Je Tag festschreiben: die Sperre auf der Elterntabelle blockiert sonst die Archivierung der nächsten Tage
+            conn.commit()
+            entfernt.append(name)
+    conn.commit()
+    if entfernt:
+        print(f"{len(entfernt)} Tages-Partition(en) vor {grenze} aus '{tabelle}' entfernt: {', '.join(entfernt)}")
+    return entfernt
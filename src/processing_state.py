@@ -0,0 +1,195 @@
+import datetime
+from dimensionen import lade_schluessel
+
+
+# Verarbeitungsstand je Maschine für die inkrementelle Verarbeitung: letzter verarbeiteter Zeitstempel (Wasserstand),
+# letzter vergebener cycle_seq und Start des zuletzt noch offenen Zyklus (Cycle_Start ohne Cycle_End).
+
+STAND_TABELLE = "machine_processing_state"
+
+
+def lade_verarbeitungsstand(conn, maschinen: list = None) -> dict:
+    # Ohne maschinen: der Stand aller Maschinen (eine Zeile je Maschine)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT machine_id, last_event_timestamp, last_cycle_seq, open_cycle_start_ts
+            FROM {STAND_TABELLE}
+            {"" if maschinen is None else "WHERE machine_id = ANY(%s)"}
+        """, None if maschinen is None else (list(maschinen),))
+        return {
+            machine_id: {"last_event_timestamp": letzter_ts, "last_cycle_seq": letzter_zyklus, "open_cycle_start_ts": offener_start}
+            for machine_id, letzter_ts, letzter_zyklus, offener_start in cur.fetchall()
+        }
+
+
+def stand_vor(conn, tabelle: str, beginn: dict) -> dict:
+    # Verarbeitungsstand, wie er vor dem Event beginn[machine_id] bestand: Grundlage für das Ersetzen bereits
+    # gespeicherter Events ab diesem Zeitpunkt (daily_aggregator.py --ersetzen). cycle_seq steigt mit der Zeit,
+    # der letzte Zyklus davor ist daher über den Index (machine_key, cycle_seq) ohne Scan der Historie erreichbar.
+    maschinen_schluessel = lade_schluessel(conn, "machine_id", beginn)
+    staende = {}
+    with conn.cursor() as cur:
+        for machine_id, ab in sorted(beginn.items()):
+            if machine_id not in maschinen_schluessel:
+                continue
+            machine_key = maschinen_schluessel[machine_id]
+            cur.execute(f"""
+                SELECT cycle_seq FROM {tabelle} WHERE machine_key = %s AND event_timestamp < %s ORDER BY cycle_seq DESC LIMIT 1
+            """, (machine_key, ab))
+            zeile = cur.fetchone()
+            if zeile is None:
+                continue
+            cur.execute(f"""
+                SELECT max(event_timestamp),
+                       min(event_timestamp) FILTER (WHERE event_key = (SELECT event_key FROM dim_event WHERE event_name = 'Cycle_Start')),
+                       bool_or(event_key = (SELECT event_key FROM dim_event WHERE event_name = 'Cycle_End'))
+                FROM {tabelle}
+                WHERE machine_key = %s AND cycle_seq = %s AND event_timestamp < %s
+            """, (machine_key, zeile[0], ab))
+            letzter_ts, start_ts, mit_ende = cur.fetchone()
+            staende[machine_id] = {
+                "last_event_timestamp": letzter_ts, "last_cycle_seq": zeile[0],
+                "open_cycle_start_ts": start_ts if zeile[0] > 0 and not mit_ende else None
+            }
+    conn.rollback()
+    return staende
+
+
+def entferne_abgebrochene_events(conn, tabelle: str, staende: dict, erste_events: dict) -> int:
+    # Zeilen eines abgebrochenen Versuchs (Events geschrieben, Wasserstand nicht fortgeschrieben) vor dem erneuten
+    # Schreiben entfernen: nach dem Wasserstand bzw. für Maschinen ohne Wasserstand ab dem ersten Event der Eingabe.
+    # Dank Partitionierung nach Tag und machine_key werden nur die jüngsten Partitionen der Maschine geprüft.
+    maschinen_schluessel = lade_schluessel(conn, "machine_id", erste_events)
+    geloescht = 0
+    with conn.cursor() as cur:
+        for machine_id, erstes in sorted(erste_events.items()):
+            if machine_id not in maschinen_schluessel:
+                continue
+            if machine_id in staende:
+                cur.execute(f"DELETE FROM {tabelle} WHERE machine_key = %s AND event_timestamp > %s",
+                            (maschinen_schluessel[machine_id], staende[machine_id]["last_event_timestamp"]))
+            else:
+                cur.execute(f"DELETE FROM {tabelle} WHERE machine_key = %s AND event_timestamp >= %s",
+                            (maschinen_schluessel[machine_id], erstes))
+            geloescht += cur.rowcount
+    conn.commit()
+    if geloescht:
+        print(f"{geloescht} Zeilen eines abgebrochenen Versuchs aus '{tabelle}' entfernt.")
+    return geloescht
+
+
+def kontext_beginn(stand: dict) -> datetime.datetime:
+    # Stunde, ab der die Zusammenfassung neu berechnet wird: die Stunde des offenen Zyklus bzw. des Wasserstands
+    beginn = (stand["open_cycle_start_ts"] or stand["last_event_timestamp"]).astimezone(datetime.timezone.utc)
+    return beginn.replace(minute=0, second=0, microsecond=0)
+
+
+def kontext_abfrage(conn, sicht: str, staende: dict) -> str:
+    # Bereits gespeicherte Events von Beginn der betroffenen Stunde bis zum Wasserstand je Maschine. Gefiltert wird auf
+    # machine_key als Literal, damit nur die Partitionen dieser Maschinen gelesen werden; die Sicht liefert die Namen.
+    maschinen_schluessel = lade_schluessel(conn, "machine_id", staende)
+    with conn.cursor() as cur:
+        bedingungen = [
+            cur.mogrify(
+                "(machine_key = %s AND event_timestamp >= %s AND event_timestamp <= %s)",
+                (maschinen_schluessel[machine_id], kontext_beginn(stand), stand["last_event_timestamp"])
+            ).decode()
+            for machine_id, stand in sorted(staende.items()) if machine_id in maschinen_schluessel
+        ] or ["FALSE"]
+    return f"""
+        SELECT event_timestamp, machine_id, event_name, parameter_name, value, is_error, cycle_seq
+        FROM {sicht}
+        WHERE {' OR '.join(bedingungen)}
+    """
+
+
+def schliesse_zyklen(conn, tabelle: str, staende: dict, zyklus_zeiten: dict):
+    # Zyklen, deren Cycle_Start im vorherigen Lauf lag: cycle_time_seconds der bereits gespeicherten Zeilen nachtragen
+    maschinen_schluessel = lade_schluessel(conn, "machine_id", zyklus_zeiten)
+    with conn.cursor() as cur:
+        for machine_id, zyklus_zeit in sorted(zyklus_zeiten.items()):
+            stand = staende[machine_id]
+            cur.execute(f"""
+                UPDATE {tabelle} SET cycle_time_seconds = %s
+                WHERE machine_key = %s AND cycle_seq = %s AND event_timestamp >= %s AND event_timestamp <= %s
+            """, (zyklus_zeit, maschinen_schluessel[machine_id], stand["last_cycle_seq"], stand["open_cycle_start_ts"],
+                  stand["last_event_timestamp"]))
+            print(f"Zyklus {stand['last_cycle_seq']} von '{machine_id}' über Dateigrenze zusammengeführt: "
+                  f"{zyklus_zeit:.3f} s, {cur.rowcount} gespeicherte Zeilen aktualisiert.")
+    conn.commit()
+
+
+def speichere_verarbeitungsstand(conn, neue_staende: list):
+    # Zeitstempel als Text mit Offset (UTC), vgl. bulk_loader.COPY_TIMESTAMP_FORMAT
+    with conn.cursor() as cur:
+        for zeile in neue_staende:
+            cur.execute(f"""
+                INSERT INTO {STAND_TABELLE} (machine_id, last_event_timestamp, last_cycle_seq, open_cycle_start_ts, updated_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (machine_id) DO UPDATE SET
+                    last_event_timestamp = EXCLUDED.last_event_timestamp,
+                    last_cycle_seq = EXCLUDED.last_cycle_seq,
+                    open_cycle_start_ts = EXCLUDED.open_cycle_start_ts,
+                    updated_at = EXCLUDED.updated_at
+            """, (zeile["machine_id"], zeile["last_event_timestamp"], zeile["last_cycle_seq"], zeile["open_cycle_start_ts"]))
+    conn.commit()
+    for zeile in neue_staende:
+        offen = f", offener Zyklus seit {zeile['open_cycle_start_ts']}" if zeile["open_cycle_start_ts"] else ""
+        print(f"Verarbeitungsstand '{zeile['machine_id']}': bis {zeile['last_event_timestamp']}, "
+              f"cycle_seq {zeile['last_cycle_seq']}{offen}")
+
+
+# Fortschritt der Streaming-Abfrage (stream_aggregator.py): zuletzt vollständig geschriebener Micro-Batch.
+# Nach einem Neustart wiederholt Spark den letzten, nicht bestätigten Batch mit identischem Inhalt.
+
+STREAM_FORTSCHRITT_TABELLE = "stream_progress"
+
+
+def letzter_stream_batch(conn, abfrage: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT last_batch_id FROM {STREAM_FORTSCHRITT_TABELLE} WHERE query_name = %s", (abfrage,))
+        zeile = cur.fetchone()
+    return zeile[0] if zeile else -1
+
+
+def merke_stream_batch(conn, abfrage: str, batch_id: int):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {STREAM_FORTSCHRITT_TABELLE} (query_name, last_batch_id, updated_at)
+            VALUES (%s, %s, now())
+            ON CONFLICT (query_name) DO UPDATE SET last_batch_id = EXCLUDED.last_batch_id, updated_at = EXCLUDED.updated_at
+        """, (abfrage, batch_id))
+    conn.commit()
+
+
+# Verarbeitungsmarker: Zeitpunkt des letzten Schreibens je Quelle, vom Dashboard-Cache (dashboard_db.py) abgefragt
+
+MARKER_TABELLE = "processing_marker"
+
+
+def setze_verarbeitungsmarker(conn, quelle: str):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {MARKER_TABELLE} (source, last_processed_at)
+            VALUES (%s, now())
+            ON CONFLICT (source) DO UPDATE SET last_processed_at = EXCLUDED.last_processed_at
+        """, (quelle,))
+    conn.commit()
+
+
+def entferne_zyklen(conn, tabelle: str, bereiche: list) -> int:
+    # Zeilen eines abgebrochenen Batch-Versuchs entfernen: ein Batch enthält je Maschine nur vollständige Zyklen
+    geloescht = 0
+    # Maschinen ohne Schlüssel haben noch keine gespeicherten Events
+    maschinen_schluessel = lade_schluessel(conn, "machine_id", [machine_id for machine_id, _, _ in bereiche])
+    with conn.cursor() as cur:
+        for machine_id, von_seq, bis_seq in bereiche:
+            if machine_id not in maschinen_schluessel:
+                continue
+            cur.execute(f"DELETE FROM {tabelle} WHERE machine_key = %s AND cycle_seq BETWEEN %s AND %s",
+                        (maschinen_schluessel[machine_id], von_seq, bis_seq))
+            geloescht += cur.rowcount
+    conn.commit()
+    if geloescht:
+        print(f"{geloescht} Zeilen eines abgebrochenen Batch-Versuchs aus '{tabelle}' entfernt.")
+    return geloescht
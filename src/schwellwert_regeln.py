@@ -0,0 +1,131 @@
+import datetime
+from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import (StructType, StructField, StringType, TimestampType, DoubleType, ArrayType, IntegerType)
+
+
+# Schwellwert-Regeln aus schwellwerte.json als kleine Lookup-Tabelle: je (event_name, parameter_name) eine untere und/oder
+# obere Grenze, optional nur für eine machine_id und ein Gültigkeitsintervall [gueltig_ab, gueltig_bis).
+# Die Fehlerprüfung ist ein Broadcast-Join auf (event_name, parameter_name) plus ein Vergleich, unabhängig von der Anzahl Regeln.
+
+REGEL_SCHEMA = StructType([
+    StructField("regel_event_name", StringType(), False), StructField("regel_parameter_name", StringType(), False),
+    StructField("regel_machine_id", StringType(), True), StructField("ausgenommene_maschinen", ArrayType(StringType()), False),
+    StructField("gueltig_ab", TimestampType(), True), StructField("gueltig_bis", TimestampType(), True),
+    StructField("untergrenze", DoubleType(), True), StructField("obergrenze", DoubleType(), True)
+])
+
+
+def _zeitpunkt(regel_name: str, text: str) -> datetime.datetime:
+    # Datum (Tagesbeginn UTC) oder Zeitstempel nach ISO 8601; ohne Angabe unbegrenzt
+    if text is None:
+        return None
+    try:
+        if len(text) == 10:
+            return datetime.datetime.combine(datetime.date.fromisoformat(text), datetime.time(), datetime.timezone.utc)
+        zeitpunkt = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Schwellwert-Regel '{regel_name}': ungültiges Datum '{text}', erwartet z. B. 2024-10-16 oder 2024-10-16T06:00:00Z")
+    return zeitpunkt if zeitpunkt.tzinfo else zeitpunkt.replace(tzinfo=datetime.timezone.utc)
+
+
+def _grenzen(regel: dict) -> tuple:
+    if "error_if_above" in regel:
+        return None, float(regel["error_if_above"])
+    if "error_if_below" in regel:
+        return float(regel["error_if_below"]), None
+    if "error_if_outside_range" in regel:
+        untergrenze, obergrenze = regel["error_if_outside_range"]
+        return float(untergrenze), float(obergrenze)
+    return None
+
+
+def _ueberschneiden(a: dict, b: dict) -> bool:
+    return (a["gueltig_ab"] is None or b["gueltig_bis"] is None or a["gueltig_ab"] < b["gueltig_bis"]) and \
+           (b["gueltig_ab"] is None or a["gueltig_bis"] is None or b["gueltig_ab"] < a["gueltig_bis"])
+
+
+def _deckt_ab(regel: dict, von: datetime.datetime, bis: datetime.datetime) -> bool:
+    return (regel["gueltig_ab"] is None or (von is not None and regel["gueltig_ab"] <= von)) and \
+           (regel["gueltig_bis"] is None or (bis is not None and bis <= regel["gueltig_bis"]))
+
+
+def lies_regeln(schwellwerte_config: dict) -> list:
+    regeln = []
+    for regel_name, regel in schwellwerte_config.items():
+        if regel_name.startswith("_") or not isinstance(regel, dict):
+            continue
+        grenzen = _grenzen(regel)
+        if grenzen is None:
+            print(f"Schwellwert-Regel '{regel_name}' ohne error_if_above/error_if_below/error_if_outside_range wird ignoriert.")
+            continue
+        if not regel.get("event_name") or regel.get("parameter_name") is None:
+            raise ValueError(f"Schwellwert-Regel '{regel_name}': 'event_name' und 'parameter_name' müssen gesetzt sein.")
+        gueltig_ab, gueltig_bis = _zeitpunkt(regel_name, regel.get("gueltig_ab")), _zeitpunkt(regel_name, regel.get("gueltig_bis"))
+        if gueltig_ab and gueltig_bis and gueltig_ab >= gueltig_bis:
+            raise ValueError(f"Schwellwert-Regel '{regel_name}': gueltig_ab muss vor gueltig_bis liegen.")
+        regeln.append({
+            "name": regel_name, "event_name": regel["event_name"], "parameter_name": regel["parameter_name"],
+            "machine_id": regel.get("machine_id"), "gueltig_ab": gueltig_ab, "gueltig_bis": gueltig_bis,
+            "untergrenze": grenzen[0], "obergrenze": grenzen[1]
+        })
+    return regeln
+
+
+def kompiliere_regeln(schwellwerte_config: dict) -> list:
+    # Jedes Event darf höchstens eine Zeile der Lookup-Tabelle treffen: maschinenspezifische Regeln haben Vorrang,
+    # allgemeine Regeln werden an deren Intervallgrenzen geteilt und schließen die Maschine dort aus
+    regeln_je_schluessel = {}
+    for regel in lies_regeln(schwellwerte_config):
+        regeln_je_schluessel.setdefault((regel["event_name"], regel["parameter_name"]), []).append(regel)
+
+    zeilen = []
+    for (event_name, parameter_name), regeln in sorted(regeln_je_schluessel.items()):
+        for i, a in enumerate(regeln):
+            for b in regeln[i + 1:]:
+                if a["machine_id"] == b["machine_id"] and _ueberschneiden(a, b):
+                    raise ValueError(f"Schwellwert-Regeln '{a['name']}' und '{b['name']}' überschneiden sich "
+                                     f"für {event_name}/{parameter_name}" + (f" und '{a['machine_id']}'" if a["machine_id"] else ""))
+
+        spezifisch = [regel for regel in regeln if regel["machine_id"]]
+        for regel in spezifisch:
+            zeilen.append((event_name, parameter_name, regel["machine_id"], [], regel["gueltig_ab"], regel["gueltig_bis"],
+                           regel["untergrenze"], regel["obergrenze"]))
+
+        grenzpunkte = sorted({t for regel in regeln for t in (regel["gueltig_ab"], regel["gueltig_bis"]) if t is not None})
+        intervalle = list(zip([None] + grenzpunkte, grenzpunkte + [None]))
+        for regel in (regel for regel in regeln if not regel["machine_id"]):
+            for von, bis in intervalle:
+                if not _deckt_ab(regel, von, bis):
+                    continue
+                ausgenommen = sorted({s["machine_id"] for s in spezifisch if _deckt_ab(s, von, bis)})
+                # Aufeinanderfolgende Intervalle mit denselben Ausnahmen zusammenfassen
+                if zeilen and zeilen[-1][:4] == (event_name, parameter_name, None, ausgenommen) and zeilen[-1][5] == von \
+                        and zeilen[-1][6:] == (regel["untergrenze"], regel["obergrenze"]):
+                    zeilen[-1] = zeilen[-1][:5] + (bis,) + zeilen[-1][6:]
+                else:
+                    zeilen.append((event_name, parameter_name, None, ausgenommen, von, bis, regel["untergrenze"], regel["obergrenze"]))
+    return zeilen
+
+
+def erstelle_regel_tabelle(spark: SparkSession, schwellwerte_config: dict) -> DataFrame:
+    return spark.createDataFrame(kompiliere_regeln(schwellwerte_config), REGEL_SCHEMA)
+
+
+def markiere_fehler(events_df: DataFrame, regel_df: DataFrame) -> DataFrame:
+    # Events ohne passende Regel oder ohne Wert behalten is_error = 0
+    regel_trifft_zu = (
+        (F.col("event_name") == F.col("regel_event_name")) &
+        (F.col("parameter_name") == F.col("regel_parameter_name")) &
+        (
+            (F.col("regel_machine_id") == F.col("machine_id")) |
+            (F.col("regel_machine_id").isNull() & ~F.array_contains(F.col("ausgenommene_maschinen"), F.col("machine_id")))
+        ) &
+        (F.col("gueltig_ab").isNull() | (F.col("event_timestamp") >= F.col("gueltig_ab"))) &
+        (F.col("gueltig_bis").isNull() | (F.col("event_timestamp") < F.col("gueltig_bis")))
+    )
+    ist_fehler = (F.col("value") < F.col("untergrenze")) | (F.col("value") > F.col("obergrenze"))
+    return events_df \
+        .join(F.broadcast(regel_df), regel_trifft_zu, how="left") \
+        .withColumn("is_error", F.when(ist_fehler, 1).otherwise(0).cast(IntegerType())) \
+        .drop(*REGEL_SCHEMA.fieldNames())
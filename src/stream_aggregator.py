@@ -0,0 +1,396 @@
+import sys
+import os
+import json
+import argparse
+import functools
+import traceback
+import numpy as np
+import pandas as pd
+import psycopg2
+from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.streaming.state import GroupStateTimeout
+from pyspark.sql.types import (StructType, StructField, StringType, TimestampType, FloatType, IntegerType, LongType)
+import bulk_loader
+from bulk_loader import upsert_zeilen
+from daily_aggregator import (
+    CSV_INPUT_SCHEMA, PARQUET_INPUT_SCHEMA, CYCLE_START_EVENT, CYCLE_END_EVENT, EVENT_RANG,
+    PROCESSED_EVENTS_TABLE, HOURLY_SUMMARY_TABLE, SUMMARY_SCHLUESSEL,
+    bereinige_csv, bereinige_parquet, finde_fehler_basierend_auf_schwellwerten, schreibe_events,
+    lade_schwellwerte, lade_db_konfiguration, lade_schreib_konfiguration
+)
+from kennzahlen import ZYKLUS_SPALTEN, lade_kennzahlen, summary_spalten, ergaenze_summary_spalten
+from zyklus_tabelle import ergaenze_zyklen_spalten, berechne_maschinen_zyklen, schreibe_maschinen_zyklen
+from verdichtung import TAGES_TABELLE, WOCHEN_TABELLE, aktualisiere_verdichtungen
+from processing_state import letzter_stream_batch, merke_stream_batch, entferne_zyklen, setze_verarbeitungsmarker
+from ausfuehrungsplan import lade_plan_konfiguration
+
+
+# Streaming-Variante von daily_aggregator.py: verarbeitet neue Dateien in /data/raw (oder Zeilen von einem Socket)
+# in Micro-Batches. Zyklusnummer, offener Zyklus und Stunden-Aggregate liegen je Maschine im Spark-State
+# (applyInPandasWithState), der mit dem Checkpoint gesichert wird.
+
+INPUT_VERZEICHNIS = "/data/raw"
+PARQUET_DATASET = "machine_event_logs.parquet" # vgl. generate_data.py
+CHECKPOINT_VERZEICHNIS = "/data/checkpoints/stream_aggregator"
+ABFRAGE_NAME = "stream_aggregator"
+QUELLEN = ("parquet", "csv", "socket")
+# COPY-Verbindungen je Micro-Batch ohne festen COPY_PARALLELITAET: die Größe eines Batches ist vorab nicht bekannt
+COPY_PARALLELITAET_STANDARD = 4
+
+EVENT_SPALTEN = ["event_timestamp", "machine_id", "event_name", "parameter_name", "value", "is_error", "cycle_seq", "cycle_time_seconds"]
+PUFFER_SPALTEN = ["event_timestamp", "event_name", "parameter_name", "value", "is_error", "cycle_seq"]
+
+# Ausgabe des State-Operators: abgeschlossene Events (art = "event") und aktualisierte Stunden (art = "stunde", als JSON)
+AUSGABE_SCHEMA = StructType([
+    StructField("art", StringType(), False),
+    StructField("event_timestamp", TimestampType(), True), StructField("machine_id", StringType(), False),
+    StructField("event_name", StringType(), True), StructField("parameter_name", StringType(), True),
+    StructField("value", FloatType(), True), StructField("is_error", IntegerType(), True),
+    StructField("cycle_seq", LongType(), True), StructField("cycle_time_seconds", FloatType(), True),
+    StructField("zusammenfassung", StringType(), True)
+])
+STATE_SCHEMA = StructType([
+    StructField("cycle_seq", LongType(), False),
+    StructField("puffer", StringType(), True),   # Events des offenen Zyklus (JSON)
+    StructField("stunden", StringType(), True)   # Stunden-Aggregate, deren Stunde noch nicht abgeschlossen ist (JSON)
+])
+
+# Hilfsfunktionen
+
+def puffer_als_json(puffer: pd.DataFrame) -> str:
+    return json.dumps({
+        "event_timestamp": puffer["event_timestamp"].astype("datetime64[ns]").astype("int64").tolist(),
+        "event_name": puffer["event_name"].tolist(),
+        "parameter_name": puffer["parameter_name"].tolist(),
+        "value": [None if pd.isna(wert) else float(wert) for wert in puffer["value"]],
+        "is_error": puffer["is_error"].astype(int).tolist(),
+        "cycle_seq": puffer["cycle_seq"].astype(int).tolist()
+    })
+
+
+def puffer_aus_json(text: str) -> pd.DataFrame:
+    daten = json.loads(text) if text else {spalte: [] for spalte in PUFFER_SPALTEN}
+    return pd.DataFrame({
+        "event_timestamp": pd.to_datetime(np.array(daten["event_timestamp"], dtype=np.int64), unit="ns"),
+        "event_name": pd.Series(daten["event_name"], dtype=object),
+        "parameter_name": pd.Series(daten["parameter_name"], dtype=object),
+        "value": np.array([np.nan if wert is None else wert for wert in daten["value"]], dtype=np.float32),
+        "is_error": np.array(daten["is_error"], dtype=np.int32),
+        "cycle_seq": np.array(daten["cycle_seq"], dtype=np.int64)
+    })
+
+
+def mit_zyklus_grenzen(events: pd.DataFrame) -> pd.DataFrame:
+    # Wie berechne_zyklus_grenzen(): Start/Ende aus Cycle_Start/Cycle_End des Zyklus, cycle_seq 0 bleibt ohne Zyklus
+    ist_start_event = (events["cycle_seq"] > 0) & (events["event_name"] == CYCLE_START_EVENT)
+    ist_grenz_event = (events["cycle_seq"] > 0) & events["event_name"].isin([CYCLE_START_EVENT, CYCLE_END_EVENT])
+    start = events["cycle_seq"].map(events[ist_start_event].groupby("cycle_seq")["event_timestamp"].min())
+    ende = events["cycle_seq"].map(events[ist_grenz_event].groupby("cycle_seq")["event_timestamp"].max())
+    return events.assign(
+        cycle_start_ts=start,
+        cycle_time_seconds=(ende - start).dt.total_seconds().astype(np.float32)
+    )
+
+
+def _addiere(ziel: dict, name: str, anzahl: int, summe: float, minimum: float, maximum: float):
+    bisher = ziel.get(name)
+    if bisher is None:
+        ziel[name] = [int(anzahl), float(summe), float(minimum), float(maximum)]
+    else:
+        ziel[name] = [bisher[0] + int(anzahl), bisher[1] + float(summe), min(bisher[2], float(minimum)), max(bisher[3], float(maximum))]
+
+
+def aktualisiere_stunden(stunden: dict, events: pd.DataFrame, kennzahlen: list) -> list:
+    # Zuordnung zur Stunde des Zyklusstarts wie im Batch; liefert die geänderten Stunden
+    mit_start = events[events["cycle_start_ts"].notna()]
+    if mit_start.empty:
+        return []
+    # Summen in float64 wie Sparks avg()
+    mit_start = mit_start.assign(
+        stunde=mit_start["cycle_start_ts"].dt.strftime("%Y-%m-%dT%H"),
+        value=mit_start["value"].astype(np.float64),
+        cycle_time_seconds=mit_start["cycle_time_seconds"].astype(np.float64)
+    )
+    geaendert = sorted(mit_start["stunde"].unique())
+    for stunde in geaendert:
+        stunden.setdefault(stunde, {})
+
+    zyklen = mit_start.drop_duplicates("cycle_seq").groupby("stunde")["cycle_time_seconds"].agg(["count", "sum", "min", "max"])
+    for stunde, zeile in zyklen.iterrows():
+        _addiere(stunden[stunde], "cycle_time", zeile["count"], zeile["sum"], zeile["min"], zeile["max"])
+
+    # Je Kennzahl: Werte unter ihrem Namen, Fehler unter der jeweiligen Fehler-Spalte
+    for kennzahl in kennzahlen:
+        ist_kennzahl = (mit_start["event_name"] == kennzahl["event_name"]) & (mit_start["parameter_name"] == kennzahl["parameter_name"])
+        aggregate = set(kennzahl["spalten"].values())
+        if aggregate - {"fehler"}:
+            werte = mit_start[ist_kennzahl & mit_start["value"].notna()].groupby("stunde")["value"].agg(["count", "sum", "min", "max"])
+            for stunde, zeile in werte.iterrows():
+                _addiere(stunden[stunde], kennzahl["name"], zeile["count"], zeile["sum"], zeile["min"], zeile["max"])
+        for spalte in (spalte for spalte, aggregat in kennzahl["spalten"].items() if aggregat == "fehler"):
+            for stunde, anzahl in mit_start[ist_kennzahl & (mit_start["is_error"] == 1)].groupby("stunde").size().items():
+                stunden[stunde][spalte] = stunden[stunde].get(spalte, 0) + int(anzahl)
+    return geaendert
+
+
+def zusammenfassung_zeile(machine_id: str, stunde: str, werte: dict, kennzahlen: list) -> dict:
+    # 0 statt NULL wie in daily_aggregator.main; gerundet wird durch die NUMERIC-Spalten (wie F.round kaufmännisch)
+    def wert(name, aggregat):
+        eintrag = werte.get(name)
+        if not eintrag or eintrag[0] == 0:
+            return 0
+        if aggregat == "anzahl":
+            return eintrag[0]
+        if aggregat == "summe":
+            return eintrag[1]
+        return eintrag[1] / eintrag[0] if aggregat == "avg" else eintrag[2 if aggregat == "min" else 3]
+
+    zeile = {"summary_date": stunde[:10], "hour_of_day": int(stunde[11:13]), "machine_id": machine_id}
+    for kennzahl in kennzahlen:
+        for spalte, aggregat in kennzahl["spalten"].items():
+            zeile[spalte] = werte.get(spalte, 0) if aggregat == "fehler" else wert(kennzahl["name"], aggregat)
+    for spalte, aggregat in ZYKLUS_SPALTEN.items():
+        zeile[spalte] = wert("cycle_time", aggregat)
+    return zeile
+
+
+def verarbeite_maschine(schluessel: tuple, pdf_iter, state, kennzahlen: list):
+    machine_id = schluessel[0]
+    if state.exists:
+        letzter_seq, puffer_text, stunden_text = state.get
+    else:
+        letzter_seq, puffer_text, stunden_text = 0, None, None
+    puffer = puffer_aus_json(puffer_text)
+    stunden = json.loads(stunden_text) if stunden_text else {}
+
+    if state.hasTimedOut:
+        # Wasserstand über dem letzten Event der Maschine: offenen Zyklus abschließen (wie am Dateiende im Batch)
+        fertig, offen = puffer, puffer.iloc[0:0]
+    else:
+        neu = pd.concat(list(pdf_iter), ignore_index=True)
+        neu = neu.assign(rang=neu["event_name"].map(EVENT_RANG).fillna(1)) \
+            .sort_values(["event_timestamp", "rang"], kind="stable") \
+            .drop(columns=["rang", "machine_id"])
+        neu["cycle_seq"] = letzter_seq + (neu["event_name"] == CYCLE_START_EVENT).cumsum().astype(np.int64)
+        alle = pd.concat([puffer, neu], ignore_index=True)
+        letzter_seq = int(alle["cycle_seq"].max()) if not alle.empty else letzter_seq
+        # Der jüngste Zyklus ist erst mit dem nächsten Cycle_Start abgeschlossen
+        ist_offen = (alle["cycle_seq"] == letzter_seq) & (letzter_seq > 0)
+        fertig, offen = alle[~ist_offen], alle[ist_offen]
+
+    ausgabe = []
+    if not fertig.empty:
+        fertig = mit_zyklus_grenzen(fertig)
+        geaendert = aktualisiere_stunden(stunden, fertig, kennzahlen)
+        ausgabe.append(pd.DataFrame({
+            "art": "event",
+            "event_timestamp": fertig["event_timestamp"].values,
+            "machine_id": machine_id,
+            "event_name": fertig["event_name"].values,
+            "parameter_name": fertig["parameter_name"].values,
+            "value": fertig["value"].values,
+            "is_error": pd.array(fertig["is_error"].values, dtype="Int32"),
+            "cycle_seq": pd.array(fertig["cycle_seq"].values, dtype="Int64"),
+            "cycle_time_seconds": fertig["cycle_time_seconds"].values,
+            "zusammenfassung": None
+        }))
+        if geaendert:
+            ausgabe.append(pd.DataFrame({
+                "art": "stunde",
+                "machine_id": machine_id,
+                "zusammenfassung": [json.dumps(zusammenfassung_zeile(machine_id, stunde, stunden[stunde], kennzahlen)) for stunde in geaendert]
+            }))
+
+    # Stunden vor dem Wasserstand sind abgeschlossen (spätere Events werden verworfen), außer der offene Zyklus startete darin
+    wasserstand = pd.Timestamp(state.getCurrentWatermarkMs(), unit="ms")
+    offene_stunde = offen["event_timestamp"].min().strftime("%Y-%m-%dT%H") if not offen.empty else None
+    for stunde in list(stunden):
+        if pd.Timestamp(stunde) + pd.Timedelta(hours=1) <= wasserstand and (offene_stunde is None or stunde < offene_stunde):
+            del stunden[stunde]
+
+    state.update((letzter_seq, puffer_als_json(offen), json.dumps(stunden)))
+    if not offen.empty:
+        timeout = offen["event_timestamp"].max()
+    elif stunden:
+        timeout = pd.Timestamp(max(stunden)) + pd.Timedelta(hours=1)
+    else:
+        timeout = None
+    if timeout is not None:
+        state.setTimeoutTimestamp(max(int(timeout.value // 10**6) + 1, state.getCurrentWatermarkMs() + 1))
+
+    if ausgabe:
+        yield pd.concat(ausgabe, ignore_index=True).reindex(columns=AUSGABE_SCHEMA.fieldNames())
+
+
+def lese_stream(spark: SparkSession, quelle: str, args) -> DataFrame:
+    if quelle == "csv":
+        print(f"Lese neue CSV-Dateien aus '{INPUT_VERZEICHNIS}'")
+        rohdaten_df = spark.readStream \
+            .schema(CSV_INPUT_SCHEMA) \
+            .option("header", True) \
+            .option("pathGlobFilter", "*.{csv,csv.gz}") \
+            .option("maxFilesPerTrigger", args.max_dateien) \
+            .csv(INPUT_VERZEICHNIS)
+        return bereinige_csv(rohdaten_df)
+
+    if quelle == "parquet":
+        input_pfad = os.path.join(INPUT_VERZEICHNIS, PARQUET_DATASET)
+        print(f"Lese neue Parquet-Dateien aus '{input_pfad}'")
+        rohdaten_df = spark.readStream \
+            .schema(PARQUET_INPUT_SCHEMA) \
+            .option("maxFilesPerTrigger", args.max_dateien) \
+            .parquet(input_pfad)
+        return bereinige_parquet(rohdaten_df)
+
+    # Socket: Zeilen im CSV-Format der Rohdateien, z. B. "nc -lk 9999 < datei.csv"
+    print(f"Lese CSV-Zeilen von Socket {args.host}:{args.port}")
+    zeilen_df = spark.readStream.format("socket").option("host", args.host).option("port", args.port).load()
+    csv_schema = ", ".join(f"{feld.name} {feld.dataType.simpleString()}" for feld in CSV_INPUT_SCHEMA.fields)
+    rohdaten_df = zeilen_df \
+        .filter(~F.col("value").startswith("timestamp,")) \
+        .select(F.from_csv("value", csv_schema).alias("zeile")) \
+        .select("zeile.*")
+    return bereinige_csv(rohdaten_df)
+
+
+def schreibe_batch(batch_df: DataFrame, batch_id: int, pg_params: dict, db_url: str, db_properties: dict, schreib_konfiguration: tuple,
+                   kennzahlen: list):
+    conn = psycopg2.connect(**pg_params)
+    try:
+        # Nach einem Neustart wird der letzte Batch wiederholt: bereits bestätigte Batches überspringen
+        if batch_id <= letzter_stream_batch(conn, ABFRAGE_NAME):
+            print(f"Batch {batch_id} wurde bereits geschrieben, übersprungen.")
+            return
+
+        batch_df.persist()
+        # Auch wenn ein Schreiben fehlschlägt, den Batch wieder freigeben
+        try:
+            events_df = batch_df \
+                .filter(F.col("art") == "event") \
+                .withColumn("cycle_time_seconds", F.round(F.col("cycle_time_seconds"), 3)) \
+                .select(EVENT_SPALTEN)
+            bereiche = events_df.groupBy("machine_id").agg(F.min("cycle_seq"), F.max("cycle_seq")).collect()
+            if bereiche:
+                entferne_zyklen(conn, PROCESSED_EVENTS_TABLE, [tuple(zeile) for zeile in bereiche])
+                events_schreibmodus, copy_parallelitaet, partition_nach_maschine, aufbewahrung_tage, archiv_pfad = schreib_konfiguration
+                schreibe_events(
+                    events_df, events_schreibmodus, pg_params, copy_parallelitaet,
+                    db_url, db_properties, partition_nach_maschine, aufbewahrung_tage, archiv_pfad
+                )
+                # Der Batch enthält nur abgeschlossene Zyklen
+                schreibe_maschinen_zyklen(
+                    conn, berechne_maschinen_zyklen(events_df, kennzahlen), events_schreibmodus, pg_params, copy_parallelitaet,
+                    db_url, db_properties
+                )
+
+            # Je Maschine und Stunde höchstens eine Zeile pro Batch: der aktuelle Stand aus dem State
+            spalten = summary_spalten(kennzahlen)
+            stunden = [
+                json.loads(zeile["zusammenfassung"])
+                for zeile in batch_df.filter(F.col("art") == "stunde").select("zusammenfassung").collect()
+            ]
+            # Stunden, Verdichtungen und Batch-Fortschritt in einer Transaktion
+            upsert_zeilen(
+                conn, HOURLY_SUMMARY_TABLE, spalten, SUMMARY_SCHLUESSEL,
+                [tuple(zeile[spalte] for spalte in spalten) for zeile in stunden], festschreiben=False
+            )
+            aktualisiere_verdichtungen(conn, kennzahlen, sorted({(zeile["summary_date"], zeile["machine_id"]) for zeile in stunden}),
+                                       festschreiben=False)
+
+            merke_stream_batch(conn, ABFRAGE_NAME, batch_id)
+            setze_verarbeitungsmarker(conn, ABFRAGE_NAME)
+        finally:
+            batch_df.unpersist()
+    finally:
+        conn.close()
+
+
+# Hauptfunktion
+def main(args):
+
+    spark: SparkSession = None
+
+    try:
+        spark = SparkSession.builder \
+            .appName(f"MaschinenEventStreaming_{args.quelle}") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.sql.shuffle.partitions", args.partitionen) \
+            .getOrCreate()
+
+        schwellwerte = lade_schwellwerte()
+        kennzahlen = lade_kennzahlen()
+        db_url, db_properties, pg_params = lade_db_konfiguration()
+        events_schreibmodus, partition_nach_maschine, aufbewahrung_tage, archiv_pfad = lade_schreib_konfiguration()
+        _, feste_parallelitaet, _ = lade_plan_konfiguration()
+        schreib_konfiguration = (
+            events_schreibmodus, feste_parallelitaet or COPY_PARALLELITAET_STANDARD, partition_nach_maschine, aufbewahrung_tage, archiv_pfad
+        )
+        conn = psycopg2.connect(**pg_params)
+        try:
+            ergaenze_summary_spalten(conn, HOURLY_SUMMARY_TABLE, kennzahlen)
+            for tabelle in (TAGES_TABELLE, WOCHEN_TABELLE):
+                ergaenze_summary_spalten(conn, tabelle, kennzahlen, mit_avg=False)
+            ergaenze_zyklen_spalten(conn, kennzahlen)
+        finally:
+            conn.close()
+        # Das Modul wird in den Python-Workern für foreachPartition benötigt
+        spark.sparkContext.addPyFile(bulk_loader.__file__)
+
+        events_df = lese_stream(spark, args.quelle, args)
+        events_mit_fehler_df = finde_fehler_basierend_auf_schwellwerten(events_df, schwellwerte) \
+            .select("event_timestamp", "machine_id", "event_name", "parameter_name", "value", "is_error")
+
+        ergebnis_df = events_mit_fehler_df \
+            .withWatermark("event_timestamp", args.verspaetung) \
+            .groupBy("machine_id") \
+            .applyInPandasWithState(
+                functools.partial(verarbeite_maschine, kennzahlen=kennzahlen), AUSGABE_SCHEMA, STATE_SCHEMA, "append", GroupStateTimeout.EventTimeTimeout
+            )
+
+        abfrage = ergebnis_df.writeStream \
+            .queryName(ABFRAGE_NAME) \
+            .foreachBatch(lambda batch_df, batch_id: schreibe_batch(batch_df, batch_id, pg_params, db_url, db_properties, schreib_konfiguration, kennzahlen)) \
+            .option("checkpointLocation", args.checkpoint) \
+            .trigger(processingTime=args.trigger) \
+            .start()
+        print(f"Streaming-Abfrage '{ABFRAGE_NAME}' gestartet (Trigger {args.trigger}, Checkpoint '{args.checkpoint}').")
+
+        if args.einmalig:
+            abfrage.processAllAvailable()
+            abfrage.stop()
+        else:
+            abfrage.awaitTermination()
+
+    except ValueError as ve:
+        print(f"Konfigurations- oder Daten-Fehler: {ve}")
+        if spark: spark.stop()
+        sys.exit(1)
+    except Exception as e:
+        print(f"Unerwarteter Fehler: {e}")
+        traceback.print_exc()
+        if spark: spark.stop()
+        sys.exit(1)
+
+    finally:
+        if spark and spark.getActiveSession():
+            print("Spark Session wird beendet.")
+            spark.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming-Verarbeitung der Maschinen-Events aus /data/raw bzw. einem Socket.")
+    parser.add_argument("--quelle", choices=QUELLEN, default="parquet",
+                        help=f"parquet: neue Dateien in '{PARQUET_DATASET}' (Standard), csv: neue CSV-Dateien, socket: CSV-Zeilen")
+    parser.add_argument("--host", default="localhost", help="Host der Socket-Quelle")
+    parser.add_argument("--port", type=int, default=9999, help="Port der Socket-Quelle")
+    parser.add_argument("--trigger", default="1 minute", help="Intervall der Micro-Batches")
+    parser.add_argument("--verspaetung", default="10 minutes", help="Erlaubte Verspätung der Events (Event-Time-Wasserstand)")
+    parser.add_argument("--max-dateien", type=int, default=1, help="Neue Dateien je Micro-Batch")
+    parser.add_argument("--partitionen", type=int, default=8,
+                        help="Shuffle-Partitionen des State-Operators (nach dem ersten Start durch den Checkpoint festgelegt)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_VERZEICHNIS, help="Checkpoint-Verzeichnis für Offsets und State")
+    parser.add_argument("--einmalig", action="store_true", help="Alle vorhandenen Daten verarbeiten und beenden")
+    args = parser.parse_args()
+
+    print(f"Starte Streaming-Verarbeitung (Quelle: {args.quelle})")
+    main(args)
@@ -0,0 +1,80 @@
+from kennzahlen import ZYKLUS_SPALTEN
+
+
+# Tages- und Wochen-Verdichtung der Stunden-Zusammenfassung. Nach jedem Lauf werden die betroffenen Tage aus
+# hourly_machine_summary und die betroffenen Wochen aus daily_machine_summary gelöscht und neu berechnet; Tage bzw.
+# Wochen ohne verbliebene Stunden (z. B. nach daily_aggregator.py --ersetzen) entfallen dabei.
+# Mittelwerte liegen nur als Summe und Anzahl vor (Mittelwert = Summe / Anzahl bei der Abfrage), min/max berücksichtigen
+# nur Stunden mit mindestens einem Wert (die Stunden-Zusammenfassung enthält dort 0).
+# available_dates, die Datumsauswahl des Dashboards, wird für die betroffenen Tage mitgeführt.
+
+STUNDEN_TABELLE = "hourly_machine_summary"
+TAGES_TABELLE = "daily_machine_summary"
+WOCHEN_TABELLE = "weekly_machine_summary"
+KALENDER_TABELLE = "available_dates"
+
+
+def verdichtungs_spalten(kennzahlen: list) -> list:
+    # (Spalte, Aggregat, zugehörige anzahl-Spalte) ohne Mittelwerte
+    spalten = []
+    for kennzahl in kennzahlen:
+        anzahl_spalte = next((spalte for spalte, aggregat in kennzahl["spalten"].items() if aggregat == "anzahl"), None)
+        spalten += [(spalte, aggregat, anzahl_spalte) for spalte, aggregat in kennzahl["spalten"].items() if aggregat != "avg"]
+    spalten += [(spalte, aggregat, "cycle_count") for spalte, aggregat in ZYKLUS_SPALTEN.items() if aggregat != "avg"]
+    return spalten
+
+
+def _ausdruck(spalte: str, aggregat: str, anzahl_spalte: str, aus_stunden: bool) -> str:
+    if aggregat in ("min", "max"):
+        wert = f"CASE WHEN {anzahl_spalte} > 0 THEN {spalte} END" if aus_stunden else spalte
+        return f"{aggregat.upper()}({wert})"
+    return f"SUM({spalte})"
+
+
+def _verdichte(cur, ziel: str, zeit_spalte: str, zeit_ausdruck: str, quelle: str, spalten: list, filter_sql: str, parameter: tuple):
+    namen = [spalte for spalte, _, _ in spalten]
+    ausdruecke = [_ausdruck(spalte, aggregat, anzahl_spalte, quelle == STUNDEN_TABELLE) for spalte, aggregat, anzahl_spalte in spalten]
+    cur.execute(f"DELETE FROM {ziel} WHERE ({zeit_spalte}, machine_id) IN ({filter_sql})", parameter)
+    cur.execute(f"""
+        INSERT INTO {ziel} ({zeit_spalte}, machine_id, {', '.join(namen)}, updated_at)
+        SELECT {zeit_ausdruck}, machine_id, {', '.join(ausdruecke)}, now()
+        FROM {quelle}
+        WHERE ({zeit_ausdruck}, machine_id) IN ({filter_sql})
+        GROUP BY 1, 2
+    """, parameter)
+    return cur.rowcount
+
+
+def aktualisiere_verdichtungen(conn, kennzahlen: list, tage: list, festschreiben: bool = True):
+    # tage: (summary_date, machine_id) der in diesem Lauf geschriebenen Stunden; festschreiben=False: in derselben
+    # Transaktion wie das Schreiben der Stunden, der Aufrufer schreibt beides gemeinsam fest
+    if not tage:
+        return
+    spalten = verdichtungs_spalten(kennzahlen)
+    daten = [tag for tag, _ in tage]
+    maschinen = [machine_id for _, machine_id in tage]
+    with conn.cursor() as cur:
+        tages_zeilen = _verdichte(
+            cur, TAGES_TABELLE, "summary_date", "summary_date", STUNDEN_TABELLE, spalten,
+            "SELECT * FROM unnest(%s::date[], %s::varchar[])", (daten, maschinen)
+        )
+        wochen_zeilen = _verdichte(
+            cur, WOCHEN_TABELLE, "week_start", "date_trunc('week', summary_date)::date", TAGES_TABELLE, spalten,
+            "SELECT DISTINCT date_trunc('week', tag)::date, machine_id FROM unnest(%s::date[], %s::varchar[]) AS t(tag, machine_id)",
+            (daten, maschinen)
+        )
+        # Ein Tag bleibt im Kalender, solange irgendeine Maschine an ihm Stunden hat
+        cur.execute(f"""
+            DELETE FROM {KALENDER_TABELLE} k
+            WHERE k.summary_date = ANY(%s::date[])
+              AND NOT EXISTS (SELECT 1 FROM {TAGES_TABELLE} t WHERE t.summary_date = k.summary_date)
+        """, (daten,))
+        cur.execute(f"""
+            INSERT INTO {KALENDER_TABELLE} (summary_date)
+            SELECT DISTINCT summary_date FROM {TAGES_TABELLE} WHERE summary_date = ANY(%s::date[])
+            ON CONFLICT (summary_date) DO NOTHING
+        """, (daten,))
+    if festschreiben:
+        conn.commit()
+    print(f"Verdichtung: {tages_zeilen} Zeilen in '{TAGES_TABELLE}', {wochen_zeilen} Zeilen in '{WOCHEN_TABELLE}' aktualisiert.")
+
@@ -0,0 +1,107 @@
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import FloatType, ShortType
+from bulk_loader import schreibe_per_copy
+from kennzahlen import KENNZAHL_SCHEMA
+
+
+# Faktentabelle machine_cycles: eine Zeile je Zyklus mit Start, Dauer, den Messwerten der Kennzahlen mit "zyklus" in
+# config/kennzahlen.json als eigene Spalten und einer Fehler-Bitmaske. Zyklus-Auswertungen (fehlerhafte Zyklen,
+# langsamste Zyklen, Kraft je Zyklus) lesen damit etwa ein Achtel der Zeilen von processed_machine_events.
+
+ZYKLEN_TABELLE = "machine_cycles"
+CYCLE_START_EVENT = "Cycle_Start" # wie in daily_aggregator.py
+CYCLE_END_EVENT = "Cycle_End"
+
+
+def zyklus_kennzahlen(kennzahlen: list) -> list:
+    return [kennzahl for kennzahl in kennzahlen if kennzahl["zyklus"]]
+
+
+def zyklen_spalten(kennzahlen: list) -> list:
+    return ["machine_id", "cycle_seq", "cycle_start_ts", "cycle_time_seconds"] + \
+        [kennzahl["zyklus"]["spalte"] for kennzahl in zyklus_kennzahlen(kennzahlen)] + ["error_mask", "error_count"]
+
+
+def ergaenze_zyklen_spalten(conn, kennzahlen: list):
+    # Wie bei der Stunden-Zusammenfassung: neue Messwert-Spalten anlegen, bestehende Zyklen bleiben NULL
+    with conn.cursor() as cur:
+        for kennzahl in zyklus_kennzahlen(kennzahlen):
+            cur.execute(f"ALTER TABLE {ZYKLEN_TABELLE} ADD COLUMN IF NOT EXISTS {kennzahl['zyklus']['spalte']} REAL")
+    conn.commit()
+
+
+def berechne_maschinen_zyklen(events_mit_zyklus_df: DataFrame, kennzahlen: list, neu_spalte: str = None) -> DataFrame:
+    # Ein groupBy je (machine_id, cycle_seq) über die Events mit cycle_time_seconds; sind die Events bereits nach
+    # machine_id verteilt (daily_aggregator.py), entsteht kein weiterer Shuffle.
+    # neu_spalte: nur Zyklen mit mindestens einem neuen Event, mitgelesene abgeschlossene Zyklen sind bereits gespeichert.
+    # Zyklen ohne Cycle_Start (vor dem ersten Start bzw. vor dem Kontext-Beginn) entfallen; ohne Cycle_End bleibt die
+    # Dauer NULL, der nächste Lauf überschreibt den Zyklus.
+    kennzahl_df = events_mit_zyklus_df.sparkSession.createDataFrame(
+        [(kennzahl["event_name"], kennzahl["parameter_name"], kennzahl["kennzahl_id"]) for kennzahl in zyklus_kennzahlen(kennzahlen)],
+        KENNZAHL_SCHEMA
+    )
+    ist_start = F.col("event_name") == CYCLE_START_EVENT
+    fehler_bit = F.lit(0)
+    for kennzahl in zyklus_kennzahlen(kennzahlen):
+        fehler_bit = F.when(F.col("kennzahl_id") == kennzahl["kennzahl_id"], F.lit(1 << kennzahl["zyklus"]["fehler_bit"])) \
+            .otherwise(fehler_bit)
+    aggregationen = [
+        F.min(F.when(ist_start, F.col("event_timestamp"))).alias("cycle_start_ts"),
+        F.when(
+            F.max(F.col("event_name") == CYCLE_END_EVENT),
+            F.round(F.max(F.when(ist_start, F.col("cycle_time_seconds"))), 3)
+        ).cast(FloatType()).alias("cycle_time_seconds")
+    ] + [
+        # Ein Messwert je Kennzahl und Zyklus; falls mehrere, deren Mittelwert
+        F.avg(F.when(F.col("kennzahl_id") == kennzahl["kennzahl_id"], F.col("value"))).cast(FloatType()).alias(kennzahl["zyklus"]["spalte"])
+        for kennzahl in zyklus_kennzahlen(kennzahlen)
+    ] + [
+        F.coalesce(F.bit_or(F.when(F.col("is_error") == 1, fehler_bit)), F.lit(0)).cast(ShortType()).alias("error_mask"),
+        F.coalesce(F.sum("is_error"), F.lit(0)).cast(ShortType()).alias("error_count")
+    ]
+    if neu_spalte:
+        aggregationen.append(F.max(F.col(neu_spalte)).alias("_hat_neue_events"))
+
+    zyklen_df = events_mit_zyklus_df \
+        .filter(F.col("cycle_seq") > 0) \
+        .join(F.broadcast(kennzahl_df), on=["event_name", "parameter_name"], how="left") \
+        .groupBy("machine_id", "cycle_seq") \
+        .agg(*aggregationen) \
+        .filter(F.col("cycle_start_ts").isNotNull())
+    if neu_spalte:
+        zyklen_df = zyklen_df.filter(F.col("_hat_neue_events"))
+    return zyklen_df.select(zyklen_spalten(kennzahlen))
+
+
+def entferne_maschinen_zyklen(conn, bereiche: list) -> int:
+    # Vor dem Schreiben: ab dem ersten neu berechneten Zyklus wird alles ersetzt, auch Zyklen eines abgebrochenen
+    # Versuchs bzw. eines ersetzten Maschinentags, die diesmal nicht mehr entstehen
+    geloescht = 0
+    with conn.cursor() as cur:
+        for machine_id, von_seq, _ in bereiche:
+            cur.execute(f"DELETE FROM {ZYKLEN_TABELLE} WHERE machine_id = %s AND cycle_seq >= %s", (machine_id, von_seq))
+            geloescht += cur.rowcount
+    conn.commit()
+    return geloescht
+
+
+def schreibe_maschinen_zyklen(conn, zyklen_df: DataFrame, schreibmodus: str, pg_params: dict, copy_parallelitaet: int,
+                              db_url: str, db_properties: dict) -> int:
+    # Etwa ein Achtel der Events: gecacht, damit Bereiche und Schreiben die Aggregation nur einmal berechnen
+    zyklen_df = zyklen_df.persist()
+    try:
+        bereiche = zyklen_df.groupBy("machine_id").agg(F.min("cycle_seq"), F.max("cycle_seq")).collect()
+        if not bereiche:
+            return 0
+        ersetzt = entferne_maschinen_zyklen(conn, [tuple(zeile) for zeile in bereiche])
+        if ersetzt:
+            print(f"{ersetzt} bereits gespeicherte Zyklen in '{ZYKLEN_TABELLE}' werden ersetzt.")
+        if schreibmodus == "copy":
+            return schreibe_per_copy(zyklen_df, ZYKLEN_TABELLE, pg_params, copy_parallelitaet)
+        zyklen_df.write.jdbc(url=db_url, table=ZYKLEN_TABELLE, mode="append", properties=db_properties)
+        anzahl = zyklen_df.count()
+        print(f"{anzahl} Zyklen per JDBC in '{ZYKLEN_TABELLE}' geschrieben.")
+        return anzahl
+    finally:
+        zyklen_df.unpersist()
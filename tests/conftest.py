@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+# Die Module liegen wie im Container flach in src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+KONFIG_PFAD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config")
+
+
+@pytest.fixture(scope="session")
+def spark():
+    from pyspark.sql import SparkSession
+    spark = SparkSession.builder \
+        .master("local[2]") \
+        .appName("tests") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .config("spark.sql.shuffle.partitions", "4") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+    yield spark
+    spark.stop()
@@ -0,0 +1,82 @@
+import os
+import datetime
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, StringType, TimestampType, FloatType, IntegerType, LongType
+from conftest import KONFIG_PFAD
+from daily_aggregator import nummeriere_zyklen, berechne_zyklus_grenzen
+from kennzahlen import SUMMARY_SCHLUESSEL, lade_kennzahlen, berechne_stunden_zusammenfassung
+from processing_state import kontext_beginn
+
+
+# Ein Tag in zwei Dateien wie in daily_aggregator.main (Wasserstand, Kontext ab kontext_beginn, Nummerierung ab dem
+# letzten cycle_seq) muss dieselbe Stunden-Zusammenfassung ergeben wie ein Lauf über beide Dateien.
+
+MASCHINE = "DieBonder_01"
+EVENT_SCHEMA = StructType([
+    StructField("event_timestamp", TimestampType(), False), StructField("machine_id", StringType(), False),
+    StructField("event_name", StringType(), False), StructField("parameter_name", StringType(), False),
+    StructField("value", FloatType(), True), StructField("is_error", IntegerType(), False),
+    StructField("last_cycle_seq", LongType(), True), StructField("cycle_seq", LongType(), True)
+])
+
+
+def _ts(stunde: int, minute: int) -> datetime.datetime:
+    return datetime.datetime(2024, 10, 16, stunde, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=minute)
+
+
+def _zyklus(start: tuple, ende: tuple, kraft: float) -> list:
+    return [
+        (_ts(*start), "Cycle_Start", "", None),
+        (_ts(start[0], start[1] + 5), "Pick_Check", "PP_Force", kraft),
+        (_ts(*ende), "Cycle_End", "", None),
+    ]
+
+
+# Zyklus 1 läuft mit seinem Messwert über die Stundengrenze 11:00, Zyklus 3 zusätzlich über das Dateiende
+DATEI_1 = _zyklus((10, 58), (11, 5), 100.0) + _zyklus((11, 10), (11, 20), 110.0) + _zyklus((11, 50), (12, 5), 120.0)[:2]
+DATEI_2 = _zyklus((11, 50), (12, 5), 120.0)[2:] + _zyklus((12, 10), (12, 20), 130.0)
+
+
+def _verarbeite(spark, events: list, kennzahlen: list, stand: dict = None, kontext_df=None):
+    letzter_zyklus = stand["last_cycle_seq"] if stand else None
+    events_df = spark.createDataFrame(
+        [(ts, MASCHINE, name, parameter, wert, 0, letzter_zyklus, None) for ts, name, parameter, wert in events], EVENT_SCHEMA
+    ).withColumn("ist_neu", F.lit(True))
+    if kontext_df is not None:
+        events_df = events_df.unionByName(kontext_df, allowMissingColumns=True)
+    nummeriert_df = nummeriere_zyklen(events_df.repartition("machine_id"), "last_cycle_seq", "ist_neu").drop("last_cycle_seq")
+    verarbeitet_df, _ = berechne_zyklus_grenzen(nummeriert_df)
+    return verarbeitet_df, berechne_stunden_zusammenfassung(verarbeitet_df, kennzahlen)
+
+
+def _je_stunde(summary_df) -> dict:
+    return {tuple(zeile[spalte] for spalte in SUMMARY_SCHLUESSEL): zeile.asDict() for zeile in summary_df.collect()}
+
+
+def test_zyklus_ueber_stunden_und_dateigrenze(spark):
+    kennzahlen = lade_kennzahlen(os.path.join(KONFIG_PFAD, "kennzahlen.json"))
+    _, gesamt_df = _verarbeite(spark, DATEI_1 + DATEI_2, kennzahlen)
+
+    datei_1_df, summary_1_df = _verarbeite(spark, DATEI_1, kennzahlen)
+    # Stand nach Datei 1: Zyklus 3 ist noch offen
+    stand = {
+        "last_event_timestamp": _ts(11, 55),
+        "last_cycle_seq": datei_1_df.agg(F.max("cycle_seq")).first()[0],
+        "open_cycle_start_ts": _ts(11, 50),
+    }
+    kontext_df = datei_1_df \
+        .filter(F.col("event_timestamp") >= F.lit(kontext_beginn(stand))) \
+        .select("event_timestamp", "machine_id", "event_name", "parameter_name", "value", "is_error", "cycle_seq",
+                F.lit(False).alias("ist_neu"))
+    datei_2_df, summary_2_df = _verarbeite(spark, DATEI_2, kennzahlen, stand, kontext_df)
+
+    # Der mitgelesene Rest von Zyklus 1 (Messwert 11:03, Cycle_End 11:05) hat keinen Start und zählt nicht zur Stunde 11
+    ohne_start = datei_2_df.filter(F.col("cycle_start_ts").isNull() & (F.col("cycle_seq") > 0)).orderBy("event_timestamp").collect()
+    assert [zeile["event_name"] for zeile in ohne_start] == ["Pick_Check", "Cycle_End"]
+
+    # Die zweite Datei ersetzt die Stunden ab dem Kontext-Beginn (upsert)
+    zusammen = {**_je_stunde(summary_1_df), **_je_stunde(summary_2_df)}
+    gesamt = _je_stunde(gesamt_df)
+    assert zusammen == gesamt
+    assert [gesamt[schluessel]["cycle_count"] for schluessel in sorted(gesamt)] == [1, 2, 1]
+    assert [gesamt[schluessel]["pick_force_count"] for schluessel in sorted(gesamt)] == [1, 2, 1]
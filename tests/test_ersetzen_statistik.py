@@ -0,0 +1,93 @@
+import random
+import datetime
+import pytest
+from pyspark.sql.types import StructType, StructField, StringType, TimestampType, FloatType, BooleanType
+import anomalie
+import bulk_loader
+from anomalie import STATISTIK_SCHLUESSEL, bewerte_anomalien, neue_statistik, schreibe_statistik_fort
+
+
+# --ersetzen auf bereits verarbeitete Events wie in daily_aggregator.main: der EWMA-Zustand wird auf den Stand vor dem
+# ersten ersetzten Event zurückgesetzt (statistik_vor: letzter Schnappschuss davor plus die gespeicherten Messwerte bis
+# dorthin) und die Eingabe erneut bewertet. Bei unveränderten Rohdaten bleibt machine_parameter_statistics unverändert.
+
+MASCHINE = "DieBonder_01"
+ALPHA = 0.01
+MIN_ANZAHL = 20
+EVENT_SCHEMA = StructType([
+    StructField("event_timestamp", TimestampType(), False), StructField("machine_id", StringType(), False),
+    StructField("event_name", StringType(), False), StructField("parameter_name", StringType(), False),
+    StructField("value", FloatType(), True), StructField("ist_neu", BooleanType(), False)
+])
+
+
+def _events(beginn: datetime.datetime, zyklen: int, seed: int) -> list:
+    rng = random.Random(seed)
+    zeilen = []
+    for zyklus in range(zyklen):
+        ts = beginn + datetime.timedelta(seconds=5 * zyklus)
+        zeilen.append((ts, "Cycle_Start", "", None))
+        zeilen.append((ts + datetime.timedelta(seconds=1), "Pick_Check", "PP_Force", round(rng.gauss(100, 5), 2)))
+        zeilen.append((ts + datetime.timedelta(seconds=2), "Place_Check", "PP_Force", round(rng.gauss(50, 2), 2)))
+    return zeilen
+
+
+BEGINN = datetime.datetime(2024, 10, 16, 8, tzinfo=datetime.timezone.utc)
+DATEI_1 = _events(BEGINN, 200, seed=1)
+DATEI_2 = _events(BEGINN + datetime.timedelta(hours=1), 200, seed=2)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def module_in_workern(spark):
+    # Wie in daily_aggregator.main: applyInPandas braucht anomalie.py (und dessen Import bulk_loader.py) in den Workern
+    spark.sparkContext.addPyFile(bulk_loader.__file__)
+    spark.sparkContext.addPyFile(anomalie.__file__)
+
+
+def _bewerte(spark, events: list, statistik: dict) -> list:
+    events_df = spark.createDataFrame([(ts, MASCHINE, name, parameter, wert, True) for ts, name, parameter, wert in events],
+                                      EVENT_SCHEMA)
+    return neue_statistik(bewerte_anomalien(events_df.repartition(3), statistik, ALPHA, MIN_ANZAHL))
+
+
+def _speichere(tabelle: dict, historie: dict, zeilen: list):
+    # speichere_statistik: aktueller Zustand je Schlüssel und Schnappschuss zum letzten bewerteten Messwert
+    for zeile in zeilen:
+        schluessel, zustand = tuple(zeile[:len(STATISTIK_SCHLUESSEL)]), tuple(zeile[len(STATISTIK_SCHLUESSEL):-1])
+        tabelle[schluessel] = zustand
+        historie[(schluessel, datetime.datetime.fromisoformat(zeile[-1]))] = zustand
+
+
+def _statistik_vor(historie: dict, gespeichert: list, ab: datetime.datetime) -> dict:
+    # statistik_vor ohne Datenbank: Schnappschuss vor ab, dann die gespeicherten Messwerte danach bis vor ab
+    schnappschuesse = {}
+    for (schluessel, zeitpunkt), zustand in sorted(historie.items()):
+        if zeitpunkt < ab:
+            schnappschuesse[schluessel] = (zeitpunkt, zustand)
+    messwerte = [
+        ((MASCHINE, name, parameter), wert) for ts, name, parameter, wert in sorted(gespeichert, key=lambda event: event[0])
+        if wert is not None and ts < ab
+        and ((MASCHINE, name, parameter) not in schnappschuesse or ts > schnappschuesse[(MASCHINE, name, parameter)][0])
+    ]
+    return schreibe_statistik_fort({schluessel: zustand for schluessel, (_, zustand) in schnappschuesse.items()}, messwerte, ALPHA)
+
+
+@pytest.mark.parametrize("ersatz_ab_minute", [0, 8])
+def test_ersetzen_zaehlt_messwerte_nicht_doppelt(spark, ersatz_ab_minute):
+    tabelle, historie = {}, {}
+    _speichere(tabelle, historie, _bewerte(spark, DATEI_1, {}))
+    _speichere(tabelle, historie, _bewerte(spark, DATEI_2, dict(tabelle)))
+    erwartet = dict(tabelle)
+    assert erwartet[(MASCHINE, "Pick_Check", "PP_Force")][2] == 400
+
+    # Erneut eingelesen ab Beginn bzw. Mitte der zweiten Datei, mit unveränderten Rohdaten
+    ab = BEGINN + datetime.timedelta(hours=1, minutes=ersatz_ab_minute)
+    eingabe = [event for event in DATEI_2 if event[0] >= ab]
+    assert eingabe
+    statistik = _statistik_vor(historie, DATEI_1 + DATEI_2, ab)
+    # setze_statistik_zurueck, dann speichere_statistik
+    historie = {(schluessel, zeitpunkt): zustand for (schluessel, zeitpunkt), zustand in historie.items() if zeitpunkt < ab}
+    tabelle = dict(statistik)
+    _speichere(tabelle, historie, _bewerte(spark, eingabe, statistik))
+
+    assert tabelle == erwartet
@@ -0,0 +1,67 @@
+import random
+import datetime
+import pytest
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, StringType, TimestampType, FloatType
+from daily_aggregator import nummeriere_zyklen, berechne_zyklen
+
+
+# cycle_seq darf nicht von Lesereihenfolge und Partitionierung abhängen: gleiche Zeitstempel (die beiden
+# Pick_Check-Zeilen, Cycle_End und folgender Cycle_Start) werden nur über den Inhalt der Events geordnet.
+
+EVENT_SCHEMA = StructType([
+    StructField("event_timestamp", TimestampType(), False), StructField("machine_id", StringType(), False),
+    StructField("event_name", StringType(), False), StructField("parameter_name", StringType(), False),
+    StructField("value", FloatType(), True)
+])
+SPALTEN = ["machine_id", "event_timestamp", "event_name", "parameter_name", "value", "cycle_seq"]
+
+
+def _events(maschinen: list, zyklen: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    zeilen = []
+    for machine_id in maschinen:
+        ts = datetime.datetime(2024, 10, 16, tzinfo=datetime.timezone.utc)
+        for _ in range(zyklen):
+            zeilen.append((ts, machine_id, "Cycle_Start", "", None))
+            pick = ts + datetime.timedelta(milliseconds=rng.randint(50, 150))
+            # Zwei Messwerte mit gleichem Zeitstempel
+            zeilen.append((pick, machine_id, "Pick_Check", "PP_VacuumUnits", round(rng.uniform(60, 80), 2)))
+            zeilen.append((pick, machine_id, "Pick_Check", "PP_Force", round(rng.uniform(80, 120), 2)))
+            ts = pick + datetime.timedelta(milliseconds=rng.randint(100, 400))
+            # Cycle_End teils zeitgleich mit dem nächsten Cycle_Start
+            zeilen.append((ts, machine_id, "Cycle_End", "", None))
+            if rng.random() < 0.5:
+                ts += datetime.timedelta(milliseconds=rng.randint(1, 50))
+    rng.shuffle(zeilen)
+    return zeilen
+
+
+@pytest.fixture(scope="module")
+def events_df(spark):
+    return spark.createDataFrame(_events(["DieBonder_01", "DieBonder_02"], 300), EVENT_SCHEMA).cache()
+
+
+def _abweichungen(referenz_df, vergleich_df) -> int:
+    return referenz_df.exceptAll(vergleich_df).count() + vergleich_df.exceptAll(referenz_df).count()
+
+
+@pytest.mark.parametrize("partitionen", [3, 8, 17])
+def test_cycle_seq_unabhaengig_von_partitionierung(events_df, partitionen):
+    referenz_df = nummeriere_zyklen(events_df.repartition(1)).select(SPALTEN)
+    zufaellig_df = nummeriere_zyklen(events_df.repartition(partitionen, F.rand(partitionen))).select(SPALTEN)
+    assert _abweichungen(referenz_df, zufaellig_df) == 0
+
+
+def test_zeitgleiche_events_im_selben_zyklus(events_df):
+    zyklen_df, _ = berechne_zyklen(events_df.repartition(5, F.rand(1)))
+    # Beide Pick_Check-Zeilen eines Zeitstempels im selben Zyklus, ein Cycle_Start und ein Cycle_End je Zyklus
+    pick_df = zyklen_df.filter(F.col("event_name") == "Pick_Check") \
+        .groupBy("machine_id", "event_timestamp").agg(F.countDistinct("cycle_seq").alias("zyklen"))
+    assert pick_df.filter(F.col("zyklen") != 1).count() == 0
+    je_zyklus = zyklen_df.groupBy("machine_id", "cycle_seq").agg(
+        F.sum((F.col("event_name") == "Cycle_Start").cast("int")).alias("starts"),
+        F.sum((F.col("event_name") == "Cycle_End").cast("int")).alias("enden")
+    ).collect()
+    assert len(je_zyklus) == 600
+    assert all(zeile["starts"] == 1 and zeile["enden"] == 1 for zeile in je_zyklus)